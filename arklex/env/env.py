@@ -1,5 +1,9 @@
 import os
+import json
+import asyncio
+import hashlib
 import logging
+import threading
 import uuid
 import importlib
 from typing import Optional
@@ -14,6 +18,9 @@ from arklex.orchestrator.NLU.nlu import SlotFilling
 
 logger = logging.getLogger(__name__)
 
+_envs = {}
+_envs_lock = threading.Lock()
+
 
 class BaseResourceInitializer:
     @staticmethod
@@ -41,9 +48,12 @@ class DefaulResourceInitializer(BaseResourceInitializer):
             except Exception as e:
                 logger.error(f"Tool {name} is not registered, error: {e}")
                 continue
+            # instantiate once to read the metadata, execute still creates a fresh Tool per call
+            tool_instance = func()
             tool_registry[tool_id] = {
-                "name": func().name,
-                "description": func().description,
+                "name": tool_instance.name,
+                "description": tool_instance.description,
+                "info": tool_instance.info,
                 "execute": func,
                 "fixed_args": tool.get("fixed_args", {}),
             }
@@ -67,7 +77,8 @@ class DefaulResourceInitializer(BaseResourceInitializer):
             worker_registry[worker_id] = {
                 "name": name,
                 "description": func.description,
-                "execute": partial(func, **worker.get("fixed_args", {}))
+                "execute": partial(func, **worker.get("fixed_args", {})),
+                "reusable": getattr(func, "reusable", False),
             }
         return worker_registry
 
@@ -80,6 +91,9 @@ class Env():
         self.name2id = {resource["name"]: id for id, resource in {**self.tools, **self.workers}.items()}
         self.id2name = {id: resource["name"] for id, resource in {**self.tools, **self.workers}.items()}
         self.slotfillapi = self.initialize_slotfillapi(slotsfillapi)
+        # initialized instances of the reusable workers, with their compiled graphs
+        self.worker_pool = {}
+        self._worker_pool_lock = threading.Lock()
         self.planner = FunctionCallingPlanner(
             tools_map=self.tools,
             name2id=self.name2id
@@ -88,46 +102,110 @@ class Env():
     def initialize_slotfillapi(self, slotsfillapi):
         return SlotFilling(slotsfillapi)
 
+    def _init_tool(self, id: str) -> Tool:
+        logger.info(f"{self.tools[id]['name']} tool selected")
+        tool: Tool = self.tools[id]["execute"]()
+        # slotfilling is in the basetoool class
+        tool.init_slotfilling(self.slotfillapi)
+        return tool
+
+    def _create_worker(self, id: str) -> BaseWorker:
+        worker: BaseWorker = self.workers[id]["execute"]()
+        # If the worker need to do the slotfilling, then it should have this method
+        if hasattr(worker, "init_slotfilling"):
+            worker.init_slotfilling(self.slotfillapi)
+        return worker
+
+    def _init_worker(self, id: str) -> BaseWorker:
+        logger.info(f"{self.workers[id]['name']} worker selected")
+        if not self.workers[id].get("reusable", False):
+            return self._create_worker(id)
+        worker = self.worker_pool.get(id)
+        if worker is None:
+            with self._worker_pool_lock:
+                worker = self.worker_pool.get(id)
+                if worker is None:
+                    worker = self._create_worker(id)
+                    worker.get_graph()
+                    self.worker_pool[id] = worker
+        return worker
+
+    def _update_tool_params(self, response_state: MessageState, params: Params):
+        params.memory.function_calling_trajectory = response_state.function_calling_trajectory
+        params.taskgraph.dialog_states = response_state.slots
+        params.taskgraph.node_status[params.taskgraph.curr_node] = response_state.status
+        return params
+
+    def _update_worker_params(self, id: str, response_state: MessageState, params: Params):
+        call_id = str(uuid.uuid4())
+        params.memory.function_calling_trajectory.append({
+            'content': None, 
+            'role': 'assistant', 
+            'tool_calls': [{'function': {'arguments': "{}", 'name': self.id2name[id]}, 'id': call_id, 'type': 'function'}], 
+            'function_call': None
+        })
+        params.memory.function_calling_trajectory.append({
+                    "role": "tool",
+                    "tool_call_id": call_id,
+                    "name": self.id2name[id],
+                    "content": response_state.response if response_state.response else response_state.message_flow,
+        })
+        params.taskgraph.node_status[params.taskgraph.curr_node] = response_state.status
+        return params
+
     def step(self, 
              id: str, 
              message_state: MessageState, 
              params: Params):
         if id in self.tools:
-            logger.info(f"{self.tools[id]['name']} tool selected")
-            tool: Tool = self.tools[id]["execute"]()
-            # slotfilling is in the basetoool class
-            tool.init_slotfilling(self.slotfillapi)
+            tool = self._init_tool(id)
             response_state = tool.execute(message_state, **self.tools[id]["fixed_args"])
-            params.memory.function_calling_trajectory = response_state.function_calling_trajectory
-            params.taskgraph.dialog_states = response_state.slots
-            params.taskgraph.node_status[params.taskgraph.curr_node] = response_state.status
-
-                
+            params = self._update_tool_params(response_state, params)
         elif id in self.workers:
-            logger.info(f"{self.workers[id]['name']} worker selected")
-            worker: BaseWorker = self.workers[id]["execute"]()
-            # If the worker need to do the slotfilling, then it should have this method
-            if hasattr(worker, "init_slotfilling"):
-                worker.init_slotfilling(self.slotfillapi)
+            worker = self._init_worker(id)
             response_state = worker.execute(message_state)
-            call_id = str(uuid.uuid4())
-            params.memory.function_calling_trajectory.append({
-                'content': None, 
-                'role': 'assistant', 
-                'tool_calls': [{'function': {'arguments': "{}", 'name': self.id2name[id]}, 'id': call_id, 'type': 'function'}], 
-                'function_call': None
-            })
-            params.memory.function_calling_trajectory.append({
-                        "role": "tool",
-                        "tool_call_id": call_id,
-                        "name": self.id2name[id],
-                        "content": response_state.response if response_state.response else response_state.message_flow,
-            })
-            params.taskgraph.node_status[params.taskgraph.curr_node] = response_state.status
+            params = self._update_worker_params(id, response_state, params)
         else:
             logger.info("planner selected")
             action, response_state, msg_history = self.planner.execute(message_state, params.memory.function_calling_trajectory)
         
+        logger.info(f"Response state from {id}: {response_state}")
+        return response_state, params
+
+    async def astep(self, 
+                    id: str, 
+                    message_state: MessageState, 
+                    params: Params):
+        if id in self.tools:
+            tool = self._init_tool(id)
+            response_state = await tool.aexecute(message_state, **self.tools[id]["fixed_args"])
+            params = self._update_tool_params(response_state, params)
+        elif id in self.workers:
+            worker = self._init_worker(id)
+            response_state = await worker.aexecute(message_state)
+            params = self._update_worker_params(id, response_state, params)
+        else:
+            logger.info("planner selected")
+            # the planner loop is synchronous, run it in a worker thread
+            action, response_state, msg_history = await asyncio.to_thread(
+                self.planner.execute, message_state, params.memory.function_calling_trajectory
+            )
         
         logger.info(f"Response state from {id}: {response_state}")
         return response_state, params
+
+
+def get_env(tools, workers, slotsfillapi = "") -> Env:
+    """Return the process-wide Env for a (tools, workers, slotsfillapi) spec.
+
+    Envs keep no per-request state, so one instance per spec is shared and the resources are only
+    imported and registered the first time the spec is seen. The key is a hash of the spec's content.
+    """
+    spec = json.dumps({"tools": tools, "workers": workers, "slotsfillapi": slotsfillapi}, sort_keys=True, default=str)
+    key = hashlib.sha256(spec.encode("utf-8")).hexdigest()
+    with _envs_lock:
+        env = _envs.get(key)
+        if env is None:
+            env = Env(tools=tools, workers=workers, slotsfillapi=slotsfillapi)
+            _envs[key] = env
+    return env
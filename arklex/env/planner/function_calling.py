@@ -6,14 +6,13 @@ from pydantic import BaseModel
 import traceback
 
 from langchain.schema import AIMessage
-from langchain_openai import ChatOpenAI
 
 from litellm import completion
 import litellm
 
 from arklex.utils.graph_state import MessageState
 from arklex.utils.model_config import MODEL
-from arklex.utils.model_provider_config import PROVIDER_MAP
+from arklex.utils.model_provider_config import get_llm
 from arklex.orchestrator.prompts import RESPOND_ACTION_NAME
 
 
@@ -37,7 +36,8 @@ class FunctionCallingPlanner:
         name2id: Dict[str, int]):
         super().__init__()
         self.tools_map = tools_map
-        self.tools_info = [tool["execute"]().info for tool in self.tools_map.values()]
+        # the default resource initializer records the tool info at registration, other initializers may not
+        self.tools_info = [tool["info"] if "info" in tool else tool["execute"]().info for tool in self.tools_map.values()]
         self.name2id = name2id
 
     def message_to_actions(
@@ -69,10 +69,7 @@ class FunctionCallingPlanner:
             logger.info(f"tools_info in function calling: {self.tools_info}")
             litellm.modify_params = True
             if not self.tools_info:
-                llm = PROVIDER_MAP.get(MODEL['llm_provider'], ChatOpenAI)(
-                    model=MODEL["model_type_or_path"],
-                    temperature = 0.0
-                )
+                llm = get_llm(temperature=0.0)
                 res = llm.invoke(messages)
                 next_message = aimessage_to_dict(res)             
             else:
@@ -112,6 +112,23 @@ The response must be the name of one of the actions ({actions_name}).
 "database_slot_prompt": """The user has provided a value for the slot {slot}. The value is {value}. 
 If the provided value matches any of the following values: {value_list} (they may not be exactly the same and you can reformulate the value), please provide the reformulated value. Otherwise, respond None. 
 Your response should only be the reformulated value or None.
+""",
+
+"database_slots_prompt": """The user has provided values for the following slots. Each slot lists the provided value and the values found in the database:
+{slots_info}
+For each slot, if the provided value matches one of its database values (they may not be exactly the same, e.g. different spelling or format), choose that database value. Otherwise choose null.
+Your response should only be a JSON object mapping each slot name to the chosen database value or null.
+""",
+
+
+### ================================== Memory Prompts ================================== ###
+"summarize_memory_prompt": """Summarize the conversation between the user and the assistant so that the assistant can continue it without the original messages.
+Keep the user's goals, the information the user provided (names, dates, numbers, choices), the results of the actions taken and any open question. Leave out greetings and small talk. Answer with the summary only, in a few sentences.
+Summary of the earlier conversation:
+{summary}
+Conversation to add to the summary:
+{formatted_chat}
+Summary:
 """
 }
         elif bot_config.language == "CN":
@@ -221,6 +238,23 @@ Answer:
 "database_slot_prompt": """用户为这个slot：{slot}提供了一个值。该值为{value}。
 如果提供的值与以下任何一个值匹配：{value_list}（它们可能不完全相同，你可以重新构造值），请提供重新构造后的值。否则，回复None。
 你的回复应该只是重新构造后的值或None。
+""",
+
+"database_slots_prompt": """用户为以下slot提供了值。每个slot列出了用户提供的值和数据库中的值：
+{slots_info}
+对于每个slot，如果提供的值与其某个数据库值匹配（它们可能不完全相同，例如拼写或格式不同），请选择该数据库值。否则选择null。
+你的回复应该只是一个JSON对象，将每个slot名称映射到所选的数据库值或null。
+""",
+
+
+### ================================== Memory Prompts ================================== ###
+"summarize_memory_prompt": """请总结用户和助手之间的对话，使助手在没有原始消息的情况下也能继续对话。
+保留用户的目标、用户提供的信息（姓名、日期、数字、选择）、已执行操作的结果以及尚未解决的问题。省略问候和闲聊。只回复总结，用几句话即可。
+之前对话的总结：
+{summary}
+需要加入总结的对话：
+{formatted_chat}
+总结：
 """
 }
         else:
@@ -1,24 +1,91 @@
 import os
+import json
+import hashlib
 import argparse
-import pickle
-from pathlib import Path
+from collections import defaultdict
 import logging
 
-from arklex.utils.loader import Loader
+from arklex.utils.loader import Loader, URLObject
+from arklex.utils.document_store import documents_exist, load_documents
+from arklex.env.tools.RAG.retrievers.faiss_retriever import FaissRetrieverExecutor, INDEX_NAME
 
 logger = logging.getLogger(__name__)
 
+MANIFEST_NAME = "manifest.json"
 
-def build_rag(folder_path, docs):
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def source_url(doc: dict) -> str:
+    return doc.get("source").split("#")[0].rstrip("/")
+
+
+def page_source(url: str, sources):
+    """The longest of sources url is under, None if it is under none of them."""
+    return max((source for source in sources if url.startswith(source)), key=len, default=None)
+
+
+def load_manifest(folder_path: str):
+    manifest_path = os.path.join(folder_path, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def build_manifest(docs, crawled_urls, chunked_docs, validators, gone=()) -> dict:
+    """Manifest of the corpus: for each page its source, content hash, HTTP validators and chunk ids, and
+    the urls that could not be crawled or were deleted (gone), so links to them are not followed again."""
+    sources = [source_url(doc) for doc in docs]
+    chunk_ids = defaultdict(list)
+    for chunk in chunked_docs:
+        chunk_ids[chunk.metadata["source"]].append(chunk.metadata.get("chunk_id"))
+    pages = {}
+    for url_obj in crawled_urls:
+        if url_obj.is_error or url_obj.content is None:
+            continue
+        validator = validators.get(url_obj.url) or {}
+        pages[url_obj.url] = {
+            "id": url_obj.id,
+            "source": page_source(url_obj.url, sources),
+            "hash": content_hash(url_obj.content),
+            "etag": validator.get("etag"),
+            "last_modified": validator.get("last_modified"),
+            "chunk_ids": chunk_ids.get(url_obj.url, []),
+        }
+    gone = ({url_obj.url for url_obj in crawled_urls if url_obj.is_error} | set(gone)) - set(pages)
+    return {"sources": sources, "pages": pages, "gone": sorted(url for url in gone if page_source(url, sources))}
+
+
+def save_manifest(folder_path: str, manifest: dict):
+    manifest_path = os.path.join(folder_path, MANIFEST_NAME)
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def build_rag(folder_path, docs, index_path=None, incremental=False):
     if not os.path.exists(folder_path):
         os.makedirs(folder_path)
+    index_path = index_path or os.path.join(folder_path, INDEX_NAME)
+
+    filepath = os.path.join(folder_path, "documents")
+    filepath_chunk = os.path.join(folder_path, "chunked_documents")
+    if incremental:
+        manifest = load_manifest(folder_path)
+        if manifest is not None and documents_exist(filepath) and documents_exist(filepath_chunk) \
+                and FaissRetrieverExecutor.index_exists(index_path):
+            update_rag(folder_path, docs, index_path, manifest)
+            return
+        logger.warning("No manifest of a previous build found, building the whole corpus.")
 
-    filepath = os.path.join(folder_path, "documents.pkl")
     loader = Loader()
     crawled_urls = []
-    if Path(filepath).exists():
-        logger.warning(f"Loading existing documents from {os.path.join(folder_path, 'documents.pkl')}! If you want to recrawl, please delete the file or specify a new --output-dir when initiate Generator.")
-        crawled_urls = pickle.load(open(os.path.join(folder_path, "documents.pkl"), "rb"))
+    if documents_exist(filepath):
+        logger.warning(f"Loading existing documents from {filepath}! If you want to recrawl, please delete the file or specify a new --output-dir when initiate Generator.")
+        crawled_urls = load_documents(filepath)
     else:
         for doc in docs:
             source = doc.get("source")
@@ -29,9 +96,103 @@ def build_rag(folder_path, docs):
 
     logging.info(f"CRAWLED URLS: {[c.url for c in crawled_urls]}")
     chunked_docs = Loader.chunk(crawled_urls)
-    filepath_chunk = os.path.join(folder_path, "chunked_documents.pkl")
     Loader.save(filepath_chunk, chunked_docs)
 
+    # Embed the corpus once here so that serving only needs to load the index
+    FaissRetrieverExecutor.build_index(chunked_docs, index_path)
+    save_manifest(folder_path, build_manifest(docs, crawled_urls, chunked_docs, loader.validators))
+
+
+def discover_new_pages(loader: Loader, docs, pages, seen: set):
+    """Crawl the pages never seen that pages link to, level by level, up to the num of their source.
+
+    Only the links recorded with the pages are followed, so the pages already crawled are not fetched
+    again. A page new to the site is linked from a page whose content changed, i.e. one just re-crawled.
+    """
+    limits = {source_url(doc): doc.get("num") if doc.get("num") else 1 for doc in docs}
+    num_pages = defaultdict(int)
+    for page in pages:
+        num_pages[page_source(page.url, limits)] += 1
+
+    new_crawled = []
+    frontier = pages
+    while frontier:
+        new_urls = []
+        for page in frontier:
+            for link in getattr(page, "links", None) or []:
+                source = page_source(link, limits)
+                if link in seen or source is None or num_pages[source] >= limits[source] \
+                        or not loader._check_url(link, source):
+                    continue
+                seen.add(link)
+                num_pages[source] += 1
+                new_urls.append(link)
+        frontier = loader.to_crawled_obj(new_urls) if new_urls else []
+        new_crawled.extend(frontier)
+    return new_crawled
+
+
+def update_rag(folder_path, docs, index_path, manifest):
+    """Bring a previous build up to date, doing work proportional to the changes.
+
+    Known pages are re-fetched with one conditional request each, and only the pages whose content changed
+    are re-chunked and re-embedded. New pages are found by following the links recorded with the pages,
+    without fetching the unchanged ones again; only the sources added since the last build are explored
+    from scratch. The pages that are gone (404/410) or whose source was removed are deleted from the index;
+    the urls that failed or were deleted are not requested again.
+    """
+    loader = Loader()
+    filepath = os.path.join(folder_path, "documents")
+    filepath_chunk = os.path.join(folder_path, "chunked_documents")
+    known_pages = manifest["pages"]
+    sources = [source_url(doc) for doc in docs]
+
+    removed = {url for url, page in known_pages.items() if page["source"] not in sources}
+    to_refresh = [URLObject(page["id"], url) for url, page in known_pages.items() if url not in removed]
+    refreshed = loader.refresh_urls(to_refresh, known_pages)
+    changed = []
+    gone = set(manifest.get("gone", []))
+    for url, crawled in refreshed.items():
+        if crawled is None:
+            removed.add(url)
+            gone.add(url)
+        elif not crawled.is_error and content_hash(crawled.content) != known_pages[url]["hash"]:
+            changed.append(crawled)
+
+    changed_urls = {c.url for c in changed}
+    # pages that failed last time are not kept, the manifest lists them as gone
+    stored = [c for c in load_documents(filepath) if not c.is_error and c.url not in removed and c.url not in changed_urls]
+    seen = set(known_pages) | {c.url for c in stored} | gone
+    new_crawled = []
+    for doc in docs:
+        if source_url(doc) in manifest["sources"]:
+            continue
+        num_docs = doc.get("num") if doc.get("num") else 1
+        new_urls = [url for url in loader.get_all_urls(doc.get("source"), num_docs) if url not in seen]
+        seen.update(new_urls)
+        new_crawled.extend(loader.to_crawled_obj(new_urls))
+    current = stored + changed + [c for c in new_crawled if not c.is_error]
+    new_crawled.extend(discover_new_pages(loader, docs, current, seen))
+
+    changed.extend(c for c in new_crawled if not c.is_error)
+    logger.info(f"Corpus update: {len(changed)} new or changed pages, {len(removed)} removed, "
+                f"{len(to_refresh) - len(refreshed)} not modified")
+
+    replaced = removed | {c.url for c in changed}
+    crawled_urls = stored + changed + [c for c in new_crawled if c.is_error]
+    Loader.save(filepath, crawled_urls)
+
+    new_chunks = Loader.chunk(changed)
+    chunked_docs = [chunk for chunk in load_documents(filepath_chunk) if chunk.metadata["source"] not in replaced] + new_chunks
+    Loader.save(filepath_chunk, chunked_docs)
+
+    deleted_ids = [chunk_id for url in replaced if url in known_pages for chunk_id in known_pages[url]["chunk_ids"]]
+    if new_chunks or deleted_ids:
+        FaissRetrieverExecutor.update_index(index_path, new_chunks, deleted_ids)
+
+    validators = {url: {"etag": page["etag"], "last_modified": page["last_modified"]} for url, page in known_pages.items()}
+    validators.update(loader.validators)
+    save_manifest(folder_path, build_manifest(docs, crawled_urls, chunked_docs, validators, gone))
 
 
 if __name__ == "__main__":
@@ -40,6 +201,7 @@ if __name__ == "__main__":
     parser.add_argument("--base_url", required=True, type=str, help="base url to crawl")
     parser.add_argument("--folder_path", required=True, type=str, help="location to save the documents")
     parser.add_argument("--max_num", type=int, default=10, help="maximum number of urls to crawl")
+    parser.add_argument("--incremental", action="store_true", help="only process the pages that changed since the last build")
     args = parser.parse_args()
 
-    build_rag(folder_path=args.folder_path, docs=[{"source": args.base_url, "num": args.max_num}])
\ No newline at end of file
+    build_rag(folder_path=args.folder_path, docs=[{"source": args.base_url, "num": args.max_num}], incremental=args.incremental)
@@ -0,0 +1,244 @@
+import os
+import re
+import json
+import atexit
+import hashlib
+import logging
+import threading
+import collections
+from typing import Callable, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, the cache then assumes a single writer
+    fcntl = None
+
+
+logger = logging.getLogger(__name__)
+
+# directory of the on-disk embedding cache, the cache is disabled when it is not set
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "")
+# maximum number of embeddings kept per model, the least recently used ones are overwritten
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 200000))
+# new entries written before the index file is rewritten
+EMBEDDING_CACHE_FLUSH_EVERY = int(os.getenv("EMBEDDING_CACHE_FLUSH_EVERY", 1000))
+
+_INITIAL_ROWS = 1024
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Persistent cache of the embeddings of one model, keyed by the sha256 of the text.
+
+    The vectors are rows of a float32 matrix memory-mapped from <model>.f32, which grows up to capacity
+    rows. <model>.index.json maps each key to its row, in least recently used order; once the cache is
+    full the row of the least recently used key is reused. The digest of each row's text is also kept in
+    <model>.keys and checked on lookup, so an index file older than the matrix never returns a wrong vector.
+
+    Only one process writes the files of a model (the first one to open them, e.g. the parent of a
+    build_rag process pool); the others read the entries present when they opened the cache.
+    """
+    def __init__(self, cache_dir: str, model: str, capacity: int = EMBEDDING_CACHE_SIZE):
+        self.model = model
+        self.capacity = capacity
+        self.pid = os.getpid()
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", model)
+        os.makedirs(cache_dir, exist_ok=True)
+        self.matrix_path = os.path.join(cache_dir, f"{name}.f32")
+        self.index_path = os.path.join(cache_dir, f"{name}.index.json")
+        self.keys_path = os.path.join(cache_dir, f"{name}.keys")
+        self.dim = None
+        self.rows = 0
+        self._matrix = None
+        self._keys = None
+        self._slots = collections.OrderedDict()
+        # rows of the matrix not holding a live entry, reused before the matrix grows or an entry is evicted
+        self._free_rows = []
+        self._unflushed = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writable = self._lock_files(os.path.join(cache_dir, f"{name}.lock"))
+        self._load()
+        if self.writable:
+            atexit.register(self.flush)
+
+    def _lock_files(self, lock_path: str) -> bool:
+        if fcntl is None:
+            return True
+        self._lock_file = open(lock_path, "a")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            logger.info(f"Embedding cache {self.index_path} is written by another process, opening it read only")
+            return False
+
+    def _load(self):
+        if not all(os.path.exists(path) for path in (self.index_path, self.matrix_path, self.keys_path)):
+            return
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+            self.dim = index["dim"]
+            self.rows = index["rows"]
+            self._slots = collections.OrderedDict((key, row) for key, row in index["entries"])
+            mode = "r+" if self.writable else "r"
+            self._matrix = np.memmap(self.matrix_path, dtype=np.float32, mode=mode, shape=(self.rows, self.dim))
+            self._keys = np.memmap(self.keys_path, dtype=np.uint8, mode=mode, shape=(self.rows, 32))
+            used = set(self._slots.values())
+            self._free_rows = [row for row in range(self.rows - 1, -1, -1) if row not in used]
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable embedding cache {self.index_path}: {e}")
+            self.dim, self.rows, self._matrix, self._keys = None, 0, None, None
+            self._slots = collections.OrderedDict()
+            self._free_rows = []
+
+    def _grow(self, rows: int):
+        """Extend the matrix file to rows rows. Must be called with the lock held."""
+        if self._matrix is not None:
+            self._matrix.flush()
+            self._keys.flush()
+        for path, row_size in ((self.matrix_path, self.dim * np.dtype(np.float32).itemsize), (self.keys_path, 32)):
+            with open(path, "ab") as f:
+                f.truncate(rows * row_size)
+        self._matrix = np.memmap(self.matrix_path, dtype=np.float32, mode="r+", shape=(rows, self.dim))
+        self._keys = np.memmap(self.keys_path, dtype=np.uint8, mode="r+", shape=(rows, 32))
+        # popped from the end, so the new rows are handed out in order
+        self._free_rows.extend(range(rows - 1, self.rows - 1, -1))
+        self.rows = rows
+
+    def _free_row(self) -> int:
+        """Row for a new entry. Must be called with the lock held."""
+        if not self._free_rows and self.rows < self.capacity:
+            self._grow(min(max(self.rows * 2, _INITIAL_ROWS), self.capacity))
+        if self._free_rows:
+            return self._free_rows.pop()
+        _, row = self._slots.popitem(last=False)
+        return row
+
+    def get_many(self, texts: List[str]) -> List[Optional[List[float]]]:
+        embeddings = []
+        with self._lock:
+            for text in texts:
+                key = text_key(text)
+                row = self._slots.get(key)
+                if row is not None and self._keys[row].tobytes() != bytes.fromhex(key):
+                    # the row was rewritten after the index was saved, it holds no live entry
+                    del self._slots[key]
+                    self._free_rows.append(row)
+                    row = None
+                if row is None:
+                    self.misses += 1
+                    embeddings.append(None)
+                    continue
+                self.hits += 1
+                self._slots.move_to_end(key)
+                embeddings.append(self._matrix[row].tolist())
+        return embeddings
+
+    def put_many(self, texts: List[str], embeddings: List[List[float]]):
+        if not self.writable or not texts:
+            return
+        with self._lock:
+            if self.dim is None:
+                self.dim = len(embeddings[0])
+            for text, embedding in zip(texts, embeddings):
+                if len(embedding) != self.dim:
+                    continue
+                key = text_key(text)
+                row = self._slots.get(key)
+                if row is None:
+                    row = self._free_row()
+                self._matrix[row] = np.asarray(embedding, dtype=np.float32)
+                self._keys[row] = np.frombuffer(bytes.fromhex(key), dtype=np.uint8)
+                self._slots[key] = row
+                self._slots.move_to_end(key)
+                self._unflushed += 1
+            should_flush = self._unflushed >= EMBEDDING_CACHE_FLUSH_EVERY
+        if should_flush:
+            self.flush()
+
+    def embed(self, texts: List[str], embed_fn: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+        """Embeddings of texts, calling embed_fn once with the texts that are not cached."""
+        embeddings = self.get_many(texts)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            # the same text may appear more than once in a batch, embed it once
+            missing_texts = list(dict.fromkeys(texts[i] for i in missing))
+            new_embeddings = dict(zip(missing_texts, embed_fn(missing_texts)))
+            self.put_many(missing_texts, [new_embeddings[text] for text in missing_texts])
+            for i in missing:
+                embeddings[i] = new_embeddings[texts[i]]
+        return embeddings
+
+    def flush(self):
+        if not self.writable:
+            return
+        with self._lock:
+            if not self._unflushed or self._matrix is None:
+                return
+            self._matrix.flush()
+            self._keys.flush()
+            index = {"model": self.model, "dim": self.dim, "rows": self.rows, "entries": list(self._slots.items())}
+            tmp_path = self.index_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(index, f)
+            os.replace(tmp_path, self.index_path)
+            self._unflushed = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "model": self.model,
+            "size": len(self._slots),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(model: str) -> Optional[EmbeddingCache]:
+    """The process-wide cache of model, None when EMBEDDING_CACHE_DIR is not set."""
+    if not EMBEDDING_CACHE_DIR:
+        return None
+    with _caches_lock:
+        cache = _caches.get(model)
+        # a forked worker process opens its own (read only) view instead of writing through the parent's
+        if cache is None or cache.pid != os.getpid():
+            cache = EmbeddingCache(EMBEDDING_CACHE_DIR, model)
+            _caches[model] = cache
+    return cache
+
+
+def get_cache_stats() -> List[dict]:
+    return [cache.stats() for cache in _caches.values()]
+
+
+class CachedEmbeddings(Embeddings):
+    """langchain Embeddings that look the documents up in the embedding cache of model before embedding them.
+
+    Queries are not cached: they rarely repeat and some models embed them differently from documents.
+    """
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.cache.embed(texts, self.embeddings.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.embeddings.aembed_query(text)
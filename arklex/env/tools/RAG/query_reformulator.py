@@ -0,0 +1,141 @@
+import os
+import re
+import asyncio
+import hashlib
+import logging
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+from langchain.prompts import PromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+
+from arklex.utils.model_provider_config import get_llm
+
+
+logger = logging.getLogger(__name__)
+
+# reformulated queries kept per process, keyed by the prompt and the chat history
+REFORMULATION_CACHE_SIZE = int(os.getenv("REFORMULATION_CACHE_SIZE", 1024))
+# search with the raw user message while the query is reformulated, see QueryReformulator.search
+REFORMULATION_RACE = os.getenv("REFORMULATION_RACE", "false").lower() == "true"
+# minimum confidence (0-100) of the raw query results for them to be used without the reformulation
+RAW_QUERY_CONFIDENCE = float(os.getenv("RAW_QUERY_CONFIDENCE", 70))
+
+_USER_TURN = re.compile(r"^user: ", re.MULTILINE)
+
+_cache = collections.OrderedDict()
+_cache_lock = threading.Lock()
+_race_pool = ThreadPoolExecutor(max_workers=int(os.getenv("REFORMULATION_MAX_WORKERS", 8)), thread_name_prefix="reformulate")
+# reformulations that lost the race keep running to fill the cache
+_background_tasks = set()
+
+
+def last_user_message(chat_history_str: str) -> str:
+    matches = list(_USER_TURN.finditer(chat_history_str))
+    if not matches:
+        return chat_history_str.strip()
+    return chat_history_str[matches[-1].end():].strip()
+
+
+def is_single_user_turn(chat_history_str: str) -> bool:
+    return len(_USER_TURN.findall(chat_history_str)) <= 1
+
+
+class QueryReformulator:
+    """Turns the chat history into a standalone search query with the retrieve_contextualize_q_prompt chain.
+
+    The LLM is skipped when the history has a single user turn (the message already stands alone) and
+    its answers are cached by a hash of the prompt and the history.
+    """
+    def __init__(self, contextualize_prompt: str, llm=None):
+        self.contextualize_prompt = contextualize_prompt
+        self.chain = PromptTemplate.from_template(contextualize_prompt) | (llm or get_llm()) | StrOutputParser()
+
+    def _key(self, chat_history_str: str) -> str:
+        return hashlib.sha256(f"{self.contextualize_prompt}\0{chat_history_str}".encode("utf-8")).hexdigest()
+
+    def _cached(self, chat_history_str: str) -> Optional[str]:
+        """The query when it needs no LLM call, None otherwise."""
+        if is_single_user_turn(chat_history_str):
+            return last_user_message(chat_history_str)
+        key = self._key(chat_history_str)
+        with _cache_lock:
+            query = _cache.get(key)
+            if query is not None:
+                _cache.move_to_end(key)
+        return query
+
+    def _store(self, chat_history_str: str, query: str):
+        if not REFORMULATION_CACHE_SIZE:
+            return
+        with _cache_lock:
+            _cache[self._key(chat_history_str)] = query
+            while len(_cache) > REFORMULATION_CACHE_SIZE:
+                _cache.popitem(last=False)
+
+    def reformulate(self, chat_history_str: str) -> str:
+        query = self._cached(chat_history_str)
+        if query is None:
+            query = self.chain.invoke({"chat_history": chat_history_str})
+            self._store(chat_history_str, query)
+        logger.info(f"Reformulated input for retriever search: {query}")
+        return query
+
+    async def areformulate(self, chat_history_str: str) -> str:
+        query = self._cached(chat_history_str)
+        if query is None:
+            query = await self.chain.ainvoke({"chat_history": chat_history_str})
+            self._store(chat_history_str, query)
+        logger.info(f"Reformulated input for retriever search: {query}")
+        return query
+
+    def search(self, chat_history_str: str, search_fn: Callable[[str], Any],
+               is_confident: Callable[[Any], bool] = None) -> Tuple[str, Any]:
+        """Return (query, search_fn(query)) for the reformulated query.
+
+        With REFORMULATION_RACE and is_confident, the raw last user message is searched while the query is
+        reformulated, and its results are returned if is_confident accepts them before the reformulated
+        search is done.
+        """
+        if self._cached(chat_history_str) is not None or not (REFORMULATION_RACE and is_confident):
+            query = self.reformulate(chat_history_str)
+            return query, search_fn(query)
+
+        raw_query = last_user_message(chat_history_str)
+
+        def reformulated_search():
+            query = self.reformulate(chat_history_str)
+            return query, search_fn(query)
+
+        raw_future = _race_pool.submit(search_fn, raw_query)
+        reformulated_future = _race_pool.submit(reformulated_search)
+        done, _ = wait([raw_future, reformulated_future], return_when=FIRST_COMPLETED)
+        if raw_future in done and not raw_future.exception() and is_confident(raw_future.result()):
+            logger.info(f"Using the results of the raw query: {raw_query}")
+            return raw_query, raw_future.result()
+        return reformulated_future.result()
+
+    async def asearch(self, chat_history_str: str, search_fn: Callable[[str], Awaitable[Any]],
+                      is_confident: Callable[[Any], bool] = None) -> Tuple[str, Any]:
+        """Async version of search, search_fn is a coroutine function."""
+        if self._cached(chat_history_str) is not None or not (REFORMULATION_RACE and is_confident):
+            query = await self.areformulate(chat_history_str)
+            return query, await search_fn(query)
+
+        raw_query = last_user_message(chat_history_str)
+
+        async def reformulated_search():
+            query = await self.areformulate(chat_history_str)
+            return query, await search_fn(query)
+
+        raw_task = asyncio.ensure_future(search_fn(raw_query))
+        reformulated_task = asyncio.ensure_future(reformulated_search())
+        done, _ = await asyncio.wait([raw_task, reformulated_task], return_when=asyncio.FIRST_COMPLETED)
+        if raw_task in done and not raw_task.exception() and is_confident(raw_task.result()):
+            logger.info(f"Using the results of the raw query: {raw_query}")
+            _background_tasks.add(reformulated_task)
+            reformulated_task.add_done_callback(_background_tasks.discard)
+            return raw_query, raw_task.result()
+        return await reformulated_task
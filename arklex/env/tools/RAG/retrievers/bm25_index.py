@@ -0,0 +1,105 @@
+import os
+import re
+import math
+import json
+import logging
+from collections import Counter, defaultdict
+from typing import Dict, List, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+BM25_INDEX_NAME = "bm25.json"
+
+# CJK text has no spaces, its characters are indexed one by one
+_TOKEN_PATTERN = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯]|[^\W぀-ヿ㐀-䶿一-鿿가-힯]+")
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """Inverted index over the chunked documents, scored with Okapi BM25.
+
+    Documents are identified by the ids given to build (the docstore ids of the FAISS index), so lexical
+    and dense results can be fused. Searching only needs local CPU.
+    """
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_ids: List[str] = []
+        self.doc_lens: List[int] = []
+        # term -> [[document position, term frequency], ...]
+        self.postings: Dict[str, List[List[int]]] = {}
+
+    @property
+    def avgdl(self) -> float:
+        return sum(self.doc_lens) / len(self.doc_lens) if self.doc_lens else 0.0
+
+    @classmethod
+    def build(cls, texts: List[str], doc_ids: List[str], **kwargs) -> "BM25Index":
+        index = cls(**kwargs)
+        postings = defaultdict(list)
+        for position, (doc_id, text) in enumerate(zip(doc_ids, texts)):
+            tokens = tokenize(text)
+            index.doc_ids.append(doc_id)
+            index.doc_lens.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                postings[term].append([position, tf])
+        index.postings = dict(postings)
+        logger.info(f"Built BM25 index of {len(index.doc_ids)} documents and {len(index.postings)} terms")
+        return index
+
+    def search(self, query: str, k: int = 4) -> List[Tuple[str, float]]:
+        """(doc_id, score) of the k best documents for query, best first."""
+        num_docs = len(self.doc_ids)
+        avgdl = self.avgdl
+        if not num_docs or not avgdl:
+            return []
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            df = len(postings)
+            idf = math.log(1 + (num_docs - df + 0.5) / (df + 0.5))
+            for position, tf in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lens[position] / avgdl)
+                scores[position] += idf * tf * (self.k1 + 1) / (tf + norm)
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.doc_ids[position], score) for position, score in best]
+
+    def save(self, index_path: str):
+        os.makedirs(index_path, exist_ok=True)
+        with open(os.path.join(index_path, BM25_INDEX_NAME), "w") as f:
+            json.dump({
+                "k1": self.k1,
+                "b": self.b,
+                "doc_ids": self.doc_ids,
+                "doc_lens": self.doc_lens,
+                "postings": self.postings,
+            }, f)
+
+    @classmethod
+    def load(cls, index_path: str) -> "BM25Index":
+        with open(os.path.join(index_path, BM25_INDEX_NAME)) as f:
+            data = json.load(f)
+        index = cls(k1=data["k1"], b=data["b"])
+        index.doc_ids = data["doc_ids"]
+        index.doc_lens = data["doc_lens"]
+        index.postings = data["postings"]
+        return index
+
+    @staticmethod
+    def exists(index_path: str) -> bool:
+        return os.path.exists(os.path.join(index_path, BM25_INDEX_NAME))
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """Fuse rankings of doc ids: each document scores the sum of 1 / (k + rank) over the rankings."""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] += 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
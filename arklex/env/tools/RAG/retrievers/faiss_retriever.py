@@ -1,25 +1,53 @@
+import asyncio
 import os
 import logging
-from typing import List
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import List, Tuple
 import pickle
 
-from langchain.prompts import PromptTemplate
-from langchain_openai import ChatOpenAI
-from langchain_core.output_parsers import StrOutputParser
+import faiss
+import numpy as np
+
 from langchain_core.documents import Document
 from langchain_community.vectorstores.faiss import FAISS
-from langchain_openai import OpenAIEmbeddings
 
 
 from arklex.utils.model_config import MODEL
 from arklex.env.prompts import load_prompts
 from arklex.utils.graph_state import MessageState
-from arklex.utils.model_provider_config import PROVIDER_MAP, PROVIDER_EMBEDDINGS, PROVIDER_EMBEDDING_MODELS
+from arklex.utils.document_store import documents_exist
+from arklex.utils.model_provider_config import get_llm, get_embedding_model, PROVIDER_EMBEDDING_MODELS
 from arklex.env.tools.utils import trace
+from arklex.env.tools.RAG.embedding_cache import CachedEmbeddings, get_embedding_cache
+from arklex.env.tools.RAG.retrievers.bm25_index import BM25Index, reciprocal_rank_fusion
+from arklex.env.tools.RAG.query_reformulator import QueryReformulator, RAW_QUERY_CONFIDENCE
 
 
 logger = logging.getLogger(__name__)
 
+INDEX_NAME = "index"
+
+# "dense" searches the FAISS index, "lexical" the BM25 index only (no embedding call), and "hybrid"
+# fuses both rankings with reciprocal rank fusion
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "dense")
+# seconds the hybrid mode waits for the dense search, query embedding included, before answering
+# from the BM25 results alone; 0 always waits
+DENSE_SEARCH_TIMEOUT = float(os.getenv("DENSE_SEARCH_TIMEOUT", 0))
+RRF_K = int(os.getenv("RRF_K", 60))
+
+_dense_search_pool = ThreadPoolExecutor(max_workers=int(os.getenv("DENSE_SEARCH_MAX_WORKERS", 8)), thread_name_prefix="faiss-dense")
+
+# Process-wide registry of executors keyed by (data directory, index path, embedding model), so each index
+# is loaded once per process. Each key has its own lock, held while its index loads, so loading one does not
+# block the others.
+_executors = {}
+_executor_locks = {}
+_executors_lock = threading.Lock()
+# index paths already reported missing, so a deployment without an index logs the error once, not per turn
+_missing_indexes = set()
+
+
 class RetrieveEngine():
     @staticmethod
     def faiss_retrieve(state: MessageState):
@@ -28,74 +56,294 @@ class RetrieveEngine():
 
         # Search for the relevant documents
         prompts = load_prompts(state.bot_config)
-        docs = FaissRetrieverExecutor.load_docs(database_path=os.environ.get("DATA_DIR"))
-        retrieved_text, retriever_returns = docs.search(user_message.history, prompts["retrieve_contextualize_q_prompt"])
+        try:
+            docs = FaissRetrieverExecutor.load_docs(database_path=os.environ.get("DATA_DIR"))
+        except FileNotFoundError:
+            # reported once by check_index, the turn is answered without documents
+            retrieved_text, retriever_returns = "", []
+        else:
+            retrieved_text, retriever_returns = docs.search(user_message.history, prompts["retrieve_contextualize_q_prompt"])
 
         state.message_flow = retrieved_text
         state = trace(input=retriever_returns, state=state)
         return state
 
+    @staticmethod
+    async def afaiss_retrieve(state: MessageState):
+        # the faiss search is CPU bound and synchronous, keep it off the event loop
+        return await asyncio.to_thread(RetrieveEngine.faiss_retrieve, state)
+
 
 class FaissRetrieverExecutor:
     def __init__(
             self, 
             texts: List[Document], 
             index_path: str,
-            embedding_model_name: str =  PROVIDER_EMBEDDING_MODELS[MODEL['llm_provider']]
+            embedding_model_name: str =  PROVIDER_EMBEDDING_MODELS[MODEL['llm_provider']],
+            retrieval_mode: str = None
         ):
         self.texts = texts
         self.index_path = index_path
         self.embedding_model_name = embedding_model_name
-        self.llm = PROVIDER_MAP.get(MODEL['llm_provider'], ChatOpenAI)(
-            model=MODEL["model_type_or_path"], timeout=30000
-        )
+        self.retrieval_mode = retrieval_mode or RETRIEVAL_MODE
+        self.llm = get_llm()
+        self.bm25 = None
+        # docstore ids of the documents stored without one, see _docstore_id
+        self._ids_by_object = None
+        # the reformulator of each contextualize prompt, built with its chain on the first search
+        self._reformulators = {}
         self.retriever = self._init_retriever()
 
+    @staticmethod
+    def _get_embedding_model(embedding_model_name: str):
+        embedding_model = get_embedding_model(model=embedding_model_name)
+        # rebuilding an index re-embeds the unchanged chunks from the cache
+        cache = get_embedding_cache(embedding_model_name)
+        if cache is not None:
+            embedding_model = CachedEmbeddings(embedding_model, cache)
+        return embedding_model
+
+    @staticmethod
+    def index_exists(index_path: str) -> bool:
+        return os.path.exists(os.path.join(index_path, f"{INDEX_NAME}.faiss")) and \
+            os.path.exists(os.path.join(index_path, f"{INDEX_NAME}.pkl"))
+
+    @staticmethod
+    def build_index(texts: List[Document], index_path: str, embedding_model_name: str = None) -> FAISS:
+        """Embed the chunked documents once and persist the FAISS index under index_path."""
+        embedding_model_name = embedding_model_name or PROVIDER_EMBEDDING_MODELS[MODEL['llm_provider']]
+        embedding_model = FaissRetrieverExecutor._get_embedding_model(embedding_model_name)
+        logger.info(f"Building FAISS index for {len(texts)} documents at {index_path}")
+        # documents chunked by Loader.chunk carry deterministic ids, so they can be replaced incrementally
+        ids = [doc.metadata.get("chunk_id") for doc in texts]
+        docsearch = FAISS.from_documents(texts, embedding_model, ids=ids if texts and all(ids) else None)
+        docsearch.save_local(index_path, index_name=INDEX_NAME)
+        FaissRetrieverExecutor._build_bm25(docsearch).save(index_path)
+        if isinstance(embedding_model, CachedEmbeddings):
+            embedding_model.cache.flush()
+            logger.info(f"Embedding cache: {embedding_model.cache.stats()}")
+        return docsearch
+
+    @staticmethod
+    def update_index(index_path: str, added: List[Document], deleted_ids: List[str], embedding_model_name: str = None) -> FAISS:
+        """Delete the chunks deleted_ids from the persisted index and embed and add the added chunks, by their chunk_id."""
+        embedding_model_name = embedding_model_name or PROVIDER_EMBEDDING_MODELS[MODEL['llm_provider']]
+        embedding_model = FaissRetrieverExecutor._get_embedding_model(embedding_model_name)
+        # loaded in memory, the memory-mapped index used for serving is read only
+        docsearch = FAISS.load_local(index_path, embedding_model, index_name=INDEX_NAME, allow_dangerous_deserialization=True)
+        indexed_ids = set(docsearch.index_to_docstore_id.values())
+        deleted_ids = [doc_id for doc_id in deleted_ids if doc_id in indexed_ids]
+        logger.info(f"Updating FAISS index at {index_path}: -{len(deleted_ids)} +{len(added)} chunks")
+        if deleted_ids:
+            docsearch.delete(deleted_ids)
+        if added:
+            docsearch.add_documents(added, ids=[doc.metadata["chunk_id"] for doc in added])
+        docsearch.save_local(index_path, index_name=INDEX_NAME)
+        FaissRetrieverExecutor._build_bm25(docsearch).save(index_path)
+        if isinstance(embedding_model, CachedEmbeddings):
+            embedding_model.cache.flush()
+        return docsearch
+
+    @staticmethod
+    def _build_bm25(docsearch: FAISS) -> BM25Index:
+        """BM25 index of the documents of docsearch, identified by their docstore ids."""
+        doc_ids = [docsearch.index_to_docstore_id[i] for i in range(docsearch.index.ntotal)]
+        texts = [docsearch.docstore.search(doc_id).page_content for doc_id in doc_ids]
+        return BM25Index.build(texts, doc_ids)
+
+    @staticmethod
+    def _load_index(index_path: str, embedding_model) -> FAISS:
+        """Load a persisted FAISS index, memory-mapping the vectors when the index type supports it."""
+        faiss_file = os.path.join(index_path, f"{INDEX_NAME}.faiss")
+        try:
+            index = faiss.read_index(faiss_file, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError as e:
+            logger.info(f"Memory-mapping is not supported for {faiss_file}, reading it into memory: {e}")
+            index = faiss.read_index(faiss_file)
+        # the docstore is written by FAISS.save_local next to the index
+        with open(os.path.join(index_path, f"{INDEX_NAME}.pkl"), "rb") as fread:
+            docstore, index_to_docstore_id = pickle.load(fread)
+        return FAISS(
+            embedding_function=embedding_model,
+            index=index,
+            docstore=docstore,
+            index_to_docstore_id=index_to_docstore_id,
+        )
+
     def _init_retriever(self, **kwargs):
         # initiate FAISS retriever
-        embedding_model = PROVIDER_EMBEDDINGS.get(MODEL['llm_provider'], OpenAIEmbeddings)(
-            **{ 'model': self.embedding_model_name } if MODEL['llm_provider'] != 'anthropic' else { 'model_name': self.embedding_model_name }
-        )
-        docsearch = FAISS.from_documents(self.texts, embedding_model)
+        embedding_model = self._get_embedding_model(self.embedding_model_name)
+        if self.index_exists(self.index_path):
+            logger.info(f"Loading FAISS index from {self.index_path}")
+            docsearch = self._load_index(self.index_path, embedding_model)
+        elif self.texts:
+            logger.info(f"No FAISS index found at {self.index_path}, building it from the documents")
+            docsearch = self.build_index(self.texts, self.index_path, self.embedding_model_name)
+        else:
+            raise FileNotFoundError(f"No FAISS index found at {self.index_path} and no documents to build it from")
+        if BM25Index.exists(self.index_path):
+            self.bm25 = BM25Index.load(self.index_path)
+        elif self.retrieval_mode != "dense":
+            # index built before the lexical index was added, build it from the docstore
+            self.bm25 = self._build_bm25(docsearch)
+            self.bm25.save(self.index_path)
         retriever = docsearch.as_retriever(**kwargs)
         return retriever     
 
-    def retrieve_w_score(self, query: str):
+    def _dense_search(self, query: str, k: int) -> List[Tuple[str, Document, float]]:
+        """(docstore id, document, score) of the k nearest documents. The search goes through the
+        vectorstore, so its L2 normalization and distance strategy apply in every mode."""
+        vectorstore = self.retriever.vectorstore
+        embedding = vectorstore.embeddings.embed_query(query)
+        docs_and_scores = vectorstore.similarity_search_with_score_by_vector(embedding, k=k)
+        return [(self._docstore_id(doc), doc, float(score)) for doc, score in docs_and_scores]
+
+    def _docstore_id(self, doc: Document) -> str:
+        if getattr(doc, "id", None):
+            return doc.id
+        # documents stored before langchain recorded their id are the objects held by the docstore
+        if self._ids_by_object is None:
+            vectorstore = self.retriever.vectorstore
+            self._ids_by_object = {
+                id(vectorstore.docstore.search(doc_id)): doc_id for doc_id in vectorstore.index_to_docstore_id.values()
+            }
+        return self._ids_by_object.get(id(doc))
+
+    def _relevance(self, score: float) -> float:
+        """Relevance (0-100, higher is better) of a dense search score, by the vectorstore's own
+        conversion for its distance strategy."""
+        relevance = self.retriever.vectorstore._select_relevance_score_fn()(score)
+        return round(float(min(max(relevance, 0.0), 1.0)) * 100, 2)
+
+    def _result(self, doc: Document, raw_score: float, score_type: str, confidence: float = None) -> dict:
+        return {"doc": doc, "raw_score": raw_score, "score_type": score_type, "confidence": confidence}
+
+    def retrieve_w_score(self, query: str) -> List[dict]:
+        """The best k documents for query, best first, as dicts of:
+        - doc: the document
+        - raw_score, score_type: the score that ranked it, the distance or similarity of the vectorstore's
+          distance strategy (dense search), "bm25" (lexical search) or "rrf" (the fused rank of hybrid search)
+        - confidence: the relevance (0-100, higher is better) of its dense score, on the same scale in every
+          mode, None when the document has no dense score (lexical results)
+        The hybrid mode answers with the lexical results when the dense search fails or times out.
+        """
         k_value = 4 if not self.retriever.search_kwargs.get('k') else self.retriever.search_kwargs.get('k')
-        docs_and_scores = self.retriever.vectorstore.similarity_search_with_score(query, k=k_value)
-        return docs_and_scores
+        dense_type = self.retriever.vectorstore.distance_strategy.value.lower()
+        if self.retrieval_mode == "dense" or self.bm25 is None:
+            return [
+                self._result(doc, score, dense_type, self._relevance(score))
+                for _, doc, score in self._dense_search(query, k_value)
+            ]
+        docstore = self.retriever.vectorstore.docstore
+        lexical = self.bm25.search(query, k=k_value)
+        lexical_results = [self._result(docstore.search(doc_id), score, "bm25") for doc_id, score in lexical]
+        if self.retrieval_mode == "lexical":
+            return lexical_results
+        # the dense search needs a remote embedding call, the BM25 results are the answer if it is too slow
+        future = _dense_search_pool.submit(self._dense_search, query, k_value)
+        try:
+            dense = future.result(timeout=DENSE_SEARCH_TIMEOUT or None)
+        except TimeoutError:
+            logger.warning(f"Dense search took more than {DENSE_SEARCH_TIMEOUT}s, answering from the lexical index")
+            return lexical_results
+        except Exception as e:
+            logger.error(f"Dense search failed, answering from the lexical index: {e}")
+            return lexical_results
+        dense_scores = {doc_id: score for doc_id, _, score in dense}
+        fused = reciprocal_rank_fusion([[doc_id for doc_id, _, _ in dense], [doc_id for doc_id, _ in lexical]], k=RRF_K)
+        return [
+            self._result(
+                docstore.search(doc_id), score, "rrf",
+                self._relevance(dense_scores[doc_id]) if doc_id in dense_scores else None,
+            )
+            for doc_id, score in fused[:k_value]
+        ]
+
+    def _reformulator(self, contextualize_prompt: str) -> QueryReformulator:
+        reformulator = self._reformulators.get(contextualize_prompt)
+        if reformulator is None:
+            reformulator = self._reformulators.setdefault(
+                contextualize_prompt, QueryReformulator(contextualize_prompt, self.llm)
+            )
+        return reformulator
+
+    @staticmethod
+    def _is_confident(results: List[dict]) -> bool:
+        """Whether the results of the raw user message are good enough to skip the reformulation. Only the
+        dense confidence counts, the lexical-only results never are."""
+        confidences = [result["confidence"] for result in results if result["confidence"] is not None]
+        return bool(confidences) and max(confidences) >= RAW_QUERY_CONFIDENCE
 
     def search(self, chat_history_str: str, contextualize_prompt: str):
-        contextualize_q_prompt = PromptTemplate.from_template(
-            contextualize_prompt
+        _, results = self._reformulator(contextualize_prompt).search(
+            chat_history_str, self.retrieve_w_score, self._is_confident
         )
-        ret_input_chain = contextualize_q_prompt | self.llm | StrOutputParser()
-        ret_input = ret_input_chain.invoke({"chat_history": chat_history_str})
-        logger.info(f"Reformulated input for retriever search: {ret_input}")
-        docs_and_score = self.retrieve_w_score(ret_input)
         retrieved_text = ""
         retriever_returns = []
-        for doc, score in docs_and_score:
+        for result in results:
+            doc = result["doc"]
             retrieved_text += f"{doc.page_content} \n"
             item = {
                 "title": doc.metadata.get("title"),
                 "content": doc.page_content,
                 "source": doc.metadata.get("source"),
-                "confidence": float(score),
+                "raw_score": round(float(result["raw_score"]), 4),
+                "score_type": result["score_type"],
+                "confidence": result["confidence"],
             }
             retriever_returns.append(item)
         return retrieved_text, retriever_returns
 
     @staticmethod
-    def load_docs(database_path: str, embeddings: str=None, index_path: str="./index"):
-        document_path = os.path.join(database_path, "chunked_documents.pkl")
-        index_path = os.path.join(database_path, "index")
-        logger.info(f"Loaded documents from {document_path}")
-        with open(document_path, 'rb') as fread:
-            documents = pickle.load(fread)
-        logger.info(f"Loaded {len(documents)} documents")
-
-        return FaissRetrieverExecutor(
-            texts=documents,
-            index_path=index_path
-        )
+    def check_index(database_path: str, index_path: str = None) -> bool:
+        """Whether the index of database_path exists. A missing index is logged once per index path."""
+        index_path = os.path.abspath(index_path or os.path.join(database_path, INDEX_NAME))
+        if FaissRetrieverExecutor.index_exists(index_path):
+            _missing_indexes.discard(index_path)
+            return True
+        with _executors_lock:
+            first = index_path not in _missing_indexes
+            _missing_indexes.add(index_path)
+        if first:
+            message = f"No FAISS index found at {index_path}, the RAG answers will have no documents"
+            if documents_exist(os.path.join(database_path, "chunked_documents")):
+                # data directories built before the index was persisted only have the chunked documents
+                message += ". Indexes are no longer built while serving, run build_rag with --folder_path " \
+                    f"{database_path}, it embeds the documents already crawled there"
+            else:
+                message += ". Build it with arklex.env.tools.RAG.build_rag"
+            logger.error(message)
+        return False
+
+    @staticmethod
+    def load_docs(database_path: str, embeddings: str=None, index_path: str=None):
+        """Return the process-wide executor for the index of database_path, loading it on first use.
+
+        The index is built by build_rag, never here: embedding the corpus while serving would hold up the
+        requests for minutes, so a missing index raises FileNotFoundError.
+        """
+        database_path = os.path.abspath(database_path)
+        index_path = os.path.abspath(index_path or os.path.join(database_path, INDEX_NAME))
+        key = (database_path, index_path, embeddings)
+        with _executors_lock:
+            executor = _executors.get(key)
+            if executor is not None:
+                return executor
+            path_lock = _executor_locks.setdefault(key, threading.Lock())
+
+        with path_lock:
+            executor = _executors.get(key)
+            if executor is not None:
+                return executor
+            if not FaissRetrieverExecutor.check_index(database_path, index_path):
+                raise FileNotFoundError(
+                    f"No FAISS index found at {index_path}, build it with arklex.env.tools.RAG.build_rag first"
+                )
+            executor = FaissRetrieverExecutor(
+                texts=[],
+                index_path=index_path,
+                **({"embedding_model_name": embeddings} if embeddings else {})
+            )
+            with _executors_lock:
+                _executors[key] = executor
+        return executor
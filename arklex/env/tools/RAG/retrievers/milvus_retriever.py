@@ -1,27 +1,40 @@
+import asyncio
 import logging
 import time
 import os
+import threading
 from typing import List
 import numpy as np
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from multiprocessing.pool import Pool
 from pymilvus import Collection, DataType, MilvusClient, connections
 
-from langchain.prompts import PromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain_openai.chat_models import ChatOpenAI
 
 from arklex.env.prompts import load_prompts
 from arklex.utils.mysql import mysql_pool
-from arklex.utils.model_config import MODEL
+from arklex.utils.model_provider_config import get_llm
 from arklex.utils.graph_state import MessageState
-from arklex.env.tools.RAG.retrievers.retriever_document import RetrieverDocument, RetrieverDocumentType, RetrieverResult, embed, embed_retriever_document
+from arklex.env.tools.RAG.retrievers.retriever_document import RetrieverDocument, RetrieverDocumentType, RetrieverResult, embed, aembed, embed_retriever_documents
 from arklex.env.tools.utils import trace
+from arklex.env.tools.RAG.query_reformulator import QueryReformulator, RAW_QUERY_CONFIDENCE
 
 EMBED_DIMENSION = 1536
 MAX_TEXT_LENGTH = 65535
 CHUNK_NEIGHBOURS = 3
 
+# idle clients kept per (uri, token), clients above that are closed when released
+MILVUS_POOL_SIZE = int(os.getenv("MILVUS_POOL_SIZE", 8))
+# a client idle for longer than this is pinged before being reused
+MILVUS_HEALTH_CHECK_INTERVAL = float(os.getenv("MILVUS_HEALTH_CHECK_INTERVAL", 30))
+# how long the bot -> collection mapping read from qa_bot is trusted
+MILVUS_COLLECTION_CACHE_TTL = float(os.getenv("MILVUS_COLLECTION_CACHE_TTL", 300))
+# ids per existence check and rows per upsert when ingesting
+MILVUS_ID_BATCH_SIZE = int(os.getenv("MILVUS_ID_BATCH_SIZE", 1000))
+MILVUS_UPSERT_BATCH_SIZE = int(os.getenv("MILVUS_UPSERT_BATCH_SIZE", 256))
+# embedded batches waiting for their upsert, bounds the memory of an ingestion
+MILVUS_INGEST_MAX_PENDING = int(os.getenv("MILVUS_INGEST_MAX_PENDING", 4))
+
 logging.basicConfig()
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -40,15 +53,115 @@ class RetrieveEngine():
         state = trace(input=retriever_params, state=state)
         return state
 
+    @staticmethod
+    async def amilvus_retrieve(state: MessageState):
+        user_message = state.user_message
+
+        milvus_retriever = MilvusRetrieverExecutor(state.bot_config)
+        retrieved_text, retriever_params = await milvus_retriever.aretrieve(user_message.history)
+
+        state.message_flow = retrieved_text
+        state = trace(input=retriever_params, state=state, name="milvus_retrieve")
+        return state
+
+
+class MilvusClientPool:
+    """Process-wide pool of MilvusClient connections to one server.
+
+    Clients are checked out for the duration of a `with MilvusRetriever()` block and returned to the pool
+    afterwards instead of being closed. A client idle for more than MILVUS_HEALTH_CHECK_INTERVAL seconds is
+    pinged before being handed out again and replaced if the ping fails; a client released after an error is
+    closed, as its channel may be broken.
+    """
+    def __init__(self, uri: str, token: str, size: int = MILVUS_POOL_SIZE):
+        self.uri = uri
+        self.token = token
+        self.size = size
+        self._idle = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> MilvusClient:
+        while True:
+            with self._lock:
+                client, last_used = self._idle.pop() if self._idle else (None, None)
+            if client is None:
+                return MilvusClient(uri=self.uri, token=self.token)
+            if time.time() - last_used < MILVUS_HEALTH_CHECK_INTERVAL or self._healthy(client):
+                return client
+            self._close(client)
+
+    def release(self, client: MilvusClient, discard: bool = False):
+        if not discard:
+            with self._lock:
+                if len(self._idle) < self.size:
+                    self._idle.append((client, time.time()))
+                    return
+        self._close(client)
+
+    @staticmethod
+    def _healthy(client: MilvusClient) -> bool:
+        try:
+            client.list_collections()
+            return True
+        except Exception as e:
+            logger.warning(f"Dropping unhealthy Milvus client: {e}")
+            return False
+
+    @staticmethod
+    def _close(client: MilvusClient):
+        try:
+            client.close()
+        except Exception as e:
+            logger.warning(f"Error closing Milvus client: {e}")
+
+
+_client_pools = {}
+_client_pools_lock = threading.Lock()
+
+
+def get_client_pool(uri: str, token: str) -> MilvusClientPool:
+    with _client_pools_lock:
+        pool = _client_pools.get((uri, token))
+        if pool is None:
+            pool = MilvusClientPool(uri, token)
+            _client_pools[(uri, token)] = pool
+    return pool
+
+
+_collection_names = {}
+_collection_names_lock = threading.Lock()
+
+
+def get_collection_name(bot_id: str, version: str) -> str:
+    """Milvus collection of the bot, read from the qa_bot table and cached for MILVUS_COLLECTION_CACHE_TTL seconds."""
+    key = (bot_id, version)
+    cached = _collection_names.get(key)
+    if cached is not None and cached[0] > time.time():
+        return cached[1]
+    milvus_db = mysql_pool.fetchone("SELECT collection_name FROM qa_bot WHERE id=%s AND version=%s", (bot_id, version))
+    if milvus_db is None:
+        raise ValueError(f"No Milvus collection found for bot_id: {bot_id} version: {version}")
+    with _collection_names_lock:
+        _collection_names[key] = (time.time() + MILVUS_COLLECTION_CACHE_TTL, milvus_db["collection_name"])
+    return milvus_db["collection_name"]
+
+
 class MilvusRetriever:
+    """Access to a Milvus server (or a Milvus Lite database file as uri) through a pooled client.
+
+    uri and token default to MILVUS_URI and MILVUS_TOKEN.
+    """
+    def __init__(self, uri: str = None, token: str = None):
+        self.uri = uri if uri is not None else os.getenv("MILVUS_URI", "")
+        self.token = token if token is not None else os.getenv("MILVUS_TOKEN", "")
+
     def __enter__(self):
-        self.uri = os.getenv("MILVUS_URI", "")
-        self.token = os.getenv("MILVUS_TOKEN", "")
-        self.client = MilvusClient(uri=self.uri, token=self.token)
+        self.pool = get_client_pool(self.uri, self.token)
+        self.client = self.pool.acquire()
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.client.close()
+        self.pool.release(self.client, discard=exc_type is not None)
 
     def get_bot_uid(self, bot_id: str, version: str):
         return f"{bot_id}__{version}"
@@ -103,34 +216,73 @@ class MilvusRetriever:
         )
         return res
     
-    def add_documents_dicts(
-        self, documents: List[dict], collection_name: str, upsert: bool = False
-    ):
-        logger.info(f"Celery sub task for adding {len(documents)} documents to collection: {collection_name}.")
-        retriever_documents = [RetrieverDocument.from_dict(doc) for doc in documents]
-        documents_to_insert = []
-
-        if not upsert:
-            # check if the document already exists in the collection
-            for doc in retriever_documents:
-                res = self.client.get(collection_name=collection_name, ids=doc.id)
-                if len(res) == 0:
-                    documents_to_insert.append(doc)
-            logger.info(f"Exisiting documents: {len(documents_to_insert)}")
-        else:
-            documents_to_insert = retriever_documents
+    def get_existing_ids(self, collection_name: str, ids: List[str]) -> set:
+        """Ids already in the collection, checked MILVUS_ID_BATCH_SIZE at a time."""
+        existing = set()
+        for i in range(0, len(ids), MILVUS_ID_BATCH_SIZE):
+            res = self.client.get(collection_name=collection_name, ids=ids[i:i+MILVUS_ID_BATCH_SIZE], output_fields=["id"])
+            existing.update(r["id"] for r in res)
+        return existing
+
+    def _new_documents(self, collection_name: str, documents: List[RetrieverDocument], upsert: bool) -> List[RetrieverDocument]:
+        if upsert:
+            return documents
+        # check if the document already exists in the collection
+        existing = self.get_existing_ids(collection_name, [doc.id for doc in documents])
+        documents_to_insert = [doc for doc in documents if doc.id not in existing]
+        logger.info(f"Exisiting documents: {len(existing)}, new documents: {len(documents_to_insert)}")
+        return documents_to_insert
+
+    def _embed_and_upsert(self, collection_name: str, documents: List[RetrieverDocument], process_pool: Pool = None):
+        """Embed the documents in batches and upsert them as the embeddings come back.
+
+        Up to MILVUS_INGEST_MAX_PENDING batches are embedded ahead (in process_pool, or in threads as
+        embedding is I/O bound) while the current one is upserted, so the producer never gets more than
+        that far ahead of the upserts.
+        """
+        executor = None
+        if process_pool is None:
+            executor = ThreadPoolExecutor(max_workers=MILVUS_INGEST_MAX_PENDING, thread_name_prefix="milvus-embed")
+
+        def submit(batch):
+            if process_pool is not None:
+                return process_pool.apply_async(embed_retriever_documents, (batch,)).get
+            return executor.submit(embed_retriever_documents, batch).result
 
         res = []
-        for doc in documents_to_insert:
-            data = doc.to_milvus_schema_dict_and_embed()
+        count = 0
+        pending = deque()
+
+        def upsert_next():
+            nonlocal count
+            data = pending.popleft()()
             try:
-                res.append(
-                    self.client.upsert(collection_name=collection_name, data=[data])
-                )
+                res.append(self.client.upsert(collection_name=collection_name, data=data))
             except Exception as e:
-                logger.error(f"Error adding document id: {data['id']} error: {e}")
+                logger.error(f"Error adding documents {data[0]['id']} to {data[-1]['id']} error: {e}")
                 raise e
+            count += len(data)
+            logger.info(f"Added {count}/{len(documents)} docs")
+
+        try:
+            for i in range(0, len(documents), MILVUS_UPSERT_BATCH_SIZE):
+                pending.append(submit(documents[i:i+MILVUS_UPSERT_BATCH_SIZE]))
+                if len(pending) >= MILVUS_INGEST_MAX_PENDING:
+                    upsert_next()
+            while pending:
+                upsert_next()
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
         return res
+
+    def add_documents_dicts(
+        self, documents: List[dict], collection_name: str, upsert: bool = False
+    ):
+        logger.info(f"Celery sub task for adding {len(documents)} documents to collection: {collection_name}.")
+        retriever_documents = [RetrieverDocument.from_dict(doc) for doc in documents]
+        documents_to_insert = self._new_documents(collection_name, retriever_documents, upsert)
+        return self._embed_and_upsert(collection_name, documents_to_insert)
     
     def add_documents_parallel(
         self, collection_name: str, bot_id: str, version: str, documents: List[RetrieverDocument], process_pool: Pool, upsert: bool = False
@@ -142,32 +294,8 @@ class MilvusRetriever:
             logger.info(f"No collection found hence creating collection: {collection_name}")
             self.create_collection_with_partition_key(collection_name)
 
-        documents_to_insert = []
-
-        if not upsert:
-            # check if the document already exists in the collection
-            for doc in documents:
-                res = self.client.get(collection_name=collection_name, ids=doc.id)
-                if len(res) == 0:
-                    documents_to_insert.append(doc)
-            logger.info(f"Exisiting documents: {len(documents_to_insert)}")
-        else:
-            documents_to_insert = documents
-
-        res = []
-        # process 100 documents at a time
-        count = 0
-        for i in range(0, len(documents_to_insert), 100):
-            batch_docs = documents_to_insert[i:i+100]
-            embedded_batch_docs = process_pool.map(embed_retriever_document, batch_docs)
-
-            res.extend(
-                self.client.upsert(collection_name=collection_name, data=embedded_batch_docs)
-            )
-            count += len(batch_docs)
-            logger.info(f"Added {count}/{len(documents_to_insert)} docs")
-
-        return res
+        documents_to_insert = self._new_documents(collection_name, documents, upsert)
+        return self._embed_and_upsert(collection_name, documents_to_insert, process_pool)
         
     def add_documents(
         self, collection_name: str, bot_id: str, version: str, documents: List[RetrieverDocument], upsert: bool = False
@@ -179,37 +307,26 @@ class MilvusRetriever:
         if not self.client.has_collection(collection_name):
             self.create_collection_with_partition_key(collection_name)
 
-        documents_to_insert = []
-
-        if not upsert:
-            # check if the document already exists in the collection
-            for doc in documents:
-                res = self.client.get(collection_name=collection_name, ids=doc.id)
-                if len(res) == 0:
-                    documents_to_insert.append(doc)
-            logger.info(f"Exisiting documents: {len(documents_to_insert)}")
-        else:
-            documents_to_insert = documents
-
-        res = []
-        for doc in documents_to_insert:
-            data = doc.to_milvus_schema_dict_and_embed()
-            try:
-                res.append(
-                    self.client.upsert(collection_name=collection_name, data=[data])
-                )
-            except Exception as e:
-                logger.error(f"Error adding document id: {data['id']} error: {e}")
-                raise e
-        return res
+        documents_to_insert = self._new_documents(collection_name, documents, upsert)
+        return self._embed_and_upsert(collection_name, documents_to_insert)
 
     def search(self, collection_name: str, bot_id: str, version: str, query: str, top_k: int = 4) -> List[RetrieverResult]:
         logger.info(
             f"Retreiver search for query: {query} on collection {collection_name} for bot_id: {bot_id} version: {version}"
         )
         
+        return self._search(collection_name, bot_id, version, embed(query), top_k)
+
+    async def asearch(self, collection_name: str, bot_id: str, version: str, query: str, top_k: int = 4) -> List[RetrieverResult]:
+        logger.info(
+            f"Retreiver search for query: {query} on collection {collection_name} for bot_id: {bot_id} version: {version}"
+        )
+        query_embedding = await aembed(query)
+        # the pymilvus client is blocking, run the search RPC in a thread
+        return await asyncio.to_thread(self._search, collection_name, bot_id, version, query_embedding, top_k)
+
+    def _search(self, collection_name: str, bot_id: str, version: str, query_embedding: List[float], top_k: int) -> List[RetrieverResult]:
         partition_key = self.get_bot_uid(bot_id, version)
-        query_embedding = embed(query)
         res = self.client.search(
             collection_name=collection_name,
             data=[query_embedding],
@@ -448,13 +565,8 @@ class MilvusRetriever:
 
         if not upsert:
             # check if the document already exists in the collection
-            for vec in vectors:
-                res = self.client.query(
-                    collection_name=collection_name, 
-                    ids=vec["id"], 
-                )
-                if len(res) == 0:
-                    vectors_to_insert.append(vec)
+            existing = self.get_existing_ids(collection_name, [vec["id"] for vec in vectors])
+            vectors_to_insert = [vec for vec in vectors if vec["id"] not in existing]
             logger.info(f"New vectors to insert: {len(vectors_to_insert)}")
         else:
             vectors_to_insert = vectors
@@ -572,9 +684,11 @@ class MilvusRetriever:
 
 
 class MilvusRetrieverExecutor:
-    def __init__(self, bot_config):
+    def __init__(self, bot_config, collection_name: str = None):
         self.bot_config = bot_config
-        self.llm = ChatOpenAI(model=MODEL["model_type_or_path"], timeout=30000)
+        self.llm = get_llm()
+        # a fixed collection (e.g. in a local Milvus Lite database) skips the qa_bot lookup
+        self.collection_name = collection_name or os.getenv("MILVUS_COLLECTION")
 
     def generate_thought(self, retriever_results: List[RetrieverResult]) -> str:
         # post process list of documents into str
@@ -607,25 +721,53 @@ class MilvusRetrieverExecutor:
             retriever_returns.append(item)
         return {"retriever": retriever_returns}
 
-    def retrieve(self, chat_history_str):
-        """Given a chat history, retrieve relevant information from the database."""
-        st = time.time()
+    def _reformulator(self) -> QueryReformulator:
         prompts = load_prompts(self.bot_config)
-        contextualize_q_prompt = PromptTemplate.from_template(
-            prompts.get("retrieve_contextualize_q_prompt", "")
-        )
-        ret_input_chain = contextualize_q_prompt | self.llm | StrOutputParser()
-        ret_input = ret_input_chain.invoke({"chat_history": chat_history_str})
-        rit = time.time() - st
+        return QueryReformulator(prompts.get("retrieve_contextualize_q_prompt", ""), self.llm)
 
-        ret_results: List[RetrieverResult] = []
-        st = time.time()
-        milvus_db = mysql_pool.fetchone("SELECT collection_name FROM qa_bot WHERE id=%s AND version=%s", (self.bot_config.bot_id, self.bot_config.version))
-        with MilvusRetriever() as retriever:
-            ret_results = retriever.search(milvus_db["collection_name"], self.bot_config.bot_id, self.bot_config.version, ret_input)
-        rt = time.time() - st
+    def _get_collection_name(self) -> str:
+        return self.collection_name or get_collection_name(self.bot_config.bot_id, self.bot_config.version)
+
+    def _is_confident(self, ret_results: List[RetrieverResult]) -> bool:
+        return bool(ret_results) and max(self._gaussian_similarity(r.distance) for r in ret_results) >= RAW_QUERY_CONFIDENCE
+
+    def _finalize(self, ret_results: List[RetrieverResult], rit: float, rt: float):
         logger.info(f"MilvusRetriever search took {rt} seconds")
         retriever_params = self.postprocess(ret_results)
         retriever_params["timing"] = {"retriever_input": rit, "retriever_search": rt}
         thought = self.generate_thought(ret_results)
-        return thought, retriever_params
\ No newline at end of file
+        return thought, retriever_params
+
+    def retrieve(self, chat_history_str):
+        """Given a chat history, retrieve relevant information from the database."""
+        st = time.time()
+        collection_name = self._get_collection_name()
+        search_times = []
+
+        def search(query):
+            search_st = time.time()
+            with MilvusRetriever() as retriever:
+                ret_results = retriever.search(collection_name, self.bot_config.bot_id, self.bot_config.version, query)
+            search_times.append(time.time() - search_st)
+            return ret_results
+
+        _, ret_results = self._reformulator().search(chat_history_str, search, self._is_confident)
+        rt = search_times[-1] if search_times else 0.0
+        return self._finalize(ret_results, time.time() - st - rt, rt)
+
+    async def aretrieve(self, chat_history_str):
+        st = time.time()
+        # the lookup is usually served from the cache, only a miss goes to MySQL
+        collection_name = await asyncio.to_thread(self._get_collection_name)
+        search_times = []
+
+        async def search(query):
+            search_st = time.time()
+            with MilvusRetriever() as retriever:
+                ret_results = await retriever.asearch(collection_name, self.bot_config.bot_id, self.bot_config.version, query)
+            search_times.append(time.time() - search_st)
+            return ret_results
+
+        _, ret_results = await self._reformulator().asearch(chat_history_str, search, self._is_confident)
+        rt = search_times[-1] if search_times else 0.0
+        return self._finalize(ret_results, time.time() - st - rt, rt)
@@ -1,21 +1,44 @@
+import os
 import json
+import threading
 from enum import Enum
-from typing import List, Dict
-from openai import OpenAI
+from typing import Dict, Iterator, List, Tuple
+from openai import OpenAI, AsyncOpenAI
 import logging
 
-import tiktoken
 from arklex.utils.mysql import mysql_pool
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-
-DEFAULT_CHUNK_ENCODING = "cl100k_base"
+from arklex.env.tools.RAG.embedding_cache import get_embedding_cache
+from arklex.utils.chunking import DEFAULT_CHUNK_ENCODING, split_text, split_texts
 
 logger = logging.getLogger(__name__)
 
+EMBEDDING_MODEL = "text-embedding-ada-002"
+# inputs sent in one embeddings request
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 256))
+
+_openai_clients = {}
+_openai_clients_lock = threading.Lock()
+
+
+def get_openai_client(is_async: bool = False):
+    """OpenAI clients are shared by the process (and created lazily, so each worker process gets its own)
+    to reuse their connection pool across embedding calls."""
+    client = _openai_clients.get(is_async)
+    if client is None:
+        with _openai_clients_lock:
+            client = _openai_clients.get(is_async)
+            if client is None:
+                client = AsyncOpenAI() if is_async else OpenAI()
+                _openai_clients[is_async] = client
+    return client
+
+
 def embed(text: str):
-    client = OpenAI()
+    """Embedding of a single text, e.g. a search query. Not cached: queries rarely repeat, and the
+    cache is written by the ingestion jobs (see embed_batch)."""
+    client = get_openai_client()
     try:
-        response = client.embeddings.create(input=text, model="text-embedding-ada-002")
+        response = client.embeddings.create(input=text, model=EMBEDDING_MODEL)
     except Exception as e:
         logger.error(f"Error embedding text of length {len(text)}")
         logger.error(text[:1000])
@@ -23,6 +46,39 @@ def embed(text: str):
         raise e
     return response.data[0].embedding    
 
+def embed_batch(texts: List[str]) -> List[List[float]]:
+    """Embed texts with one embeddings request per EMBED_BATCH_SIZE inputs, in the order of texts.
+    Texts found in the embedding cache are not sent."""
+    cache = get_embedding_cache(EMBEDDING_MODEL)
+    if cache is None:
+        return _embed_batch(texts)
+    return cache.embed(texts, _embed_batch)
+
+def _embed_batch(texts: List[str]) -> List[List[float]]:
+    client = get_openai_client()
+    embeddings = []
+    for i in range(0, len(texts), EMBED_BATCH_SIZE):
+        batch = texts[i:i+EMBED_BATCH_SIZE]
+        try:
+            response = client.embeddings.create(input=batch, model=EMBEDDING_MODEL)
+        except Exception as e:
+            logger.error(f"Error embedding a batch of {len(batch)} texts")
+            logger.exception(e)
+            raise e
+        embeddings.extend(d.embedding for d in sorted(response.data, key=lambda d: d.index))
+    return embeddings
+
+async def aembed(text: str):
+    client = get_openai_client(is_async=True)
+    try:
+        response = await client.embeddings.create(input=text, model=EMBEDDING_MODEL)
+    except Exception as e:
+        logger.error(f"Error embedding text of length {len(text)}")
+        logger.error(text[:1000])
+        logger.exception(e)
+        raise e
+    return response.data[0].embedding
+
 class RetrieverDocumentType(Enum):
     WEBSITE = "website"
     FAQ = "faq"
@@ -63,7 +119,7 @@ class RetrieverDocument:
         metadata: dict,
         is_chunked: bool,
         bot_uid: str,
-        # num_tokens: int = None,
+        num_tokens: int = None,
         embedding=None,
         timestamp: int = None,
     ):
@@ -76,7 +132,7 @@ class RetrieverDocument:
             self.metadata = json.loads(metadata)
         else:
             self.metadata = metadata
-        # self.num_tokens = num_tokens
+        self.num_tokens = num_tokens
         self.embedding = embedding
         self.is_chunked = is_chunked
         self.timestamp = int(timestamp)
@@ -87,14 +143,24 @@ class RetrieverDocument:
             raise ValueError("Document is already chunked")
         elif self.qa_doc_type == RetrieverDocumentType.FAQ:
             raise ValueError("Cannot chunk FAQ document")
-        encoding = tiktoken.get_encoding(chunk_encoding)
-        chunked_texts = RecursiveCharacterTextSplitter.from_tiktoken_encoder(encoding_name=chunk_encoding, chunk_size=400, chunk_overlap=50).split_text(self.text.strip())
+        return self._from_chunks(split_text(self.text, chunk_encoding, chunk_size=400, chunk_overlap=50, strip=True))
+
+    @classmethod
+    def chunk_many(cls, docs: List["RetrieverDocument"], chunk_encoding=DEFAULT_CHUNK_ENCODING) -> Iterator["RetrieverDocument"]:
+        """Yield the chunks of docs as they are split, in parallel for large inputs (see split_texts)."""
+        for doc in docs:
+            if doc.is_chunked:
+                raise ValueError("Document is already chunked")
+            elif doc.qa_doc_type == RetrieverDocumentType.FAQ:
+                raise ValueError("Cannot chunk FAQ document")
+        chunked_texts = split_texts([doc.text for doc in docs], chunk_encoding, chunk_size=400, chunk_overlap=50, strip=True)
+        for doc, chunks in zip(docs, chunked_texts):
+            yield from doc._from_chunks(chunks)
+
+    def _from_chunks(self, chunks: List[Tuple[str, int]]) -> List["RetrieverDocument"]:
+        logger.info(f"Chunked to {len(chunks)} chunks of {sum(num_tokens for _, num_tokens in chunks)} tokens in total")
         chunked_docs = []
-        tokens = encoding.encode(self.text)
-        logger.info(f"Original text token length: {len(tokens)}, Chunked to {len(chunked_texts)} chunks")
-        for i, chunk in enumerate(chunked_texts):
-            chunk = chunk.strip()
-            tokens = encoding.encode(chunk)
+        for i, (chunk, num_tokens) in enumerate(chunks):
             doc = RetrieverDocument(
                 id=str(f"{self.id}__{i}"),
                 qa_doc_id=self.qa_doc_id,
@@ -102,7 +168,7 @@ class RetrieverDocument:
                 qa_doc_type=self.qa_doc_type,
                 text=chunk,
                 metadata=self.metadata,
-                # num_tokens=len(tokens),
+                num_tokens=num_tokens,
                 embedding=None,
                 bot_uid=self.bot_uid,
                 is_chunked=True,
@@ -120,7 +186,7 @@ class RetrieverDocument:
             "qa_doc_type": self.qa_doc_type.value,
             "text": self.text,
             "metadata": self.metadata,
-            # "num_tokens": self.num_tokens,
+            "num_tokens": self.num_tokens,
             "embedding": self.embedding,
             "is_chunked": self.is_chunked,
             "timestamp": self.timestamp,
@@ -128,6 +194,9 @@ class RetrieverDocument:
         }
     
     def to_milvus_schema_dict_and_embed(self) -> Dict:
+        return self.to_milvus_schema_dict(embed_batch([self.text])[0])
+
+    def to_milvus_schema_dict(self, embedding: List[float]) -> Dict:
         # check if values exists
         if (
             self.id is None
@@ -151,7 +220,7 @@ class RetrieverDocument:
             "metadata": self.metadata,
             "timestamp": self.timestamp,
             # "num_tokens": self.num_tokens,
-            "embedding": embed(self.text),
+            "embedding": embedding,
             "bot_uid": self.bot_uid,
         }
     
@@ -164,7 +233,7 @@ class RetrieverDocument:
             qa_doc_type=RetrieverDocumentType(doc_dict["qa_doc_type"]),
             text=doc_dict["text"],
             metadata=doc_dict["metadata"],
-            # num_tokens=doc_dict["num_tokens"],
+            num_tokens=doc_dict.get("num_tokens"),
             embedding=doc_dict["embedding"],
             is_chunked=doc_dict["is_chunked"],
             timestamp=doc_dict["timestamp"],
@@ -218,7 +287,7 @@ class RetrieverDocument:
     def chunked_retriever_docs_from_db_docs(
         cls, db_docs: List[dict], doc_type: RetrieverDocumentType, bot_uid: str,
     ) -> List["RetrieverDocument"]:
-        chunked_db_docs: List[RetrieverDocument] = []
+        unchunked_docs: List[RetrieverDocument] = []
         for doc in db_docs:
             doc_id = doc["id"]
             metadata = doc["metadata"]
@@ -227,12 +296,11 @@ class RetrieverDocument:
             text = doc["content"].strip()
             timestamp = doc["timestamp"]
 
-            ret_doc = cls.unchunked_retreiver_doc(
+            unchunked_docs.append(cls.unchunked_retreiver_doc(
                 doc_id, doc_type, text, metadata, bot_uid, timestamp
-            )
-            chunked_db_docs.extend(ret_doc.chunk())
+            ))
 
-        return chunked_db_docs
+        return list(cls.chunk_many(unchunked_docs))
 
     @classmethod
     def load_all_chunked_docs_from_mysql(
@@ -276,5 +344,10 @@ class RetrieverDocument:
 def embed_retriever_document(retriever_document: RetrieverDocument):
     return retriever_document.to_milvus_schema_dict_and_embed()
 
+def embed_retriever_documents(retriever_documents: List[RetrieverDocument]) -> List[Dict]:
+    """Milvus rows of the documents, embedded with batched requests."""
+    embeddings = embed_batch([doc.text for doc in retriever_documents])
+    return [doc.to_milvus_schema_dict(embedding) for doc, embedding in zip(retriever_documents, embeddings)]
+
 def get_bot_uid(bot_id: str, version: str):
     return f"{bot_id}__{version}"
\ No newline at end of file
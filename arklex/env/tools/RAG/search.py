@@ -1,24 +1,20 @@
 import logging
 
-from arklex.utils.model_config import MODEL
-from arklex.utils.model_provider_config import PROVIDER_MAP
+from arklex.utils.model_provider_config import get_llm
 from arklex.env.prompts import load_prompts
 from arklex.utils.graph_state import MessageState
 
-from langchain.prompts import PromptTemplate
-from langchain_openai import ChatOpenAI
-from langchain_core.output_parsers import StrOutputParser
 from langchain_community.tools import TavilySearchResults
 
+from arklex.env.tools.RAG.query_reformulator import QueryReformulator
+
 
 logger = logging.getLogger(__name__)
 
 
 class SearchEngine():
     def __init__(self):
-        self.llm = PROVIDER_MAP.get(MODEL['llm_provider'], ChatOpenAI)(
-            model=MODEL["model_type_or_path"], timeout=30000
-        )
+        self.llm = get_llm()
         self.search_tool = TavilySearchResults(
             max_results=5,
             search_depth="advanced",
@@ -34,14 +30,18 @@ class SearchEngine():
             search_text += f"Content: {res['content']} \n\n"
         return search_text
 
-    def search(self, state: MessageState):
+    def _reformulator(self, state: MessageState) -> QueryReformulator:
         prompts = load_prompts(state.bot_config)
-        contextualize_q_prompt = PromptTemplate.from_template(
-            prompts["retrieve_contextualize_q_prompt"]
-        )
-        ret_input_chain = contextualize_q_prompt | self.llm | StrOutputParser()
-        ret_input = ret_input_chain.invoke({"chat_history": state.user_message.history})
-        logger.info(f"Reformulated input for search engine: {ret_input}")
+        return QueryReformulator(prompts["retrieve_contextualize_q_prompt"], self.llm)
+
+    def search(self, state: MessageState):
+        ret_input = self._reformulator(state).reformulate(state.user_message.history)
         search_results = self.search_tool.invoke({"query": ret_input})
         state.message_flow = self.process_search_result(search_results)
         return state
+
+    async def asearch(self, state: MessageState):
+        ret_input = await self._reformulator(state).areformulate(state.user_message.history)
+        search_results = await self.search_tool.ainvoke({"query": ret_input})
+        state.message_flow = self.process_search_result(search_results)
+        return state
@@ -1,9 +1,8 @@
 import os
 import sqlite3
 import logging
-from langchain_openai import ChatOpenAI
 
-from arklex.utils.model_config import MODEL
+from arklex.utils.model_provider_config import get_llm
 
 DBNAME = 'show_booking_db.sqlite'
 USER_ID = "user_be6e1836-8fe9-4938-b2d0-48f810648e72"
@@ -48,7 +47,7 @@ NO_BOOKING_MESSAGE = "You have not booked any show."
 
 class Booking:
     db_path = None
-    llm = ChatOpenAI(model=MODEL["model_type_or_path"], timeout=30000)
+    llm = get_llm()
     user_id = USER_ID
     # actions = {
     #     "SearchShow": "Search for shows", 
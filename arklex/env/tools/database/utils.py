@@ -1,17 +1,23 @@
 import os
+import re
+import json
 import sqlite3
+import threading
+import unicodedata
 from datetime import datetime
 import uuid
 import logging
 import pandas as pd
+import Levenshtein
 
 from langchain.prompts import PromptTemplate
-from langchain_openai import ChatOpenAI
 from langchain_core.output_parsers import StrOutputParser
 
-from arklex.utils.utils import chunk_string
+from arklex.utils.utils import chunk_string, postprocess_json
 from arklex.utils.model_config import MODEL
-from arklex.utils.graph_state import Slot, SlotDetail, MessageState
+from arklex.utils.model_provider_config import get_llm
+from arklex.utils.slot import Slot, SlotDetail
+from arklex.utils.graph_state import MessageState
 from arklex.env.prompts import load_prompts
 from arklex.utils.graph_state import StatusEnum
 
@@ -21,6 +27,116 @@ USER_ID = "user_be6e1836-8fe9-4938-b2d0-48f810648e72"
 
 logger = logging.getLogger(__name__)
 
+# a fuzzy match at least this similar (0-1) to the provided value, and SLOT_MATCH_MARGIN more similar than
+# the next value, is taken without asking the LLM
+SLOT_MATCH_THRESHOLD = float(os.getenv("SLOT_MATCH_THRESHOLD", 0.85))
+SLOT_MATCH_MARGIN = float(os.getenv("SLOT_MATCH_MARGIN", 0.1))
+# most candidate values sent to the LLM for a slot that has a close local match
+SLOT_MATCH_CANDIDATES = int(os.getenv("SLOT_MATCH_CANDIDATES", 5))
+# a value contained in a single database value is taken when it has at least SLOT_CONTAINMENT_MIN_CHARS
+# characters, is made of whole words of that value and covers SLOT_CONTAINMENT_COVERAGE of its length,
+# so "nutcracker" resolves to "The Nutcracker" but "the" or "new" go to the LLM
+SLOT_CONTAINMENT_MIN_CHARS = int(os.getenv("SLOT_CONTAINMENT_MIN_CHARS", 4))
+SLOT_CONTAINMENT_COVERAGE = float(os.getenv("SLOT_CONTAINMENT_COVERAGE", 0.5))
+
+_DATE_FORMATS = {"date": "%Y-%m-%d", "time": "%H:%M:%S"}
+
+# (database path, column) -> (modification time of the database, distinct values of the column)
+_distinct_values = {}
+_distinct_values_lock = threading.Lock()
+
+
+def get_distinct_values(db_path: str, columns: list[str]) -> dict:
+    """Distinct values of the columns of the show table, cached until the database file changes or
+    invalidate_distinct_values is called."""
+    mtime = os.stat(db_path).st_mtime_ns
+    values = {}
+    with _distinct_values_lock:
+        for column in columns:
+            cached = _distinct_values.get((db_path, column))
+            if cached is not None and cached[0] == mtime:
+                values[column] = cached[1]
+        missing = [column for column in columns if column not in values]
+        if missing:
+            conn = sqlite3.connect(db_path)
+            try:
+                cursor = conn.cursor()
+                for column in missing:
+                    cursor.execute(f'SELECT DISTINCT "{column}" FROM show')
+                    values[column] = [result[0] for result in cursor.fetchall()]
+                    _distinct_values[(db_path, column)] = (mtime, values[column])
+                cursor.close()
+            finally:
+                conn.close()
+    return values
+
+
+def invalidate_distinct_values(db_path: str):
+    with _distinct_values_lock:
+        for key in [key for key in _distinct_values if key[0] == db_path]:
+            del _distinct_values[key]
+
+
+def normalize_value(value) -> str:
+    """Case, accents, punctuation and spacing insensitive form of a slot value."""
+    value = unicodedata.normalize("NFKD", str(value)).casefold()
+    value = "".join(char for char in value if not unicodedata.combining(char))
+    return " ".join(re.sub(r"[^\w\s]", " ", value).split())
+
+
+def _parse_datetime(value, slot_type: str):
+    try:
+        parsed = pd.to_datetime(str(value), errors="coerce")
+    except (ValueError, OverflowError):
+        return None
+    if pd.isna(parsed):
+        return None
+    return parsed.strftime(_DATE_FORMATS[slot_type])
+
+
+def match_slot_value(value, value_list: list, slot_type: str = "string") -> tuple:
+    """Resolve the value provided for a slot to one of the database values without an LLM.
+
+    Returns (matched value, candidates): the matched value is None when the match is not certain, the
+    candidates are then the values the LLM should choose from (empty when no value was provided).
+    """
+    if value is None or str(value).strip() == "" or not value_list:
+        return None, []
+    if value in value_list:
+        return value, []
+    if slot_type in _DATE_FORMATS:
+        parsed = _parse_datetime(value, slot_type)
+        if parsed is not None and parsed in value_list:
+            return parsed, []
+    normalized = normalize_value(value)
+    normalized_values = [normalize_value(candidate) for candidate in value_list]
+    equal = [candidate for candidate, norm in zip(value_list, normalized_values) if norm == normalized]
+    if len(equal) == 1:
+        return equal[0], []
+    containing = [
+        (candidate, norm) for candidate, norm in zip(value_list, normalized_values)
+        if normalized and f" {normalized} " in f" {norm} "
+    ]
+    if len(containing) == 1:
+        candidate, norm = containing[0]
+        if len(normalized) >= SLOT_CONTAINMENT_MIN_CHARS and len(normalized) / len(norm) >= SLOT_CONTAINMENT_COVERAGE:
+            return candidate, []
+    if containing:
+        return None, [candidate for candidate, _ in containing][:SLOT_MATCH_CANDIDATES]
+    scored = sorted(
+        ((Levenshtein.ratio(normalized, norm), candidate) for candidate, norm in zip(value_list, normalized_values)),
+        key=lambda item: item[0], reverse=True,
+    )
+    best_score = scored[0][0]
+    next_score = scored[1][0] if len(scored) > 1 else 0.0
+    if best_score >= SLOT_MATCH_THRESHOLD and best_score - next_score >= SLOT_MATCH_MARGIN:
+        return scored[0][1], []
+    if best_score >= SLOT_MATCH_THRESHOLD:
+        close = [candidate for score, candidate in scored if best_score - score < SLOT_MATCH_MARGIN]
+        return None, close[:SLOT_MATCH_CANDIDATES]
+    # nothing is spelled alike, the value may still mean one of them (e.g. a translated name)
+    return None, list(value_list)
+
 
 SLOTS = [
     {
@@ -61,7 +177,7 @@ NO_BOOKING_MESSAGE = "You have not booked any show."
 class DatabaseActions:
     def __init__(self, user_id: str=USER_ID):
         self.db_path = os.path.join(os.environ.get("DATA_DIR"), DBNAME)
-        self.llm = ChatOpenAI(model=MODEL["model_type_or_path"], timeout=30000)
+        self.llm = get_llm()
         self.user_id = user_id
 
     def log_in(self):
@@ -76,48 +192,68 @@ class DatabaseActions:
         return result is not None
 
     def init_slots(self, slots: list[Slot], bot_config):
-        if not slots:
+        if not slots or not isinstance(slots, list):
             slots = SLOTS
-        self.slots = []
-        self.slot_prompts = []
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        for slot in slots:
-            query = f"SELECT DISTINCT {slot['name']} FROM show"
-            cursor.execute(query)
-            results = cursor.fetchall()
-            value_list = [result[0] for result in results]
-            self.slots.append(self.verify_slot(slot, value_list, bot_config))
-            if not self.slots[-1].confirmed:
-                self.slot_prompts.append(slot["prompt"])
-        cursor.close()
-        conn.close()
+        slots = [slot if isinstance(slot, dict) else slot.model_dump() for slot in slots]
+        value_lists = get_distinct_values(self.db_path, [slot["name"] for slot in slots])
+        self.slots = self.verify_slots(slots, value_lists, bot_config)
+        self.slot_prompts = [slot.prompt for slot in self.slots if not slot.confirmed]
         return SLOTS
 
-    def verify_slot(self, slot: Slot, value_list: list, bot_config) -> Slot:
-        slot_detail = SlotDetail(**slot, verified_value="", confirmed=False)
+    def verify_slots(self, slots: list[dict], value_lists: dict, bot_config) -> list[SlotDetail]:
+        """Match the values of slots to the database values, locally when possible and with a single
+        LLM call for all the slots whose match is uncertain."""
+        slot_details = []
+        ambiguous = {}
+        for slot in slots:
+            slot_detail = SlotDetail(**slot, verified_value="", confirmed=False)
+            matched, candidates = match_slot_value(slot["value"], value_lists[slot["name"]], slot["type"])
+            if matched is not None:
+                logger.info(f"Chosen slot value in the database worker: {matched}")
+                slot_detail.verified_value = matched
+                slot_detail.confirmed = True
+            elif candidates:
+                ambiguous[slot["name"]] = (slot_detail, candidates)
+            slot_details.append(slot_detail)
+        if ambiguous:
+            self._verify_with_llm(ambiguous, bot_config)
+        return slot_details
+
+    def _verify_with_llm(self, ambiguous: dict, bot_config):
         prompts = load_prompts(bot_config)
-        prompt = PromptTemplate.from_template(prompts["database_slot_prompt"])
-        input_prompt = prompt.invoke({
-            "slot": {"name": slot["name"], "description": slot["description"], "slot": slot["type"]}, 
-            "value": slot["value"], 
-            "value_list": value_list
-        })
+        prompt = PromptTemplate.from_template(prompts["database_slots_prompt"])
+        slots_info = "\n".join(
+            json.dumps({
+                "name": slot_detail.name,
+                "description": slot_detail.description,
+                "type": slot_detail.type,
+                "value": slot_detail.value,
+                "database_values": candidates,
+            }, ensure_ascii=False, default=str)
+            for slot_detail, candidates in ambiguous.values()
+        )
+        input_prompt = prompt.invoke({"slots_info": slots_info})
         chunked_prompt = chunk_string(input_prompt.text, tokenizer=MODEL["tokenizer"], max_length=MODEL["context"])
-        logger.info(f"Chunked prompt for verifying slot: {chunked_prompt}")
+        logger.info(f"Chunked prompt for verifying slots: {chunked_prompt}")
         final_chain = self.llm | StrOutputParser()
         try:
-            answer = final_chain.invoke(chunked_prompt)
-            logger.info(f"Result for verifying slot value: {answer}")
-            for value in value_list:
-                if value in answer:
-                    logger.info(f"Chosen slot value in the database worker: {value}")
-                    slot_detail.verified_value = value
-                    slot_detail.confirmed = True
-                    return slot_detail
+            answer = postprocess_json(final_chain.invoke(chunked_prompt))
+            logger.info(f"Result for verifying slot values: {answer}")
         except Exception as e:
-            logger.error(f"Error occurred while verifying slot in the database worker: {e}")
-        return slot_detail
+            logger.error(f"Error occurred while verifying slots in the database worker: {e}")
+            return
+        if not isinstance(answer, dict):
+            return
+        for name, (slot_detail, candidates) in ambiguous.items():
+            chosen = answer.get(name)
+            if chosen is None:
+                continue
+            # the model may reformat the value, map it back to the database value
+            matched, _ = match_slot_value(chosen, candidates, slot_detail.type)
+            if matched is not None:
+                logger.info(f"Chosen slot value in the database worker: {matched}")
+                slot_detail.verified_value = matched
+                slot_detail.confirmed = True
 
     def search_show(self, msg_state: MessageState) -> MessageState:
         # Populate the slots with verified values
@@ -180,6 +316,8 @@ class DatabaseActions:
                 INSERT INTO booking (id, show_id, user_id, created_at)
                 VALUES (?, ?, ?, ?)
             ''', ("booking_" + str(uuid.uuid4()),  show_id, self.user_id, datetime.now()))
+            conn.commit()
+            invalidate_distinct_values(self.db_path)
 
             results_df = pd.DataFrame([results])
             msg_state.status = StatusEnum.COMPLETE
@@ -244,10 +382,12 @@ class DatabaseActions:
             # Delete a row from the booking table based on show_id
             cursor.execute('''DELETE FROM booking WHERE show_id = ?
             ''', (show["id"],))
+            conn.commit()
+            invalidate_distinct_values(self.db_path)
             # Respond to user the cancellation
             results_df = pd.DataFrame(results)
             msg_state.message_flow = "The cancelled show is:\n" + results_df.to_string(index=False)
             msg_state.status = StatusEnum.COMPLETE
+        cursor.close()
         conn.close()
-        cursor.commit()
         return msg_state
@@ -1,9 +1,11 @@
 import os
+import asyncio
 import logging
 import json
 import uuid
 import inspect
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 from arklex.utils.graph_state import MessageState, StatusEnum
 from arklex.utils.slot import Slot
@@ -13,6 +15,10 @@ from arklex.exceptions import ToolExecutionError, AuthenticationError
 
 logger = logging.getLogger(__name__)
 
+# Bounds the number of concurrent slot verification LLM calls
+SLOT_VERIFICATION_MAX_WORKERS = int(os.getenv("SLOT_VERIFICATION_MAX_WORKERS", 8))
+_verification_pool = ThreadPoolExecutor(max_workers=SLOT_VERIFICATION_MAX_WORKERS, thread_name_prefix="slot-verify")
+
     
 def register_tool(desc, slots=[], outputs=[], isResponse=False):
     current_file_dir = os.path.dirname(__file__)
@@ -80,7 +86,7 @@ class Tool:
         
         logger.info(f'Slots after initialization are: {self.slots}')
         
-    def _execute(self, state: MessageState, **fixed_args):
+    def _load_slots(self, state: MessageState):
         # if this tool has been called before, then load the previous slots status
         if state.slots.get(self.name):
             self.slots = state.slots[self.name]
@@ -88,71 +94,81 @@ class Tool:
             state.slots[self.name] = self.slots
         # init slot values saved in default slots
         self._init_slots(state)
-        # do slotfilling
-        chat_history_str = format_chat_history(state.function_calling_trajectory)
-        slots : list[Slot] = self.slotfillapi.execute(self.slots, chat_history_str)
-        logger.info(f'{slots=}')
-        if not all([slot.value and slot.verified for slot in slots if slot.required]):
-            for slot in slots:
-                # if there is extracted slots values but haven't been verified
-                if slot.value and not slot.verified:
-                    # check whether it verified or not
-                    verification_needed, thought = self.slotfillapi.verify_needed(slot, chat_history_str)
-                    if verification_needed:
-                        response = slot.prompt + "The reason is: " + thought
-                        break
-                    else:
-                        slot.verified = True
-                # if there is no extracted slots values, then should prompt the user to fill the slot
-                if not slot.value:
-                    response = slot.prompt
-                    break
-            
-            state.status = StatusEnum.INCOMPLETE
 
-        # if slot.value is not empty for all slots, and all the slots has been verified, then execute the function
+    @staticmethod
+    def _pending_verifications(slots: list[Slot]) -> list[Slot]:
+        """Slots whose verification can decide the prompt: filled but unverified slots before the first empty one."""
+        pending = []
+        for slot in slots:
+            if not slot.value:
+                break
+            if not slot.verified:
+                pending.append(slot)
+        return pending
+
+    @staticmethod
+    def _apply_verifications(slots: list[Slot], verifications: dict):
+        """Walk the slots in order with the verification results and return the prompt for the user, if any.
+
+        verifications maps id(slot) to the (verification_needed, thought) pair of that slot.
+        """
+        for slot in slots:
+            # if there is extracted slots values but haven't been verified
+            if slot.value and not slot.verified:
+                verification_needed, thought = verifications[id(slot)]
+                if verification_needed:
+                    return slot.prompt + "The reason is: " + thought
+                slot.verified = True
+            # if there is no extracted slots values, then should prompt the user to fill the slot
+            if not slot.value:
+                return slot.prompt
+        return None
+
+    def _call_function(self, slots: list[Slot], **fixed_args):
+        kwargs = {slot.name: slot.value for slot in slots}
+        combined_kwargs = {**kwargs, **fixed_args}
         tool_success = False
-        if all([slot.value and slot.verified for slot in slots if slot.required]):
-            logger.info("all slots filled")
-            kwargs = {slot.name: slot.value for slot in slots}
-            combined_kwargs = {**kwargs, **fixed_args}
-            try:
-                response = self.func(**combined_kwargs)
-                tool_success = True
-            except ToolExecutionError as tee:
-                logger.error(traceback.format_exc())
-                response = tee.extra_message
-            except AuthenticationError as ae:
-                logger.error(traceback.format_exc())
-                response = str(ae)
-            except Exception as e:
-                logger.error(traceback.format_exc())
-                response = str(e)
-            logger.info(f"Tool {self.name} response: {response}")
-            call_id = str(uuid.uuid4())
-            state.function_calling_trajectory.append({
-                'content': None, 
-                'role': 'assistant', 
-                'tool_calls': [
-                    {
-                        'function': {
-                            'arguments': json.dumps(kwargs), 
-                            'name': self.name
-                        }, 
-                        'id': call_id, 
-                        'type': 'function'
-                    }
-                ], 
-                'function_call': None
-            })
-            state.function_calling_trajectory.append({
-                "role": "tool",
-                "tool_call_id": call_id,
-                "name": self.name,
-                "content": response
-            })
-            state.status = StatusEnum.COMPLETE if tool_success else StatusEnum.INCOMPLETE
+        try:
+            response = self.func(**combined_kwargs)
+            tool_success = True
+        except ToolExecutionError as tee:
+            logger.error(traceback.format_exc())
+            response = tee.extra_message
+        except AuthenticationError as ae:
+            logger.error(traceback.format_exc())
+            response = str(ae)
+        except Exception as e:
+            logger.error(traceback.format_exc())
+            response = str(e)
+        logger.info(f"Tool {self.name} response: {response}")
+        return kwargs, response, tool_success
 
+    def _record_function_call(self, state: MessageState, kwargs: dict, response, tool_success: bool):
+        call_id = str(uuid.uuid4())
+        state.function_calling_trajectory.append({
+            'content': None, 
+            'role': 'assistant', 
+            'tool_calls': [
+                {
+                    'function': {
+                        'arguments': json.dumps(kwargs), 
+                        'name': self.name
+                    }, 
+                    'id': call_id, 
+                    'type': 'function'
+                }
+            ], 
+            'function_call': None
+        })
+        state.function_calling_trajectory.append({
+            "role": "tool",
+            "tool_call_id": call_id,
+            "name": self.name,
+            "content": response
+        })
+        state.status = StatusEnum.COMPLETE if tool_success else StatusEnum.INCOMPLETE
+
+    def _finalize(self, state: MessageState, slots: list[Slot], response, tool_success: bool):
         state.trajectory[-1][-1].input = slots
         state.trajectory[-1][-1].output = response
 
@@ -163,10 +179,67 @@ class Tool:
             state.message_flow = state.message_flow + f"Context from {self.name} tool execution: {response}\n"
         state.slots[self.name] = slots
         return state
+        
+    def _execute(self, state: MessageState, **fixed_args):
+        self._load_slots(state)
+        # do slotfilling
+        chat_history_str = format_chat_history(state.function_calling_trajectory)
+        slots : list[Slot] = self.slotfillapi.execute(self.slots, chat_history_str)
+        logger.info(f'{slots=}')
+        response = None
+        if not all([slot.value and slot.verified for slot in slots if slot.required]):
+            pending = self._pending_verifications(slots)
+            results = list(_verification_pool.map(
+                lambda slot: self.slotfillapi.verify_needed(slot, chat_history_str), pending
+            ))
+            response = self._apply_verifications(slots, dict(zip(map(id, pending), results)))
+            state.status = StatusEnum.INCOMPLETE
+
+        # if slot.value is not empty for all slots, and all the slots has been verified, then execute the function
+        tool_success = False
+        if all([slot.value and slot.verified for slot in slots if slot.required]):
+            logger.info("all slots filled")
+            kwargs, response, tool_success = self._call_function(slots, **fixed_args)
+            self._record_function_call(state, kwargs, response, tool_success)
+
+        return self._finalize(state, slots, response, tool_success)
+
+    async def _aexecute(self, state: MessageState, **fixed_args):
+        self._load_slots(state)
+        # do slotfilling
+        chat_history_str = format_chat_history(state.function_calling_trajectory)
+        slots : list[Slot] = await self.slotfillapi.aexecute(self.slots, chat_history_str)
+        logger.info(f'{slots=}')
+        response = None
+        if not all([slot.value and slot.verified for slot in slots if slot.required]):
+            pending = self._pending_verifications(slots)
+            semaphore = asyncio.Semaphore(SLOT_VERIFICATION_MAX_WORKERS)
+
+            async def verify(slot):
+                async with semaphore:
+                    return await self.slotfillapi.averify_needed(slot, chat_history_str)
+
+            results = await asyncio.gather(*[verify(slot) for slot in pending])
+            response = self._apply_verifications(slots, dict(zip(map(id, pending), results)))
+            state.status = StatusEnum.INCOMPLETE
+
+        # if slot.value is not empty for all slots, and all the slots has been verified, then execute the function
+        tool_success = False
+        if all([slot.value and slot.verified for slot in slots if slot.required]):
+            logger.info("all slots filled")
+            # tool functions are synchronous (e.g. SDK calls), so keep them off the event loop
+            kwargs, response, tool_success = await asyncio.to_thread(self._call_function, slots, **fixed_args)
+            self._record_function_call(state, kwargs, response, tool_success)
+
+        return self._finalize(state, slots, response, tool_success)
 
     def execute(self, state: MessageState, **fixed_args):
         state = self._execute(state, **fixed_args)
         return state
+
+    async def aexecute(self, state: MessageState, **fixed_args):
+        state = await self._aexecute(state, **fixed_args)
+        return state
     
     def __str__(self):
         return f"{self.__class__.__name__}"
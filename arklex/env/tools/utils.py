@@ -2,15 +2,13 @@ import logging
 import inspect
 
 from langchain.prompts import PromptTemplate
-from langchain_openai import ChatOpenAI
 from langchain_core.output_parsers import StrOutputParser
 
 from arklex.env.prompts import load_prompts
 from arklex.types import EventType
-from arklex.utils.utils import chunk_string
+from arklex.utils.utils import build_prompt
 from arklex.utils.graph_state import MessageState
-from arklex.utils.model_config import MODEL
-from arklex.utils.model_provider_config import PROVIDER_MAP
+from arklex.utils.model_provider_config import get_llm
 
 
 logger = logging.getLogger(__name__)
@@ -18,27 +16,20 @@ logger = logging.getLogger(__name__)
 
 class ToolGenerator():
     @staticmethod
-    def generate(state: MessageState):
+    def _chain():
+        return get_llm(temperature=0.1) | StrOutputParser()
+
+    @staticmethod
+    def _prepare_prompt(state: MessageState):
+        """Return the chunked prompt of the generator without context."""
         user_message = state.user_message
-        
         prompts = load_prompts(state.bot_config)
-        llm = PROVIDER_MAP.get(MODEL['llm_provider'], ChatOpenAI)(
-            model=MODEL["model_type_or_path"], timeout=30000, temperature=0.1
-        )
         prompt = PromptTemplate.from_template(prompts["generator_prompt"])
-        input_prompt = prompt.invoke({"sys_instruct": state.sys_instruct, "formatted_chat": user_message.history})
-        chunked_prompt = chunk_string(input_prompt.text, tokenizer=MODEL["tokenizer"], max_length=MODEL["context"])
-        final_chain = llm | StrOutputParser()
-        answer = final_chain.invoke(chunked_prompt)
-
-        state.response = answer
-        return state
+        return build_prompt(prompt, {"sys_instruct": state.sys_instruct, "formatted_chat": user_message.history}, user_message.turns)
 
     @staticmethod
-    def context_generate(state: MessageState):
-        llm = PROVIDER_MAP.get(MODEL['llm_provider'], ChatOpenAI)(
-            model=MODEL["model_type_or_path"], timeout=30000, temperature=0.1
-        )
+    def _prepare_context_prompt(state: MessageState):
+        """Return the chunked prompt of the generator answering from the retrieved texts in the message flow."""
         # get the input message
         user_message = state.user_message
         message_flow = state.message_flow
@@ -47,68 +38,79 @@ class ToolGenerator():
         # generate answer based on the retrieved texts
         prompts = load_prompts(state.bot_config)
         prompt = PromptTemplate.from_template(prompts["context_generator_prompt"])
-        input_prompt = prompt.invoke({"sys_instruct": state.sys_instruct, "formatted_chat": user_message.history, "context": message_flow})
-        chunked_prompt = chunk_string(input_prompt.text, tokenizer=MODEL["tokenizer"], max_length=MODEL["context"])
-        final_chain = llm | StrOutputParser()
-        logger.info(f"Prompt: {input_prompt.text}")
-        answer = final_chain.invoke(chunked_prompt)
+        chunked_prompt = build_prompt(prompt, {"sys_instruct": state.sys_instruct, "formatted_chat": user_message.history, "context": message_flow}, user_message.turns)
+        logger.info(f"Prompt: {chunked_prompt}")
+        return chunked_prompt
+
+    @staticmethod
+    def _context_answer(state: MessageState, answer: str, name: str):
         state.message_flow = ""
         state.response = answer
-        state = trace(input=answer, state=state)
+        return trace(input=answer, state=state, name=name)
+
+    @staticmethod
+    def generate(state: MessageState):
+        state.response = ToolGenerator._chain().invoke(ToolGenerator._prepare_prompt(state))
         return state
+
+    @staticmethod
+    def context_generate(state: MessageState):
+        answer = ToolGenerator._chain().invoke(ToolGenerator._prepare_context_prompt(state))
+        return ToolGenerator._context_answer(state, answer, "context_generate")
     
     @staticmethod
     def stream_context_generate(state: MessageState):
-        llm = PROVIDER_MAP.get(MODEL['llm_provider'], ChatOpenAI)(
-            model=MODEL["model_type_or_path"], timeout=30000, temperature=0.1
-        )
-        # get the input message
-        user_message = state.user_message
-        message_flow = state.message_flow
-        logger.info(f"Retrieved texts (from retriever/search engine to generator): {message_flow[:50]} ...")
-        
-        # generate answer based on the retrieved texts
-        prompts = load_prompts(state.bot_config)
-        prompt = PromptTemplate.from_template(prompts["context_generator_prompt"])
-        input_prompt = prompt.invoke({"sys_instruct": state.sys_instruct, "formatted_chat": user_message.history, "context": message_flow})
-        chunked_prompt = chunk_string(input_prompt.text, tokenizer=MODEL["tokenizer"], max_length=MODEL["context"])
-        final_chain = llm | StrOutputParser()
-        logger.info(f"Prompt: {input_prompt.text}")
         answer = ""
-        for chunk in final_chain.stream(chunked_prompt):
+        for chunk in ToolGenerator._chain().stream(ToolGenerator._prepare_context_prompt(state)):
             answer += chunk
             state.message_queue.put({"event": EventType.CHUNK.value, "message_chunk": chunk})
-
-        state.message_flow = ""
-        state.response = answer
-        state = trace(input=answer, state=state)
-        return state
+        return ToolGenerator._context_answer(state, answer, "stream_context_generate")
     
     @staticmethod
     def stream_generate(state: MessageState):
-        user_message = state.user_message
-        
-        prompts = load_prompts(state.bot_config)
-        llm = PROVIDER_MAP.get(MODEL['llm_provider'], ChatOpenAI)(
-            model=MODEL["model_type_or_path"], timeout=30000, temperature=0.1
-        )
-        prompt = PromptTemplate.from_template(prompts["generator_prompt"])
-        input_prompt = prompt.invoke({"sys_instruct": state.sys_instruct, "formatted_chat": user_message.history})
-        chunked_prompt = chunk_string(input_prompt.text, tokenizer=MODEL["tokenizer"], max_length=MODEL["context"])
-        final_chain = llm | StrOutputParser()
         answer = ""
-        for chunk in final_chain.stream(chunked_prompt):
+        for chunk in ToolGenerator._chain().stream(ToolGenerator._prepare_prompt(state)):
             answer += chunk
             state.message_queue.put({"event": EventType.CHUNK.value, "message_chunk": chunk})
+        state.response = answer
+        return state
 
+    @staticmethod
+    async def agenerate(state: MessageState):
+        state.response = await ToolGenerator._chain().ainvoke(ToolGenerator._prepare_prompt(state))
+        return state
+
+    @staticmethod
+    async def acontext_generate(state: MessageState):
+        answer = await ToolGenerator._chain().ainvoke(ToolGenerator._prepare_context_prompt(state))
+        return ToolGenerator._context_answer(state, answer, "context_generate")
+
+    @staticmethod
+    async def astream_context_generate(state: MessageState):
+        answer = ""
+        async for chunk in ToolGenerator._chain().astream(ToolGenerator._prepare_context_prompt(state)):
+            answer += chunk
+            # put_nowait works for both the sync and the async side of a janus queue
+            state.message_queue.put_nowait({"event": EventType.CHUNK.value, "message_chunk": chunk})
+        return ToolGenerator._context_answer(state, answer, "stream_context_generate")
+
+    @staticmethod
+    async def astream_generate(state: MessageState):
+        answer = ""
+        async for chunk in ToolGenerator._chain().astream(ToolGenerator._prepare_prompt(state)):
+            answer += chunk
+            state.message_queue.put_nowait({"event": EventType.CHUNK.value, "message_chunk": chunk})
         state.response = answer
         return state
 
 
-def trace(input, state):
-    current_frame = inspect.currentframe()
-    previous_frame = current_frame.f_back if current_frame else None
-    previous_function_name = previous_frame.f_code.co_name if previous_frame else "unknown"
-    response_meta = {previous_function_name: input}
+def trace(input, state, name=None):
+    """Record input as a step of the current turn, under name or else the name of the calling function.
+    The async twins of a function pass the name of the sync one, so both record the same trajectory."""
+    if name is None:
+        current_frame = inspect.currentframe()
+        previous_frame = current_frame.f_back if current_frame else None
+        name = previous_frame.f_code.co_name if previous_frame else "unknown"
+    response_meta = {name: input}
     state.trajectory[-1][-1].steps.append(response_meta)
     return state
\ No newline at end of file
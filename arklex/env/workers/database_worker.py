@@ -1,7 +1,6 @@
 import logging
 
 from langgraph.graph import StateGraph, START
-from langchain_openai import ChatOpenAI
 from langchain.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 
@@ -12,6 +11,7 @@ from arklex.env.tools.database.utils import DatabaseActions
 from arklex.utils.utils import chunk_string
 from arklex.utils.graph_state import MessageState
 from arklex.utils.model_config import MODEL
+from arklex.utils.model_provider_config import get_llm
 
 
 
@@ -24,7 +24,7 @@ class DataBaseWorker(BaseWorker):
     description = "Help the user with actions related to customer support like a booking system with structured data, always involving search, insert, update, and delete operations."
 
     def __init__(self):
-        self.llm = ChatOpenAI(model=MODEL["model_type_or_path"], timeout=30000)
+        self.llm = get_llm()
         self.actions = {
             "SearchShow": "Search for shows", 
             "BookShow": "Book a show", 
@@ -90,6 +90,6 @@ class DataBaseWorker(BaseWorker):
     def _execute(self, msg_state: MessageState):
         self.DBActions.log_in()
         msg_state.slots = self.DBActions.init_slots(msg_state.slots, msg_state.bot_config)
-        graph = self.action_graph.compile()
+        graph = self.get_graph()
         result = graph.invoke(msg_state)
         return result
@@ -3,14 +3,13 @@ import os
 from typing import Any, Iterator, Union
 
 from langgraph.graph import StateGraph, START
-from langchain_openai import ChatOpenAI
+from langchain_core.runnables import RunnableLambda
 
 from arklex.env.workers.worker import BaseWorker, register_worker
 from arklex.utils.graph_state import MessageState
 from arklex.env.tools.utils import ToolGenerator
-from arklex.env.tools.RAG.retrievers.faiss_retriever import RetrieveEngine
-from arklex.utils.model_config import MODEL
-from arklex.utils.model_provider_config import PROVIDER_MAP
+from arklex.env.tools.RAG.retrievers.faiss_retriever import FaissRetrieverExecutor, RetrieveEngine
+from arklex.utils.model_provider_config import get_llm
 
 
 logger = logging.getLogger(__name__)
@@ -20,6 +19,7 @@ logger = logging.getLogger(__name__)
 class FaissRAGWorker(BaseWorker):
 
     description = "Answer the user's questions based on the company's internal documentations (unstructured text data), such as the policies, FAQs, and product information"
+    reusable = True
 
     def __init__(self,
                  # stream_ reponse is a boolean value that determines whether the response should be streamed or not.
@@ -27,10 +27,11 @@ class FaissRAGWorker(BaseWorker):
                  stream_response: bool = True):
         super().__init__()
         self.action_graph = self._create_action_graph()
-        self.llm = PROVIDER_MAP.get(MODEL['llm_provider'], ChatOpenAI)(
-            model=MODEL["model_type_or_path"], timeout=30000
-        )
+        self.llm = get_llm()
         self.stream_response = stream_response
+        # report a missing index when the worker starts rather than on its first turn
+        if os.environ.get("DATA_DIR"):
+            FaissRetrieverExecutor.check_index(os.environ["DATA_DIR"])
 
     def choose_tool_generator(self, state: MessageState):
         if self.stream_response and state.is_stream:
@@ -40,9 +41,9 @@ class FaissRAGWorker(BaseWorker):
     def _create_action_graph(self):
         workflow = StateGraph(MessageState)
         # Add nodes for each worker
-        workflow.add_node("retriever", RetrieveEngine.faiss_retrieve)
-        workflow.add_node("tool_generator", ToolGenerator.context_generate)
-        workflow.add_node("stream_tool_generator", ToolGenerator.stream_context_generate)
+        workflow.add_node("retriever", RunnableLambda(RetrieveEngine.faiss_retrieve, afunc=RetrieveEngine.afaiss_retrieve))
+        workflow.add_node("tool_generator", RunnableLambda(ToolGenerator.context_generate, afunc=ToolGenerator.acontext_generate))
+        workflow.add_node("stream_tool_generator", RunnableLambda(ToolGenerator.stream_context_generate, afunc=ToolGenerator.astream_context_generate))
 
         # Add edges
         workflow.add_edge(START, "retriever")
@@ -51,6 +52,11 @@ class FaissRAGWorker(BaseWorker):
         return workflow
 
     def _execute(self, msg_state: MessageState):
-        graph = self.action_graph.compile()
+        graph = self.get_graph()
         result = graph.invoke(msg_state)
         return result
+
+    async def _aexecute(self, msg_state: MessageState):
+        graph = self.get_graph()
+        result = await graph.ainvoke(msg_state)
+        return result
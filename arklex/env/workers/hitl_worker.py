@@ -85,6 +85,8 @@ class HITLWorker(BaseWorker):
             case "chat":
                 chat_result = self.chat(state)
                 state.user_message.history += ('\n' + chat_result)
+                # the live chat is not split into messages, let the prompts use the whole history
+                state.user_message.turns = []
                 state.user_message.message = chat_result.split(f'{self.name}: ')[-1].split(':')[0]
                 result = "Live Chat Completed"
 
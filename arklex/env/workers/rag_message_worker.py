@@ -2,7 +2,6 @@ import logging
 from typing import Any, Iterator, Union
 
 from langgraph.graph import StateGraph, START
-from langchain_openai import ChatOpenAI
 from langchain.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 
@@ -11,9 +10,9 @@ from arklex.env.tools.RAG.retrievers.milvus_retriever import RetrieveEngine
 from arklex.env.prompts import load_prompts
 from arklex.env.workers.message_worker import MessageWorker
 from arklex.env.workers.milvus_rag_worker import MilvusRAGWorker
-from arklex.utils.utils import chunk_string
+from arklex.utils.utils import build_prompt
 from arklex.utils.graph_state import MessageState
-from arklex.utils.model_config import MODEL
+from arklex.utils.model_provider_config import get_llm
 
 
 logger = logging.getLogger(__name__)
@@ -23,18 +22,18 @@ logger = logging.getLogger(__name__)
 class RagMsgWorker(BaseWorker):
 
     description = "A combination of RAG and Message Workers"
+    reusable = True
 
     def __init__(self):
         super().__init__()
         self.action_graph = self._create_action_graph()
-        self.llm = ChatOpenAI(model=MODEL["model_type_or_path"], timeout=30000)
+        self.llm = get_llm()
 
     def _choose_retriever(self, state: MessageState):
         prompts = load_prompts(state.bot_config)
         prompt = PromptTemplate.from_template(prompts["retrieval_needed_prompt"])
-        input_prompt = prompt.invoke({"formatted_chat": state.user_message.history})
-        logger.info(f"Prompt for choosing the retriever in RagMsgWorker: {input_prompt.text}")
-        chunked_prompt = chunk_string(input_prompt.text, tokenizer=MODEL["tokenizer"], max_length=MODEL["context"])
+        chunked_prompt = build_prompt(prompt, {"formatted_chat": state.user_message.history}, state.user_message.turns)
+        logger.info(f"Prompt for choosing the retriever in RagMsgWorker: {chunked_prompt}")
         final_chain = self.llm | StrOutputParser()
         answer = final_chain.invoke(chunked_prompt)
         logger.info(f"Choose retriever in RagMsgWorker: {answer}")
@@ -55,6 +54,6 @@ class RagMsgWorker(BaseWorker):
         return workflow
 
     def _execute(self, msg_state: MessageState):
-        graph = self.action_graph.compile()
+        graph = self.get_graph()
         result = graph.invoke(msg_state)
         return result
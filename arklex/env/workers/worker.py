@@ -1,3 +1,4 @@
+import asyncio
 from abc import ABC, abstractmethod
 from arklex.utils.graph_state import MessageState, StatusEnum
 import logging
@@ -14,6 +15,9 @@ def register_worker(cls):
 class BaseWorker(ABC):
     
     description = None
+    # Reusable workers keep no per-call state on the instance, so Env creates them once and shares them
+    # between steps and concurrent requests. Workers that hold state across a call must leave this False.
+    reusable = False
 
     def __str__(self):
         return f"{self.__class__.__name__}"
@@ -25,15 +29,39 @@ class BaseWorker(ABC):
     def _execute(self, msg_state: MessageState):
         pass
 
+    def get_graph(self):
+        """Compile self.action_graph on first use and reuse the compiled graph afterwards."""
+        graph = getattr(self, "_compiled_graph", None)
+        if graph is None:
+            graph = self.action_graph.compile()
+            self._compiled_graph = graph
+        return graph
+
+    async def _aexecute(self, msg_state: MessageState):
+        """Async counterpart of _execute. Workers without a native async path run _execute in a thread."""
+        return await asyncio.to_thread(self._execute, msg_state)
+
+    def _postprocess(self, response_return):
+        response_state = MessageState.model_validate(response_return)
+        response_state.trajectory[-1][-1].output = response_state.response if response_state.response else response_state.message_flow
+        if response_state.status == StatusEnum.INCOMPLETE:
+            response_state.status = StatusEnum.COMPLETE
+        return response_state
+
     def execute(self, msg_state: MessageState):
         try:
             response_return = self._execute(msg_state)
-            response_state = MessageState.model_validate(response_return)
-            response_state.trajectory[-1][-1].output = response_state.response if response_state.response else response_state.message_flow
-            if response_state.status == StatusEnum.INCOMPLETE:
-                response_state.status = StatusEnum.COMPLETE
-            return response_state
+            return self._postprocess(response_return)
+        except Exception as e:
+            logger.error(traceback.format_exc())
+            msg_state.status = StatusEnum.INCOMPLETE
+            return msg_state
+
+    async def aexecute(self, msg_state: MessageState):
+        try:
+            response_return = await self._aexecute(msg_state)
+            return self._postprocess(response_return)
         except Exception as e:
             logger.error(traceback.format_exc())
             msg_state.status = StatusEnum.INCOMPLETE
-            return msg_state
\ No newline at end of file
+            return msg_state
@@ -1,12 +1,11 @@
 import os
 import sys
 import json
-import pickle
-from pathlib import Path
 from os.path import dirname, abspath
 
 sys.path.insert(0, dirname(dirname(abspath(__file__))))
 from arklex.utils.loader import Loader, CrawledURLObject
+from arklex.utils.document_store import documents_exist, load_documents
 
 def get_domain_info(documents):
     summary = None
@@ -22,16 +21,16 @@ def load_docs(document_dir, doc_config, limit=10):
             raise ValueError("The config json file must have a key 'rag_docs' or 'task_docs' with a list of documents to load.")
         else:
             rag_docs = doc_config['task_docs']
-            filename = "task_documents.pkl"
+            filename = "task_documents"
     else:
         rag_docs = doc_config['rag_docs']
-        filename = "documents.pkl"
+        filename = "documents"
     if document_dir is not None:
         filepath = os.path.join(document_dir, filename)
         total_num_docs = sum([doc.get("num") if doc.get("num") else 1 for doc in rag_docs])
         loader = Loader()
-        if Path(filepath).exists():
-            docs = pickle.load(open(os.path.join(document_dir, filename), "rb"))
+        if documents_exist(filepath):
+            docs = load_documents(filepath)
         else:
             docs = []
             for doc in rag_docs:
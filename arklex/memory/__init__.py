@@ -0,0 +1,2 @@
+from arklex.memory.session_store import SessionStore, InMemorySessionStore, SQLiteSessionStore
+from arklex.memory.summary import RollingSummaryMemory
@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import logging
+import threading
+import collections
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+from arklex.utils.graph_state import Params
+from arklex.utils.slot import Slot
+
+
+logger = logging.getLogger(__name__)
+
+SESSION_MAX_SIZE = int(os.getenv("SESSION_MAX_SIZE", 10000))
+SESSION_TTL = float(os.getenv("SESSION_TTL", 24 * 3600))
+# seconds between two deletions of the expired sessions of a SQLite store
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", 60))
+
+
+class SessionStore(ABC):
+    """Server-side storage of the conversations handled by an AgentOrg, keyed by chat_id.
+
+    A session holds the chat history (the user/assistant messages the clients used to send) and the
+    Params of the chat, which include the dialog states of the tools. get returns fresh objects, so
+    concurrent requests never share state through the store.
+    """
+
+    @abstractmethod
+    def get(self, chat_id: str) -> Optional[Tuple[List[dict], Params]]:
+        """Return (history, params) of the chat, None if it does not exist or has expired."""
+        pass
+
+    @abstractmethod
+    def put(self, chat_id: str, history: List[dict], params: Params):
+        pass
+
+    @abstractmethod
+    def delete(self, chat_id: str):
+        pass
+
+    def get_dialog_states(self, chat_id: str) -> Optional[Dict[str, List[Slot]]]:
+        session = self.get(chat_id)
+        if session is None:
+            return None
+        return session[1].taskgraph.dialog_states
+
+
+class InMemorySessionStore(SessionStore):
+    """Keeps the sessions in process, evicting the least recently used one above maxsize and
+    the ones that were not updated for ttl seconds.
+
+    Params are stored with Params.encode, so a session costs its compressed size.
+    """
+    def __init__(self, maxsize: int = SESSION_MAX_SIZE, ttl: Optional[float] = SESSION_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._sessions = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expired(self, updated_at: float) -> bool:
+        return bool(self.ttl) and time.time() - updated_at > self.ttl
+
+    def get(self, chat_id: str) -> Optional[Tuple[List[dict], Params]]:
+        with self._lock:
+            session = self._sessions.get(chat_id)
+            if session is None:
+                return None
+            updated_at, history, params = session
+            if self._expired(updated_at):
+                del self._sessions[chat_id]
+                return None
+            self._sessions.move_to_end(chat_id)
+        return list(history), Params.decode(params)
+
+    def put(self, chat_id: str, history: List[dict], params: Params):
+        session = (time.time(), list(history), params.encode())
+        with self._lock:
+            self._sessions[chat_id] = session
+            self._sessions.move_to_end(chat_id)
+            while len(self._sessions) > self.maxsize:
+                self._sessions.popitem(last=False)
+            # sessions are ordered by last use, so the expired ones are at the front
+            while self._sessions:
+                oldest = next(iter(self._sessions))
+                if not self._expired(self._sessions[oldest][0]):
+                    break
+                self._sessions.popitem(last=False)
+
+    def delete(self, chat_id: str):
+        with self._lock:
+            self._sessions.pop(chat_id, None)
+
+
+class SQLiteSessionStore(SessionStore):
+    """Keeps the sessions in a SQLite database in WAL mode, so that they survive restarts and can be
+    shared by the worker processes of one host.
+
+    The dialog states are also stored in their own column so they can be read without decoding the Params.
+    The sessions not updated for ttl seconds are deleted by put, at most every SESSION_SWEEP_INTERVAL seconds.
+    """
+    def __init__(self, db_path: str, ttl: Optional[float] = SESSION_TTL):
+        self.db_path = db_path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._next_sweep = 0.0
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "chat_id TEXT PRIMARY KEY, "
+                "history BLOB NOT NULL, "
+                "params BLOB NOT NULL, "
+                "dialog_states TEXT NOT NULL, "
+                "updated_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 connections cannot be shared between threads, keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _valid(self, updated_at: float) -> bool:
+        return not self.ttl or time.time() - updated_at <= self.ttl
+
+    def get(self, chat_id: str) -> Optional[Tuple[List[dict], Params]]:
+        row = self._connect().execute(
+            "SELECT history, params, updated_at FROM sessions WHERE chat_id = ?", (chat_id,)
+        ).fetchone()
+        if row is None or not self._valid(row[2]):
+            return None
+        history = json.loads(zlib.decompress(row[0]))
+        return history, Params.decode(row[1])
+
+    def put(self, chat_id: str, history: List[dict], params: Params):
+        dialog_states = params.taskgraph.model_dump(mode="json", include={"dialog_states"})["dialog_states"]
+        now = time.time()
+        with self._connect() as conn:
+            if self.ttl and now >= self._next_sweep:
+                self._next_sweep = now + SESSION_SWEEP_INTERVAL
+                deleted = conn.execute("DELETE FROM sessions WHERE updated_at < ?", (now - self.ttl,)).rowcount
+                if deleted:
+                    logger.info(f"Deleted {deleted} expired sessions")
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (chat_id, history, params, dialog_states, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (
+                    chat_id,
+                    zlib.compress(json.dumps(history).encode("utf-8")),
+                    params.encode(),
+                    json.dumps(dialog_states),
+                    now,
+                ),
+            )
+
+    def delete(self, chat_id: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM sessions WHERE chat_id = ?", (chat_id,))
+
+    def get_dialog_states(self, chat_id: str) -> Optional[Dict[str, List[Slot]]]:
+        row = self._connect().execute(
+            "SELECT dialog_states, updated_at FROM sessions WHERE chat_id = ?", (chat_id,)
+        ).fetchone()
+        if row is None or not self._valid(row[1]):
+            return None
+        dialog_states = json.loads(row[0])
+        if not isinstance(dialog_states, dict):
+            return dialog_states
+        return {name: [Slot.model_validate(slot) for slot in slots] for name, slots in dialog_states.items()}
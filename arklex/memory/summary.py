@@ -0,0 +1,116 @@
+import os
+import logging
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from langchain.prompts import PromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+
+from arklex.env.prompts import load_prompts
+from arklex.utils.graph_state import BotConfig, Params
+from arklex.utils.model_provider_config import get_llm
+from arklex.utils.utils import build_prompt, format_chat_history
+
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_MAX_WORKERS = int(os.getenv("SUMMARY_MAX_WORKERS", 4))
+# summaries computed but not yet picked up by the next turn of their chat
+SUMMARY_MAX_PENDING = int(os.getenv("SUMMARY_MAX_PENDING", 10000))
+
+SUMMARY_ROLE = "system"
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+
+# shared by all the orchestrators of the process, the pending summaries are keyed by chat_id
+_summary_pool = ThreadPoolExecutor(max_workers=SUMMARY_MAX_WORKERS, thread_name_prefix="summary")
+_pending = collections.OrderedDict()
+_pending_lock = threading.Lock()
+
+
+def is_summary_message(message: dict) -> bool:
+    return message.get("role") == SUMMARY_ROLE and str(message.get("content", "")).startswith(SUMMARY_PREFIX)
+
+
+class RollingSummaryMemory:
+    """Keeps the last keep_turns user turns of a conversation verbatim and folds the older ones into a
+    rolling summary stored in Params.memory, so the prompts stay roughly the same size in long sessions.
+
+    The summary is updated in the background: schedule submits the LLM call after a turn, once at least
+    summarize_every turns are out of the window, and apply picks up the result when the next turn of
+    the chat starts. No turn waits for the summarization; until it is done the turns stay verbatim.
+    """
+    def __init__(self, keep_turns: int = 4, summarize_every: int = 2, user_prefix: str = "user"):
+        self.keep_turns = keep_turns
+        self.summarize_every = max(summarize_every, 1)
+        self.user_prefix = user_prefix
+
+    def _user_turn_starts(self, messages: List[dict]) -> List[int]:
+        return [i for i, msg in enumerate(messages) if msg.get("role") == self.user_prefix]
+
+    def apply(self, params: Params) -> Params:
+        """Store the summary computed in the background for the chat of params, if it is ready."""
+        chat_id = params.metadata.chat_id
+        with _pending_lock:
+            future = _pending.get(chat_id)
+            if future is None or not future.done():
+                return params
+            del _pending[chat_id]
+        try:
+            summary, summarized_upto = future.result()
+        except Exception as err:
+            logger.error(f"Failed to summarize the conversation {chat_id}: {err}")
+            return params
+        if summarized_upto > params.memory.summarized_upto:
+            params.memory.summary = summary
+            params.memory.summarized_upto = summarized_upto
+        return params
+
+    def compact(self, messages: List[dict], params: Params, num_user_turns: Optional[int] = None) -> List[dict]:
+        """Replace the user turns of messages covered by the summary with a single summary message.
+
+        messages may be the tail of the conversation (e.g. the function calling trajectory), num_user_turns
+        is then the number of user turns of the whole conversation.
+        """
+        if not params.memory.summary:
+            return messages
+        messages = [msg for msg in messages if not is_summary_message(msg)]
+        starts = self._user_turn_starts(messages)
+        if num_user_turns is None:
+            num_user_turns = len(starts)
+        not_summarized = num_user_turns - params.memory.summarized_upto
+        if not_summarized < len(starts):
+            messages = messages[starts[-not_summarized]:] if not_summarized > 0 else []
+        return [{"role": SUMMARY_ROLE, "content": SUMMARY_PREFIX + params.memory.summary}] + messages
+
+    def schedule(self, history: List[dict], params: Params, bot_config: BotConfig):
+        """Start updating the summary with the turns of history that fell out of the window."""
+        starts = self._user_turn_starts(history)
+        summarized_upto = len(starts) - self.keep_turns
+        if summarized_upto - params.memory.summarized_upto < self.summarize_every:
+            return
+        chat_id = params.metadata.chat_id
+        # from the first turn not in the summary yet (or the greeting) to the first turn kept verbatim
+        start = starts[params.memory.summarized_upto] if params.memory.summarized_upto else 0
+        messages = history[start:starts[summarized_upto]]
+        with _pending_lock:
+            if chat_id in _pending:
+                return
+            _pending[chat_id] = _summary_pool.submit(
+                self._summarize, params.memory.summary, messages, summarized_upto, bot_config
+            )
+            while len(_pending) > SUMMARY_MAX_PENDING:
+                _pending.popitem(last=False)
+
+    @staticmethod
+    def _summarize(summary: str, messages: List[dict], summarized_upto: int, bot_config: BotConfig) -> Tuple[str, int]:
+        prompts = load_prompts(bot_config)
+        prompt = PromptTemplate.from_template(prompts["summarize_memory_prompt"])
+        chunked_prompt = build_prompt(
+            prompt, {"summary": summary or "None", "formatted_chat": format_chat_history(messages)}, messages
+        )
+        final_chain = get_llm(temperature=0.0) | StrOutputParser()
+        new_summary = final_chain.invoke(chunked_prompt).strip()
+        logger.info(f"Summarized the conversation up to user turn {summarized_upto}: {new_summary}")
+        return new_summary, summarized_upto
@@ -12,8 +12,7 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from arklex.utils.model_config import MODEL
-from arklex.utils.model_provider_config import PROVIDER_MAP
-from langchain_openai import ChatOpenAI
+from arklex.utils.model_provider_config import get_llm
 from pydantic_ai import Agent
 
 
@@ -28,13 +27,12 @@ class NLUModelAPI ():
     def get_response(self, sys_prompt, model, response_format="text", note="intent detection"):
         logger.info(f"Prompt for {note}: {sys_prompt}")
         dialog_history = [{"role": "system", "content": sys_prompt}]
-        kwargs = {'model': MODEL["model_type_or_path"], 'temperature': 0.7}
+        kwargs = {'temperature': 0.7}
         
         if MODEL['llm_provider'] != 'anthropic': kwargs['n'] = 1
-        llm = PROVIDER_MAP.get(MODEL['llm_provider'], ChatOpenAI)(**kwargs)
+        llm = get_llm(response_format="json" if response_format == "json" else "text", **kwargs)
 
         if MODEL['llm_provider'] == 'openai':
-            llm = llm.bind(response_format={"type": "json_object"} if response_format == "json" else {"type": "text"})
             res = llm.invoke(dialog_history)
         else:
             messages = [("user", f"{dialog_history[0]['content']} Only choose the option letter, no explanation.")]
@@ -42,6 +40,22 @@ class NLUModelAPI ():
         
         return res.content
 
+    async def aget_response(self, sys_prompt, model, response_format="text", note="intent detection"):
+        logger.info(f"Prompt for {note}: {sys_prompt}")
+        dialog_history = [{"role": "system", "content": sys_prompt}]
+        kwargs = {'temperature': 0.7}
+        
+        if MODEL['llm_provider'] != 'anthropic': kwargs['n'] = 1
+        llm = get_llm(response_format="json" if response_format == "json" else "text", **kwargs)
+
+        if MODEL['llm_provider'] == 'openai':
+            res = await llm.ainvoke(dialog_history)
+        else:
+            messages = [("user", f"{dialog_history[0]['content']} Only choose the option letter, no explanation.")]
+            res = await llm.ainvoke(messages)
+        
+        return res.content
+
     def format_input(self, intents, chat_history_str) -> str:
         """Format input text before feeding it to the model."""
         intents_choice, definition_str, exemplars_str = "", "", ""
@@ -123,6 +137,25 @@ class NLUModelAPI ():
         response = self.get_response(
             system_prompt, model, note="intent detection"
         )
+        return self.postprocess_response(response, idx2intents_mapping)
+
+    async def apredict(
+        self,
+        text,
+        intents,
+        chat_history_str,
+        model
+    ) -> str:
+
+        system_prompt, idx2intents_mapping = self.format_input(
+            intents, chat_history_str
+        )
+        response = await self.aget_response(
+            system_prompt, model, note="intent detection"
+        )
+        return self.postprocess_response(response, idx2intents_mapping)
+
+    def postprocess_response(self, response, idx2intents_mapping) -> str:
         logger.info(f"postprocessed intent response: {response}")
         try:
             pred_intent_idx = response.split(")")[0]
@@ -147,19 +180,18 @@ class SlotFillModelAPI():
             system_prompt = f"Given a user profile, extract the values for each defined slot type. Only extract values that are explicitly mentioned in the profile. If a value is not found, leave it empty.\n\nSlot definitions:\n{slots}\n\nUser profile:\n{input}\n\nFor each slot:\n1. Look for an exact match in the profile\n2. Only extract values that are clearly stated\n3. Do not make assumptions or infer values\n4. If a slot has enum values, the extracted value must match one of them exactly\n\nExtract the values:\n"
         return system_prompt
 
-    # get response from model
-    def get_response(self, sys_prompt, format, note="slot filling"):
+    def _slotfilling_model(self, sys_prompt, format, note="slot filling"):
+        """The model of the configured provider and its input, shared by get_response and aget_response."""
         logger.info(f"Prompt for {note}: {sys_prompt}")
         dialog_history = [{"role": "system", "content": sys_prompt}]
-        kwargs = {'model': MODEL["model_type_or_path"], 'temperature': 0.7}
+        kwargs = {'temperature': 0.7}
         # set number of chat completions to generate, isn't supported by Anthropic
         if MODEL['llm_provider'] != 'anthropic': kwargs['n'] = 1
-        llm = PROVIDER_MAP.get(MODEL['llm_provider'], ChatOpenAI)(**kwargs)
-        
+        llm = get_llm(**kwargs)
+
         if MODEL['llm_provider'] == 'openai':
-            llm = llm.with_structured_output(schema=format)
-            response = llm.invoke(dialog_history)
-    
+            return llm.with_structured_output(schema=format), dialog_history
+
         # TODO: fix slotfilling for huggingface
         elif MODEL['llm_provider']=='huggingface':
             # llm = llm.bind_tools([format])
@@ -168,17 +200,36 @@ class SlotFillModelAPI():
             raise NotImplementedError("Slotfilling for Huggingface is not implemented")
 
         elif MODEL['llm_provider'] == 'gemini':
-            agent = Agent(f"google-gla:{MODEL['model_type_or_path']}", result_type=format)
-            result = agent.run_sync(dialog_history[0]['content'])
-            response = result.data
+            return Agent(f"google-gla:{MODEL['model_type_or_path']}", result_type=format), dialog_history[0]['content']
 
         #for claude 
         else:
             messages = [{"role": "user", "content": dialog_history[0]['content']}]
-            llm = llm.bind_tools([format])
-            res= llm.invoke(messages)
-            response = format(**res.tool_calls[0]['args'])
-        return response
+            return llm.bind_tools([format]), messages
+
+    def _slotfilling_response(self, res, format):
+        if MODEL['llm_provider'] == 'openai':
+            return res
+        elif MODEL['llm_provider'] == 'gemini':
+            return res.data
+        return format(**res.tool_calls[0]['args'])
+
+    # get response from model
+    def get_response(self, sys_prompt, format, note="slot filling"):
+        model, model_input = self._slotfilling_model(sys_prompt, format, note)
+        if MODEL['llm_provider'] == 'gemini':
+            res = model.run_sync(model_input)
+        else:
+            res = model.invoke(model_input)
+        return self._slotfilling_response(res, format)
+
+    async def aget_response(self, sys_prompt, format, note="slot filling"):
+        model, model_input = self._slotfilling_model(sys_prompt, format, note)
+        if MODEL['llm_provider'] == 'gemini':
+            res = await model.run(model_input)
+        else:
+            res = await model.ainvoke(model_input)
+        return self._slotfilling_response(res, format)
 
     # endpoint for slot filling
     def predict(
@@ -193,6 +244,31 @@ class SlotFillModelAPI():
         filled_slots = format_slotfilling_output(slots, response)
         logger.info(f"Updated dialogue states: {filled_slots}")
         return filled_slots
+
+    async def apredict(
+        self,
+        slots: list[Slot],
+        input: str,
+        type: str = "chat"
+    ):
+        input_slots, output_slots = structured_input_output(slots)
+        system_prompt = self.format_input(input_slots, input, type)
+        response = await self.aget_response(system_prompt, output_slots, note="slot filling")
+        filled_slots = format_slotfilling_output(slots, response)
+        logger.info(f"Updated dialogue states: {filled_slots}")
+        return filled_slots
+
+    def format_verify_input(self, slot: dict, chat_history_str) -> str:
+        reformat_slot = {key: value for key, value in slot.items() if key in ["name", "type", "value", "enum", "description", "required"]}
+        system_prompt = f"Given the conversation, definition and extracted value of each dialog state, decide whether the following dialog states values need further verification from the user. Verification is needed for expressions which may cause confusion. If it is an accurate information extracted, no verification is needed. If there is a list of enum value, which means the value has to be chosen from the enum list. Only Return boolean value: True or False. \nDialogue Statues:\n{reformat_slot}\nConversation:\n{chat_history_str}\n\n"
+        return system_prompt
+
+    def postprocess_verification(self, response) -> Verification:
+        if not response: # no need to verification, we want to make sure it is really confident that we need to ask the question again
+            logger.info(f"Failed to verify dialogue states")
+            return Verification(verification_needed=False, thought="No need to verify")
+        logger.info(f"Verified dialogue states: {response}")
+        return response
     
     # endpoint for slot verification
     def verify(
@@ -200,16 +276,22 @@ class SlotFillModelAPI():
         slot: dict,
         chat_history_str,
     ) -> Verification:
-        reformat_slot = {key: value for key, value in slot.items() if key in ["name", "type", "value", "enum", "description", "required"]}
-        system_prompt = f"Given the conversation, definition and extracted value of each dialog state, decide whether the following dialog states values need further verification from the user. Verification is needed for expressions which may cause confusion. If it is an accurate information extracted, no verification is needed. If there is a list of enum value, which means the value has to be chosen from the enum list. Only Return boolean value: True or False. \nDialogue Statues:\n{reformat_slot}\nConversation:\n{chat_history_str}\n\n"
+        system_prompt = self.format_verify_input(slot, chat_history_str)
         response = self.get_response(
             system_prompt, format=Verification, note="slot verification"
         )
-        if not response: # no need to verification, we want to make sure it is really confident that we need to ask the question again
-            logger.info(f"Failed to verify dialogue states")
-            return Verification(verification_needed=False, thought="No need to verify")
-        logger.info(f"Verified dialogue states: {response}")
-        return response
+        return self.postprocess_verification(response)
+
+    async def averify(
+        self,
+        slot: dict,
+        chat_history_str,
+    ) -> Verification:
+        system_prompt = self.format_verify_input(slot, chat_history_str)
+        response = await self.aget_response(
+            system_prompt, format=Verification, note="slot verification"
+        )
+        return self.postprocess_verification(response)
 
 
 app = FastAPI()
@@ -0,0 +1,152 @@
+import re
+import hashlib
+import logging
+import threading
+import collections
+from typing import Optional, Tuple
+
+import numpy as np
+
+from arklex.utils.model_provider_config import get_embedding_model
+
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_utterance(text: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace so that trivial variants share one key."""
+    text = re.sub(r"[^\w\s]", " ", text.lower())
+    return " ".join(text.split())
+
+
+def last_assistant_turn(chat_history_str: str) -> str:
+    """Return the last assistant message of a history formatted by format_chat_history, "" if there is none."""
+    start = chat_history_str.rfind("assistant: ")
+    while start > 0 and chat_history_str[start - 1] != "\n":
+        start = chat_history_str.rfind("assistant: ", 0, start)
+    if start < 0:
+        return ""
+    end = chat_history_str.find("\nuser: ", start)
+    return chat_history_str[start + len("assistant: "):end if end >= 0 else None]
+
+
+def candidate_labels(intents: dict) -> dict:
+    """Map (intent, target_node) of every candidate edge to the label the NLU prediction uses for it.
+
+    The labels follow NLUModelAPI.format_input: the intent name if it has one edge, intent__<idx> otherwise.
+    """
+    labels = {}
+    for intent_k, intent_v in intents.items():
+        if not intent_v:
+            continue
+        if len(intent_v) == 1:
+            labels[(intent_k, intent_v[0].get("target_node"))] = intent_k
+        else:
+            for idx, intent in enumerate(intent_v):
+                labels[(intent_k, intent.get("target_node"))] = f"{intent_k}__<{idx}>"
+    return labels
+
+
+class IntentCache:
+    """Thread-safe LRU cache of (normalized utterance, last assistant turn, candidate intents) -> predicted intent.
+
+    The last assistant turn is part of the key as short replies ("yes", "the second one") mean different
+    intents depending on what they answer.
+    """
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(text: str, labels: dict, chat_history_str: str = ""):
+        context = hashlib.sha1(normalize_utterance(last_assistant_turn(chat_history_str)).encode("utf-8")).hexdigest()
+        return normalize_utterance(text), context, tuple(sorted(labels.items(), key=str))
+
+    def get(self, key):
+        if self.maxsize <= 0:
+            return None
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+class IntentIndex:
+    """Fast-path intent classifier over the intent edges of a task graph.
+
+    Sample utterances are indexed by their normalized text for exact matches. When use_embeddings is set,
+    the definitions and sample utterances are also embedded once at load time and queries are matched by
+    cosine similarity, restricted to the candidate intents of the current prediction.
+    """
+    def __init__(self, graph, use_embeddings: bool = False, threshold: float = 0.95):
+        self.threshold = threshold
+        self.exact = collections.defaultdict(set)
+        self.keys = []
+        texts = []
+        for u, v, data in graph.edges(data=True):
+            intent = data.get("intent")
+            if not intent or intent == "none":
+                continue
+            attribute = data.get("attribute", {})
+            sample_utterances = attribute.get("sample_utterances", []) or []
+            for utterance in sample_utterances:
+                self.exact[normalize_utterance(utterance)].add((intent, v))
+            for text in [attribute.get("definition", "")] + sample_utterances:
+                if text and text.strip():
+                    self.keys.append((intent, v))
+                    texts.append(text)
+
+        self.embedding_model = None
+        self.matrix = None
+        if use_embeddings and texts:
+            try:
+                self.embedding_model = get_embedding_model()
+                self.matrix = self._normalize(np.array(self.embedding_model.embed_documents(texts), dtype=np.float32))
+                logger.info(f"Built intent embedding index with {len(texts)} entries")
+            except Exception as e:
+                logger.error(f"Failed to build the intent embedding index, falling back to the LLM: {e}")
+                self.embedding_model = None
+                self.matrix = None
+
+    @property
+    def has_embeddings(self) -> bool:
+        return self.matrix is not None
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
+
+    def exact_match(self, text: str, labels: dict) -> Optional[str]:
+        """Return the label if the utterance is a sample utterance of exactly one candidate intent."""
+        matches = {labels[key] for key in self.exact.get(normalize_utterance(text), ()) if key in labels}
+        if len(matches) == 1:
+            return matches.pop()
+        return None
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self._normalize(np.array(self.embedding_model.embed_query(text), dtype=np.float32))
+
+    async def aembed_query(self, text: str) -> np.ndarray:
+        return self._normalize(np.array(await self.embedding_model.aembed_query(text), dtype=np.float32))
+
+    def nearest(self, query_vector: np.ndarray, labels: dict) -> Tuple[Optional[str], float]:
+        """Return the closest candidate label and its similarity."""
+        rows = [i for i, key in enumerate(self.keys) if key in labels]
+        if not rows:
+            return None, 0.0
+        scores = self.matrix[rows] @ query_vector
+        best = int(np.argmax(scores))
+        return labels[self.keys[rows[best]]], float(scores[best])
@@ -1,95 +1,230 @@
+import os
+import asyncio
+import weakref
 import requests
+import httpx
 import logging
+import threading
+import collections
 from dotenv import load_dotenv
 
-from arklex.utils.model_config import MODEL
+from arklex.utils.model_config import MODEL, NLU_CONFIG
 from arklex.utils.slot import Slot
 from arklex.orchestrator.NLU.api import nlu_api, slotfilling_api
+from arklex.orchestrator.NLU.intent_index import IntentCache, IntentIndex, candidate_labels
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+# seconds the async calls wait for the NLU and slot filling servers
+NLU_TIMEOUT = float(os.getenv("NLU_TIMEOUT", 60))
+
+# keep-alive clients of the async calls, one per event loop as their connections belong to the loop
+_http_clients = weakref.WeakKeyDictionary()
+_http_clients_lock = threading.Lock()
+
+
+def _get_http_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    with _http_clients_lock:
+        client = _http_clients.get(loop)
+        if client is None:
+            client = _http_clients[loop] = httpx.AsyncClient(timeout=NLU_TIMEOUT)
+        return client
+
 
 class NLU:
-    def __init__(self, url):
+    def __init__(self, url, intent_index: IntentIndex = None):
         self.url = url
+        self.intent_index = intent_index
+        self.intent_cache = IntentCache(NLU_CONFIG["intent_cache_size"])
+        self._stats = collections.Counter()
+        self._stats_lock = threading.Lock()
 
-    def execute(self, text:str, intents:dict, chat_history_str:str) -> str:
+    def _count(self, name: str):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def get_stats(self) -> dict:
+        """Return how many predictions were served by the cache, the fast path and the model."""
+        with self._stats_lock:
+            stats = {name: self._stats[name] for name in ["cache_hits", "exact_hits", "embedding_hits", "model_calls"]}
+        total = sum(stats.values())
+        stats["cache_hit_rate"] = stats["cache_hits"] / total if total else 0.0
+        stats["fast_path_hit_rate"] = (stats["exact_hits"] + stats["embedding_hits"]) / total if total else 0.0
+        return stats
+
+    def _fast_predict(self, text: str, labels: dict, cache_key):
+        """Return the cached or exactly matched intent, None if the slower tiers are needed."""
+        pred_intent = self.intent_cache.get(cache_key)
+        if pred_intent is not None:
+            self._count("cache_hits")
+            logger.info(f"pred_intent from cache is {pred_intent}")
+            return pred_intent
+        if self.intent_index is not None:
+            pred_intent = self.intent_index.exact_match(text, labels)
+            if pred_intent is not None:
+                self._count("exact_hits")
+                logger.info(f"pred_intent from sample utterance match is {pred_intent}")
+                self.intent_cache.put(cache_key, pred_intent)
+                return pred_intent
+        return None
+
+    def _embedding_predict(self, query_vector, labels: dict, cache_key):
+        pred_intent, score = self.intent_index.nearest(query_vector, labels)
+        if pred_intent is not None and score >= self.intent_index.threshold:
+            self._count("embedding_hits")
+            logger.info(f"pred_intent from embedding index is {pred_intent} with similarity {score:.3f}")
+            self.intent_cache.put(cache_key, pred_intent)
+            return pred_intent
+        return None
+
+    def _cache(self, cache_key, labels: dict, pred_intent: str):
+        """Cache the prediction if it is one of the candidate labels, not "others" or a raw model answer."""
+        if pred_intent in labels.values():
+            self.intent_cache.put(cache_key, pred_intent)
+
+    def _prepare(self, text: str, intents: dict, chat_history_str: str):
+        """Return the candidate labels, the cache key and the intent when the cache or an exact match has it."""
         logger.info(f"candidates intents of NLU: {intents}")
-        data = {
+        labels = candidate_labels(intents)
+        cache_key = IntentCache.make_key(text, labels, chat_history_str)
+        return labels, cache_key, self._fast_predict(text, labels, cache_key)
+
+    def _model_request(self, text: str, intents: dict, chat_history_str: str) -> dict:
+        self._count("model_calls")
+        return {
             "text": text,
             "intents": intents,
             "chat_history_str": chat_history_str,
             "model":MODEL
         }
-        if self.url:
-            logger.info(f"Using NLU API to predict the intent")
-            response = requests.post(self.url + "/predict", json=data)
-            if response.status_code == 200:
-                results = response.json()
-                pred_intent = results['intent']
-                logger.info(f"pred_intent is {pred_intent}")
-            else:
-                pred_intent = "others"
-                logger.error('Remote Server Error when predicting NLU')
-        else:
-            logger.info(f"Using NLU function to predict the intent")
-            pred_intent = nlu_api.predict(**data)
+
+    def _remote_prediction(self, response, cache_key, labels: dict) -> str:
+        if response.status_code == 200:
+            results = response.json()
+            pred_intent = results['intent']
             logger.info(f"pred_intent is {pred_intent}")
+            self._cache(cache_key, labels, pred_intent)
+        else:
+            pred_intent = "others"
+            logger.error('Remote Server Error when predicting NLU')
+        return pred_intent
 
+    def _local_prediction(self, pred_intent: str, cache_key, labels: dict) -> str:
+        logger.info(f"pred_intent is {pred_intent}")
+        self._cache(cache_key, labels, pred_intent)
         return pred_intent
+
+    def execute(self, text:str, intents:dict, chat_history_str:str) -> str:
+        labels, cache_key, pred_intent = self._prepare(text, intents, chat_history_str)
+        if pred_intent is None and self.intent_index is not None and self.intent_index.has_embeddings:
+            pred_intent = self._embedding_predict(self.intent_index.embed_query(text), labels, cache_key)
+        if pred_intent is not None:
+            return pred_intent
+
+        data = self._model_request(text, intents, chat_history_str)
+        if self.url:
+            logger.info(f"Using NLU API to predict the intent")
+            return self._remote_prediction(requests.post(self.url + "/predict", json=data), cache_key, labels)
+        logger.info(f"Using NLU function to predict the intent")
+        return self._local_prediction(nlu_api.predict(**data), cache_key, labels)
+
+    async def aexecute(self, text:str, intents:dict, chat_history_str:str) -> str:
+        labels, cache_key, pred_intent = self._prepare(text, intents, chat_history_str)
+        if pred_intent is None and self.intent_index is not None and self.intent_index.has_embeddings:
+            pred_intent = self._embedding_predict(await self.intent_index.aembed_query(text), labels, cache_key)
+        if pred_intent is not None:
+            return pred_intent
+
+        data = self._model_request(text, intents, chat_history_str)
+        if self.url:
+            logger.info(f"Using NLU API to predict the intent")
+            return self._remote_prediction(await _get_http_client().post(self.url + "/predict", json=data), cache_key, labels)
+        logger.info(f"Using NLU function to predict the intent")
+        return self._local_prediction(await nlu_api.apredict(**data), cache_key, labels)
     
 
 class SlotFilling:
     def __init__(self, url):
         self.url = url
 
-    def verify_needed(self, slot: Slot, chat_history_str:str) -> Slot:
+    def _verify_request(self, slot: Slot, chat_history_str: str) -> dict:
         logger.info(f"verify slot: {slot}")
-        data = {
+        return {
             "slot": slot.model_dump(),
             "chat_history_str": chat_history_str
         }
+
+    def _remote_verification(self, response):
+        if response.status_code == 200:
+            verification_needed = response.json().get("verification_needed")
+            thought = response.json().get("thought")
+            logger.info(f"verify_needed is {verification_needed}")
+        else:
+            verification_needed = False
+            thought = "No need to verify"
+            logger.error('Remote Server Error when verifying Slot Filling')
+        return verification_needed, thought
+
+    def _local_verification(self, verification):
+        logger.info(f"verify_needed is {verification.verification_needed}")
+        return verification.verification_needed, verification.thought
+
+    def verify_needed(self, slot: Slot, chat_history_str:str) -> Slot:
+        data = self._verify_request(slot, chat_history_str)
         if self.url:
             logger.info(f"Using Slot Filling API to verify the slot")
-            response = requests.post(self.url + "/verify", json=data)
-            if response.status_code == 200:
-                verification_needed = response.json().get("verification_needed")
-                thought = response.json().get("thought")
-                logger.info(f"verify_needed is {verification_needed}")
-            else:
-                verification_needed = False
-                thought = "No need to verify"
-                logger.error('Remote Server Error when verifying Slot Filling')
-        else:
-            logger.info(f"Using Slot Filling function to verify the slot")
-            verification = slotfilling_api.verify(**data)
-            verification_needed = verification.verification_needed
-            thought = verification.thought
-            logger.info(f"verify_needed is {verification_needed}")
+            return self._remote_verification(requests.post(self.url + "/verify", json=data))
+        logger.info(f"Using Slot Filling function to verify the slot")
+        return self._local_verification(slotfilling_api.verify(**data))
 
-        return verification_needed, thought
+    async def averify_needed(self, slot: Slot, chat_history_str:str) -> Slot:
+        data = self._verify_request(slot, chat_history_str)
+        if self.url:
+            logger.info(f"Using Slot Filling API to verify the slot")
+            return self._remote_verification(await _get_http_client().post(self.url + "/verify", json=data))
+        logger.info(f"Using Slot Filling function to verify the slot")
+        return self._local_verification(await slotfilling_api.averify(**data))
 
-    def execute(self, slots:list[Slot], context:str, type: str = "chat") -> list[Slot]:
-        logger.info(f"extracted slots: {slots}")
-        if not slots: return []
-        
-        data = {
+    def _fill_request(self, slots: list[Slot], context: str, type: str) -> dict:
+        return {
             "slots": slots,
             "input": context,
             "type": type
         }
+
+    def _remote_slots(self, response, slots: list[Slot]) -> list[Slot]:
+        if response.status_code == 200:
+            pred_slots = response.json()
+            logger.info(f"pred_slots is {pred_slots}")
+        else:
+            pred_slots = slots
+            logger.error('Remote Server Error when predicting Slot Filling')
+        return pred_slots
+
+    def execute(self, slots:list[Slot], context:str, type: str = "chat") -> list[Slot]:
+        logger.info(f"extracted slots: {slots}")
+        if not slots: return []
+        
+        data = self._fill_request(slots, context, type)
         if self.url:
             logger.info(f"Using Slot Filling API to predict the slots")
-            response = requests.post(self.url + "/predict", json=data)
-            if response.status_code == 200:
-                pred_slots = response.json()
-                logger.info(f"pred_slots is {pred_slots}")
-            else:
-                pred_slots = slots
-                logger.error('Remote Server Error when predicting Slot Filling')
-        else:
-            logger.info(f"Using Slot Filling function to predict the slots")
-            pred_slots = slotfilling_api.predict(**data)
-            logger.info(f"pred_slots is {pred_slots}")
+            return self._remote_slots(requests.post(self.url + "/predict", json=data), slots)
+        logger.info(f"Using Slot Filling function to predict the slots")
+        pred_slots = slotfilling_api.predict(**data)
+        logger.info(f"pred_slots is {pred_slots}")
+        return pred_slots
+
+    async def aexecute(self, slots:list[Slot], context:str, type: str = "chat") -> list[Slot]:
+        logger.info(f"extracted slots: {slots}")
+        if not slots: return []
+        
+        data = self._fill_request(slots, context, type)
+        if self.url:
+            logger.info(f"Using Slot Filling API to predict the slots")
+            return self._remote_slots(await _get_http_client().post(self.url + "/predict", json=data), slots)
+        logger.info(f"Using Slot Filling function to predict the slots")
+        pred_slots = await slotfilling_api.apredict(**data)
+        logger.info(f"pred_slots is {pred_slots}")
         return pred_slots
@@ -5,8 +5,6 @@ import logging
 from datetime import datetime
 from tqdm import tqdm as progress_bar
 import subprocess
-import pickle
-from pathlib import Path
 import inspect
 import importlib
 from typing import Optional
@@ -24,6 +22,7 @@ from textual.widgets.tree import TreeNode
 from arklex.utils.utils import postprocess_json
 from arklex.orchestrator.generator.prompts import *
 from arklex.utils.loader import Loader
+from arklex.utils.document_store import documents_exist, load_documents
 from arklex.env.env import BaseResourceInitializer, DefaulResourceInitializer
 
 
@@ -382,12 +381,12 @@ class Generator:
     
     def _load_docs(self):
         if self.task_docs:
-            filepath = os.path.join(self.output_dir, "task_documents.pkl")
+            filepath = os.path.join(self.output_dir, "task_documents")
             total_num_docs = sum([doc.get("num") if doc.get("num") else 1 for doc in self.task_docs])
             loader = Loader()
-            if Path(filepath).exists():
-                logger.warning(f"Loading existing documents from {os.path.join(self.output_dir, 'task_documents.pkl')}! If you want to recrawl, please delete the file or specify a new --output-dir when initiate Generator.")
-                crawled_urls_full = pickle.load(open(os.path.join(self.output_dir, "task_documents.pkl"), "rb"))
+            if documents_exist(filepath):
+                logger.warning(f"Loading existing documents from {filepath}! If you want to recrawl, please delete the file or specify a new --output-dir when initiate Generator.")
+                crawled_urls_full = load_documents(filepath)
             else:
                 crawled_urls_full = []
                 for doc in self.task_docs:
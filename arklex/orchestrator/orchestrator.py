@@ -3,7 +3,6 @@ import time
 from typing import Any, Dict
 import logging
 from typing import Dict, Any, Tuple
-import copy
 import janus
 from dotenv import load_dotenv
 
@@ -19,6 +18,8 @@ from arklex.utils.graph_state import (ConvoMessage, NodeInfo, OrchestratorMessag
                                       BotConfig, Params, ResourceRecord,
                                       OrchestratorResp, NodeTypeEnum)
 from arklex.utils.utils import format_chat_history
+from arklex.memory.session_store import SessionStore
+from arklex.memory.summary import RollingSummaryMemory
 
 
 load_dotenv()
@@ -27,7 +28,16 @@ logger = logging.getLogger(__name__)
 INFO_WORKERS = ["planner", "MessageWorker", "RagMsgWorker", "HITLWorkerChatFlag"]
 
 class AgentOrg:
-    def __init__(self, config, env: Env, **kwargs):
+    """Orchestrates one turn of a conversation over a TaskGraph.
+
+    An AgentOrg keeps no per-request state: everything that belongs to a turn lives in the inputs,
+    the Params and the MessageState created by init_params. A single instance can therefore be
+    loaded once per taskgraph and shared by concurrent requests.
+
+    With a session_store, conversations are kept server side: the inputs only need a chat_id and
+    the text, and the history and Params of the chat are loaded from and saved back to the store.
+    """
+    def __init__(self, config, env: Env, task_graph: TaskGraph = None, session_store: SessionStore = None, **kwargs):
         if isinstance(config, dict):
             self.product_kwargs = config
         else:
@@ -36,9 +46,78 @@ class AgentOrg:
         self.worker_prefix = "assistant"
         self.environment_prefix = "tool"
         self.__eos_token = "\n"
-        self.task_graph = TaskGraph("taskgraph", self.product_kwargs)
+        # a prebuilt TaskGraph can be passed in to share the compiled graph between orchestrators
+        self.task_graph = task_graph if task_graph is not None else TaskGraph("taskgraph", self.product_kwargs)
         self.env = env
+        self.session_store = session_store
+        # number of most recent turns kept in the memory trajectories, None keeps the whole conversation
+        self.trajectory_window = self.product_kwargs.get("trajectory_window")
+        # rolling summary of the older turns, enabled with e.g. "summary_memory": {"keep_turns": 4, "summarize_every": 2}
+        summary_config = self.product_kwargs.get("summary_memory")
+        self.summary_memory = RollingSummaryMemory(user_prefix=self.user_prefix, **summary_config) if summary_config else None
+
+    def load_session(self, inputs: dict) -> dict:
+        """Fill in the chat history and Params of inputs["chat_id"] from the session store."""
+        chat_id = inputs.get("chat_id")
+        if self.session_store is None or not chat_id:
+            return inputs
+        session = self.session_store.get(chat_id)
+        if session is None:
+            history = inputs.get("chat_history") or self.start_history()
+            params = Params()
+            params.metadata.chat_id = chat_id
+        else:
+            history, params = session
+        return {**inputs, "chat_history": history, "parameters": params}
+
+    def start_history(self) -> list:
+        """History of a new conversation: the greeting of the start node, as the clients send it."""
+        start_node = self.task_graph.graph.nodes.get(self.task_graph.start_node, {})
+        start_message = start_node.get("attribute", {}).get("value")
+        return [{"role": self.worker_prefix, "content": start_message}] if start_message else []
+
+    def save_session(self, inputs: dict, orchestrator_response: OrchestratorResp, params: Params) -> OrchestratorResp:
+        """Store the turn in the session store, or return the full Params to the caller when sessions are not used."""
+        chat_id = inputs.get("chat_id")
+        if self.session_store is None or not chat_id:
+            orchestrator_response.parameters = params.model_dump()
+            return orchestrator_response
+        history = self.turn_history(inputs, orchestrator_response)
+        self.session_store.put(chat_id, history, params)
+        # the session stays on the server, only return what identifies it
+        orchestrator_response.parameters = {"metadata": params.metadata.model_dump()}
+        return orchestrator_response
 
+    def turn_history(self, inputs: dict, orchestrator_response: OrchestratorResp) -> list:
+        """Chat history at the end of the turn."""
+        return inputs["chat_history"] + [
+            {"role": self.user_prefix, "content": inputs["text"]},
+            {"role": self.worker_prefix, "content": orchestrator_response.answer},
+        ]
+
+    def schedule_summary(self, inputs: dict, orchestrator_response: OrchestratorResp, params: Params):
+        if self.summary_memory is None:
+            return
+        self.summary_memory.schedule(self.turn_history(inputs, orchestrator_response), params, self.get_bot_config())
+
+    def get_bot_config(self) -> BotConfig:
+        return BotConfig(
+            bot_id=self.product_kwargs.get("bot_id", "default"),
+            version=self.product_kwargs.get("version", "default"),
+            language=self.product_kwargs.get("language", "EN"),
+            bot_type=self.product_kwargs.get("bot_type", "presalebot"),
+        )
+
+    def trim_memory(self, params: Params) -> Params:
+        """Keep only the last trajectory_window turns of the memory trajectories."""
+        window = self.trajectory_window
+        if not window:
+            return params
+        params.memory.trajectory = params.memory.trajectory[-window:]
+        user_turns = [i for i, msg in enumerate(params.memory.function_calling_trajectory) if msg.get("role") == self.user_prefix]
+        if len(user_turns) > window:
+            params.memory.function_calling_trajectory = params.memory.function_calling_trajectory[user_turns[-window]:]
+        return params
     
     def init_params(self, inputs) -> Tuple[str, str, Params, MessageState]:
         text = inputs["text"]
@@ -48,22 +127,33 @@ class AgentOrg:
         # Create base params with defaults
         params = Params()
         
-        # Update with any provided values
-        if input_params:
+        # Update with any provided values, Params loaded from the session store are used as is
+        if isinstance(input_params, Params):
+            params = input_params
+        elif input_params:
             params = Params.model_validate(input_params)
         
         # Update specific fields
-        chat_history_copy = copy.deepcopy(chat_history)
-        chat_history_copy.append({"role": self.user_prefix, "content": text})
-        chat_history_str = format_chat_history(chat_history_copy)        
+        # the history is only read, so a new list is enough; the messages kept in memory are copied one level
+        chat_history_copy = chat_history + [{"role": self.user_prefix, "content": text}]
         # Update turn_id and function_calling_trajectory
         params.metadata.turn_id += 1
         if not params.memory.function_calling_trajectory:
-            params.memory.function_calling_trajectory = copy.deepcopy(chat_history_copy)
+            params.memory.function_calling_trajectory = [dict(msg) for msg in chat_history_copy]
         else:
-            params.memory.function_calling_trajectory.extend(chat_history_copy[-2:])
+            params.memory.function_calling_trajectory.extend(dict(msg) for msg in chat_history_copy[-2:])
         
         params.memory.trajectory.append([])
+        params = self.trim_memory(params)
+        if self.summary_memory is not None:
+            # the turns covered by the rolling summary are replaced by the summary in the prompts
+            params = self.summary_memory.apply(params)
+            num_user_turns = sum(1 for msg in chat_history_copy if msg.get("role") == self.user_prefix)
+            chat_history_copy = self.summary_memory.compact(chat_history_copy, params)
+            params.memory.function_calling_trajectory = self.summary_memory.compact(
+                params.memory.function_calling_trajectory, params, num_user_turns
+            )
+        chat_history_str = format_chat_history(chat_history_copy)
         
 
         # Initialize the message state
@@ -72,15 +162,10 @@ class AgentOrg:
                             self.product_kwargs["builder_objective"] + \
                             self.product_kwargs["intro"] + \
                             self.product_kwargs.get("opt_instruct", "")
-        bot_config = BotConfig(
-            bot_id=self.product_kwargs.get("bot_id", "default"),
-            version=self.product_kwargs.get("version", "default"),
-            language=self.product_kwargs.get("language", "EN"),
-            bot_type=self.product_kwargs.get("bot_type", "presalebot"),
-        )
         message_state = MessageState(
             sys_instruct=sys_instruct,
-            bot_config=bot_config,
+            bot_config=self.get_bot_config(),
+            user_message=ConvoMessage(history=chat_history_str, message=text, turns=chat_history_copy),
         )
         return text, chat_history_str, params, message_state
 
@@ -124,7 +209,6 @@ class AgentOrg:
                 params = self.post_process_node(node_info, params)
                 return_response = OrchestratorResp(
                     answer=node_attribute["value"],
-                    parameters=params.model_dump()
                 )
                 # Multiple choice list
                 if node_info.type == NodeTypeEnum.MULTIPLE_CHOICE.value and node_attribute.get("choice_list", []):
@@ -132,13 +216,11 @@ class AgentOrg:
                 return True, return_response, params
         return False, None, params
     
-    def perform_node(self, message_state:MessageState, node_info: NodeInfo, params: Params,
-                     text: str, chat_history_str: str,
-                     stream_type: StreamType, message_queue: janus.SyncQueue):
-        # Tool/Worker
-        node_info, params = self.handle_nested_graph_node(node_info, params)
-
-        user_message = ConvoMessage(history=chat_history_str, message=text)
+    def _prepare_message_state(self, message_state:MessageState, node_info: NodeInfo, params: Params,
+                               text: str, chat_history_str: str,
+                               stream_type: StreamType, message_queue: janus.SyncQueue):
+        turns = message_state.user_message.turns if message_state.user_message else []
+        user_message = ConvoMessage(history=chat_history_str, message=text, turns=turns)
         orchestrator_message = OrchestratorMessage(message=node_info.attributes["value"], attribute=node_info.attributes)
     
         # Create initial resource record with common info and output from trajectory
@@ -163,10 +245,29 @@ class AgentOrg:
         message_state.metadata = params.metadata
         message_state.is_stream = True if stream_type is not None else False
         message_state.message_queue = message_queue
-        
+        return message_state, params
+
+    def perform_node(self, message_state:MessageState, node_info: NodeInfo, params: Params,
+                     text: str, chat_history_str: str,
+                     stream_type: StreamType, message_queue: janus.SyncQueue):
+        # Tool/Worker
+        node_info, params = self.handle_nested_graph_node(node_info, params)
+        message_state, params = self._prepare_message_state(message_state, node_info, params, text, chat_history_str,
+                                                            stream_type, message_queue)
         response_state, params = self.env.step(node_info.resource_id, message_state, params)
         params.memory.trajectory = response_state.trajectory
         return node_info, response_state, params
+
+    async def aperform_node(self, message_state:MessageState, node_info: NodeInfo, params: Params,
+                            text: str, chat_history_str: str,
+                            stream_type: StreamType, message_queue: janus.SyncQueue):
+        # Tool/Worker
+        node_info, params = self.handle_nested_graph_node(node_info, params)
+        message_state, params = self._prepare_message_state(message_state, node_info, params, text, chat_history_str,
+                                                            stream_type, message_queue)
+        response_state, params = await self.env.astep(node_info.resource_id, message_state, params)
+        params.memory.trajectory = response_state.trajectory
+        return node_info, response_state, params
     
     def handle_nested_graph_node(self, node_info: NodeInfo, params: Params):
         if node_info.resource_id != NESTED_GRAPH_ID:
@@ -194,10 +295,29 @@ class AgentOrg:
         return node_info, params
         
     
+    def _should_stop(self, node_info: NodeInfo, params: Params, msg_counter: int) -> Tuple[bool, int]:
+        """Decide whether the turn ends after performing node_info, return the updated message counter."""
+        # If the current node is not complete, then no need to continue to the next node
+        node_status = params.taskgraph.node_status
+        cur_node_id = params.taskgraph.curr_node
+        status = node_status.get(cur_node_id, StatusEnum.COMPLETE)
+        if status == StatusEnum.INCOMPLETE:
+            return True, msg_counter
+        
+        # Check current node attributes
+        if node_info.resource_name in INFO_WORKERS:
+            msg_counter += 1
+        # If the counter of message worker or counter of planner or counter of ragmsg worker == 1, break the loop
+        if msg_counter == 1:
+            return True, msg_counter
+        if node_info.is_leaf is True:
+            return True, msg_counter
+        return False, msg_counter
+
     def _get_response(self, 
                      inputs: dict, 
                      stream_type: StreamType = None, 
-                     message_queue: janus.SyncQueue = None) -> OrchestratorResp:
+                     message_queue: janus.SyncQueue = None) -> Tuple[OrchestratorResp, Params]:
         text, chat_history_str, params, message_state = self.init_params(inputs)
         ##### TaskGraph Chain
         taskgraph_inputs = {
@@ -228,7 +348,7 @@ class AgentOrg:
             # handle direct node
             is_direct_node, direct_response, params = self.handl_direct_node(node_info, params)
             if is_direct_node:
-                return direct_response
+                return direct_response, params
             # perform node
 
             node_info, message_state, params = self.perform_node(message_state,
@@ -241,20 +361,8 @@ class AgentOrg:
             params = self.post_process_node(node_info, params)
             
             n_node_performed += 1
-            # If the current node is not complete, then no need to continue to the next node
-            node_status = params.taskgraph.node_status
-            cur_node_id = params.taskgraph.curr_node
-            status = node_status.get(cur_node_id, StatusEnum.COMPLETE)
-            if status == StatusEnum.INCOMPLETE:
-                break
-            
-            # Check current node attributes
-            if node_info.resource_name in INFO_WORKERS:
-                msg_counter += 1
-            # If the counter of message worker or counter of planner or counter of ragmsg worker == 1, break the loop
-            if msg_counter == 1:
-                break
-            if node_info.is_leaf is True:
+            should_stop, msg_counter = self._should_stop(node_info, params, msg_counter)
+            if should_stop:
                 break
 
         if not message_state.response:
@@ -268,13 +376,88 @@ class AgentOrg:
         # params["memory"]["tool_response"] = {}
         return OrchestratorResp(
             answer=message_state.response,
-            parameters=params.model_dump(),
             human_in_the_loop=params.metadata.hitl,
-        )
+        ), params
+
+    async def _aget_response(self, 
+                             inputs: dict, 
+                             stream_type: StreamType = None, 
+                             message_queue: janus.SyncQueue = None) -> Tuple[OrchestratorResp, Params]:
+        text, chat_history_str, params, message_state = self.init_params(inputs)
+        ##### TaskGraph Chain
+        taskgraph_inputs = {
+            "text": text,
+            "chat_history_str": chat_history_str,
+            "parameters": params,
+            "allow_global_intent_switch": True,
+        }
+        taskgraph_chain = RunnableLambda(self.task_graph.get_node, afunc=self.task_graph.aget_node) | \
+            RunnableLambda(self.task_graph.postprocess_node, afunc=self.task_graph.apostprocess_node)
+
+        msg_counter = 0
+        
+        n_node_performed = 0
+        max_n_node_performed = 5
+        while n_node_performed < max_n_node_performed:
+            taskgraph_start_time = time.time()
+            node_info, params = await taskgraph_chain.ainvoke(taskgraph_inputs)
+            taskgraph_inputs["allow_global_intent_switch"] = False
+            params.metadata.timing.taskgraph = time.time() - taskgraph_start_time
+            # Check if current node can be skipped
+            can_skip = self.check_skip_node(node_info, params)
+            if can_skip:
+                params = self.post_process_node(node_info, params, {"is_skipped": True})
+                continue
+            logger.info(f"The current node info is : {node_info}")
+            
+            # handle direct node
+            is_direct_node, direct_response, params = self.handl_direct_node(node_info, params)
+            if is_direct_node:
+                return direct_response, params
+
+            node_info, message_state, params = await self.aperform_node(message_state,
+                                                                        node_info,
+                                                                        params,
+                                                                        text,
+                                                                        chat_history_str,
+                                                                        stream_type,
+                                                                        message_queue)
+            params = self.post_process_node(node_info, params)
+            
+            n_node_performed += 1
+            should_stop, msg_counter = self._should_stop(node_info, params, msg_counter)
+            if should_stop:
+                break
+
+        if not message_state.response:
+            logger.info("No response, do context generation")
+            if not stream_type:
+                message_state = await ToolGenerator.acontext_generate(message_state)
+            else:
+                message_state = await ToolGenerator.astream_context_generate(message_state)
+        
+        return OrchestratorResp(
+            answer=message_state.response,
+            human_in_the_loop=params.metadata.hitl,
+        ), params
     
     def get_response(self, 
                      inputs: dict, 
                      stream_type: StreamType = None, 
                      message_queue: janus.SyncQueue = None) -> Dict[str, Any]:
-        orchestrator_response = self._get_response(inputs, stream_type, message_queue)
+        inputs = self.load_session(inputs)
+        orchestrator_response, params = self._get_response(inputs, stream_type, message_queue)
+        self.schedule_summary(inputs, orchestrator_response, params)
+        orchestrator_response = self.save_session(inputs, orchestrator_response, params)
+        return orchestrator_response.model_dump()
+
+    async def aget_response(self, 
+                            inputs: dict, 
+                            stream_type: StreamType = None, 
+                            message_queue: janus.SyncQueue = None) -> Dict[str, Any]:
+        """Async version of get_response. The queue only needs put_nowait, so a janus sync or async queue both work."""
+        inputs = self.load_session(inputs)
+        orchestrator_response, params = await self._aget_response(inputs, stream_type, message_queue)
+        self.schedule_summary(inputs, orchestrator_response, params)
+        orchestrator_response = self.save_session(inputs, orchestrator_response, params)
         return orchestrator_response.model_dump()
@@ -5,14 +5,13 @@ from typing import Tuple
 
 import networkx as nx
 import numpy as np
-from langchain_openai import ChatOpenAI
 
 from arklex.env.nested_graph.nested_graph import NestedGraph
-from arklex.utils.model_provider_config import PROVIDER_MAP
 from arklex.utils.utils import normalize, str_similarity, format_chat_history
 from arklex.utils.graph_state import NodeInfo, Params, PathNode, StatusEnum
 from arklex.orchestrator.NLU.nlu import NLU, SlotFilling
-from arklex.utils.model_config import MODEL
+from arklex.orchestrator.NLU.intent_index import IntentIndex
+from arklex.utils.model_config import NLU_CONFIG
 
 logger = logging.getLogger(__name__)
 
@@ -58,11 +57,14 @@ class TaskGraph(TaskGraphBase):
                     "sample_utterances": []
                 }
             }
+        self.compile_graph()
         self.initial_node = self.get_initial_flow()
-        self.model = PROVIDER_MAP.get(MODEL['llm_provider'], ChatOpenAI)(
-            model=MODEL["model_type_or_path"], timeout=30000
+        self.intent_index = IntentIndex(
+            self.graph,
+            use_embeddings=NLU_CONFIG["embedding_fast_path"],
+            threshold=NLU_CONFIG["embedding_threshold"],
         )
-        self.nluapi = NLU(self.product_kwargs.get("nluapi"))
+        self.nluapi = NLU(self.product_kwargs.get("nluapi"), intent_index=self.intent_index)
         self.slotfillapi = SlotFilling(self.product_kwargs.get("slotfillapi"))
 
     def create_graph(self):
@@ -74,6 +76,44 @@ class TaskGraph(TaskGraphBase):
         self.graph.add_nodes_from(nodes)
         self.graph.add_edges_from(edges)
 
+    def compile_graph(self):
+        """
+        Precompute the per-turn lookups once, the graph is not modified after loading
+        The tables below are shared by all turns and must be treated as read-only
+        """
+        # nodes without successors
+        self.leaf_nodes = frozenset(node for node in self.graph.nodes if self.graph.out_degree(node) == 0)
+        # default node limits
+        self.default_node_limit = {
+            node: data["limit"] for node, data in self.graph.nodes.data() if data.get("limit") is not None
+        }
+        # per-node local intents and "none" edges with their normalized weights
+        self.local_intents = {}
+        self.none_edges = {}
+        for node in self.graph.nodes:
+            candidates_intents = collections.defaultdict(list)
+            none_targets, none_weights = [], []
+            for u, v, data in self.graph.out_edges(node, data=True):
+                intent = data.get("intent")
+                if intent == "none":
+                    none_targets.append(v)
+                    none_weights.append(data["attribute"]["weight"])
+                elif intent:
+                    edge_info = copy.deepcopy(data)
+                    edge_info["source_node"] = u
+                    edge_info["target_node"] = v
+                    candidates_intents[intent].append(edge_info)
+            self.local_intents[node] = dict(candidates_intents)
+            if none_targets:
+                self.none_edges[node] = (none_targets, normalize(none_weights))
+        # global intents including the unsure intent
+        self.global_intents = dict(self.intents)
+        if self.unsure_intent.get("intent") not in self.global_intents:
+            self.global_intents[self.unsure_intent.get("intent")] = [self.unsure_intent]
+
+    def is_leaf(self, node) -> bool:
+        return node in self.leaf_nodes
+
     def get_initial_flow(self):
         services_nodes = self.product_kwargs.get("services_nodes", None)
         node = None
@@ -128,7 +168,7 @@ class TaskGraph(TaskGraphBase):
             resource_id=resource_id,
             resource_name=resource_name,
             can_skipped=True,
-            is_leaf=len(list(self.graph.successors(sample_node))) == 0,
+            is_leaf=self.is_leaf(sample_node),
             attributes=node_info["attribute"],
             add_flow_stack=False
         )
@@ -170,9 +210,7 @@ class TaskGraph(TaskGraphBase):
         """
         available_global_intents = params.taskgraph.available_global_intents
         if not available_global_intents:
-            available_global_intents = copy.deepcopy(self.intents)
-            if self.unsure_intent.get("intent") not in available_global_intents.keys():
-                available_global_intents[self.unsure_intent.get("intent")].append(self.unsure_intent)
+            available_global_intents = self.global_intents
         logger.info(f"Available global intents: {available_global_intents}")
         return available_global_intents
     
@@ -181,11 +219,10 @@ class TaskGraph(TaskGraphBase):
         Update the node_limit in params which will be used to check if we can skip the node or not
         """
         old_node_limit = params.taskgraph.node_limit
-        node_limit = {}
-        for node in self.graph.nodes.data():
-            limit = old_node_limit.get(node[0], node[1].get("limit")) 
-            if limit is not None:
-                node_limit[node[0]] = limit
+        node_limit = dict(self.default_node_limit)
+        for node, limit in old_node_limit.items():
+            if limit is not None and node in self.graph:
+                node_limit[node] = limit
         params.taskgraph.node_limit = node_limit
         return params
 
@@ -193,16 +230,9 @@ class TaskGraph(TaskGraphBase):
         """
         Get the local intent of a current node
         """
-        candidates_intents = collections.defaultdict(list)
-        for u, v, data in self.graph.out_edges(curr_node, data=True):
-            intent = data.get("intent")
-            if intent != "none" and data.get("intent"):
-                edge_info = copy.deepcopy(data)
-                edge_info["source_node"] = u
-                edge_info["target_node"] = v
-                candidates_intents[intent].append(edge_info)
+        candidates_intents = self.local_intents.get(curr_node, {})
         logger.info(f"Current local intent: {candidates_intents}")
-        return dict(candidates_intents)
+        return candidates_intents
 
     def get_last_flow_stack_node(self, params: Params) -> PathNode:
         """
@@ -232,7 +262,7 @@ class TaskGraph(TaskGraphBase):
                 resource_id = resource_id,
                 resource_name = resource_name,
                 can_skipped=False,
-                is_leaf=len(list(self.graph.successors(curr_node))) == 0,
+                is_leaf=self.is_leaf(curr_node),
                 attributes=node_info["attribute"]
             )
             return True, node_info, params
@@ -250,52 +280,69 @@ class TaskGraph(TaskGraphBase):
             return True, node_info, params
         return False, {}, params
     
-    def global_intent_prediction(self, curr_node, params: Params, available_global_intents, excluded_intents) -> Tuple[bool, str, dict, Params]:
+    def _global_candidate_intents(self, available_global_intents, excluded_intents):
         """
-        Do global intent prediction
+        Build the candidate intents for the global intent prediction
+        Return the predicted intent directly if only the unsure intent is available
         """
-        candidate_intents = copy.deepcopy(available_global_intents)
-        candidate_intents = {k: v for k, v in candidate_intents.items() if k not in excluded_intents}
-        pred_intent = None
+        candidate_intents = {k: v for k, v in available_global_intents.items() if k not in excluded_intents}
         # if only unsure_intent is available -> move directly to this intent
         if len(candidate_intents) == 1 and self.unsure_intent.get("intent") in candidate_intents.keys():
-            pred_intent = self.unsure_intent.get("intent")
-        else: # global intent prediction
-            # if match other intent, add flow, jump over
-            candidate_intents[self.unsure_intent.get("intent")] = \
-                candidate_intents.get(self.unsure_intent.get("intent"), [self.unsure_intent])
-            logger.info(f"Available global intents with unsure intent: {candidate_intents}")
-            
-            pred_intent = self.nluapi.execute(self.text, candidate_intents, self.chat_history_str)
-            params.taskgraph.nlu_records.append({"candidate_intents": candidate_intents, 
-                                "pred_intent": pred_intent, "no_intent": False, "global_intent": True})
-            found_pred_in_avil, pred_intent, intent_idx = self._postprocess_intent(pred_intent, available_global_intents)
-            # if found prediction and prediction is not unsure intent and current intent
-            # TODO: how to know if user want to proceed or going back to the initial node of the same global intent
-            if found_pred_in_avil and \
-                pred_intent != self.unsure_intent.get("intent") and \
-                pred_intent != params.taskgraph.curr_global_intent:
-                params.taskgraph.intent = pred_intent
-                next_node, next_intent = self.jump_to_node(pred_intent, intent_idx, curr_node)
-                logger.info(f"curr_node: {next_node}")
-                node_info, params = self._get_node(next_node, params, intent=next_intent)
-                # if current node is not a leaf node and jump to another node, then add it onto stack
-                if next_node != curr_node and list(self.graph.successors(curr_node)):
-                    node_info.add_flow_stack = True
-                params.taskgraph.curr_global_intent = pred_intent
-                return True, pred_intent, node_info, params
+            return candidate_intents, self.unsure_intent.get("intent")
+        # if match other intent, add flow, jump over
+        candidate_intents[self.unsure_intent.get("intent")] = \
+            candidate_intents.get(self.unsure_intent.get("intent"), [self.unsure_intent])
+        logger.info(f"Available global intents with unsure intent: {candidate_intents}")
+        return candidate_intents, None
+
+    def _apply_global_intent(self, curr_node, params: Params, available_global_intents,
+                             candidate_intents, pred_intent) -> Tuple[bool, str, dict, Params]:
+        params.taskgraph.nlu_records.append({"candidate_intents": candidate_intents, 
+                            "pred_intent": pred_intent, "no_intent": False, "global_intent": True})
+        found_pred_in_avil, pred_intent, intent_idx = self._postprocess_intent(pred_intent, available_global_intents)
+        # if found prediction and prediction is not unsure intent and current intent
+        # TODO: how to know if user want to proceed or going back to the initial node of the same global intent
+        if found_pred_in_avil and \
+            pred_intent != self.unsure_intent.get("intent") and \
+            pred_intent != params.taskgraph.curr_global_intent:
+            params.taskgraph.intent = pred_intent
+            next_node, next_intent = self.jump_to_node(pred_intent, intent_idx, curr_node)
+            logger.info(f"curr_node: {next_node}")
+            node_info, params = self._get_node(next_node, params, intent=next_intent)
+            # if current node is not a leaf node and jump to another node, then add it onto stack
+            if next_node != curr_node and not self.is_leaf(curr_node):
+                node_info.add_flow_stack = True
+            params.taskgraph.curr_global_intent = pred_intent
+            return True, pred_intent, node_info, params
         return False, pred_intent, {}, params
+
+    def global_intent_prediction(self, curr_node, params: Params, available_global_intents, excluded_intents,
+                                 text: str, chat_history_str: str) -> Tuple[bool, str, dict, Params]:
+        """
+        Do global intent prediction
+        """
+        candidate_intents, pred_intent = self._global_candidate_intents(available_global_intents, excluded_intents)
+        if pred_intent is not None:
+            return False, pred_intent, {}, params
+        pred_intent = self.nluapi.execute(text, candidate_intents, chat_history_str)
+        return self._apply_global_intent(curr_node, params, available_global_intents, candidate_intents, pred_intent)
+
+    async def aglobal_intent_prediction(self, curr_node, params: Params, available_global_intents, excluded_intents,
+                                        text: str, chat_history_str: str) -> Tuple[bool, str, dict, Params]:
+        """
+        Async version of global_intent_prediction
+        """
+        candidate_intents, pred_intent = self._global_candidate_intents(available_global_intents, excluded_intents)
+        if pred_intent is not None:
+            return False, pred_intent, {}, params
+        pred_intent = await self.nluapi.aexecute(text, candidate_intents, chat_history_str)
+        return self._apply_global_intent(curr_node, params, available_global_intents, candidate_intents, pred_intent)
  
     def handle_random_next_node(self, curr_node, params: Params) -> Tuple[bool, dict, Params]:
-        candidate_samples = []
-        candidates_nodes_weights = []
-        for out_edge in self.graph.out_edges(curr_node, data=True):
-            if out_edge[2]["intent"] == "none":
-                candidate_samples.append(out_edge[1])
-                candidates_nodes_weights.append(out_edge[2]["attribute"]["weight"])
-        if candidate_samples:
+        if curr_node in self.none_edges:
+            candidate_samples, candidates_nodes_weights = self.none_edges[curr_node]
             # randomly choose one sample from candidate samples
-            next_node = np.random.choice(candidate_samples, p=normalize(candidates_nodes_weights))
+            next_node = np.random.choice(candidate_samples, p=candidates_nodes_weights)
         else:  # leaf node + the node without None intents
             next_node = curr_node
 
@@ -309,31 +356,46 @@ class TaskGraph(TaskGraphBase):
             return True, node_info, params
         return False, {}, params
     
-    def local_intent_prediction(self, curr_node, params: Params, curr_local_intents) -> Tuple[bool, dict, Params]:
-        """
-        Do local intent prediction
-        """
-        curr_local_intents_w_unsure = copy.deepcopy(curr_local_intents)
+    def _local_candidate_intents(self, curr_local_intents):
+        curr_local_intents_w_unsure = dict(curr_local_intents)
         curr_local_intents_w_unsure[self.unsure_intent.get("intent")] = \
             curr_local_intents_w_unsure.get(self.unsure_intent.get("intent"), [self.unsure_intent])
         logger.info(f"Check intent under current node: {curr_local_intents_w_unsure}")
-        pred_intent = self.nluapi.execute(self.text, curr_local_intents_w_unsure, self.chat_history_str)
+        return curr_local_intents_w_unsure
+
+    def _apply_local_intent(self, curr_node, params: Params, curr_local_intents,
+                            curr_local_intents_w_unsure, pred_intent) -> Tuple[bool, dict, Params]:
         params.taskgraph.nlu_records.append({"candidate_intents": curr_local_intents_w_unsure, 
                                 "pred_intent": pred_intent, "no_intent": False, "global_intent": False})
         found_pred_in_avil, pred_intent, intent_idx = self._postprocess_intent(pred_intent, curr_local_intents)
         logger.info(f"Local intent predition -> found_pred_in_avil: {found_pred_in_avil}, pred_intent: {pred_intent}")
         if found_pred_in_avil:
             params.taskgraph.intent = pred_intent
-            for edge in self.graph.out_edges(curr_node, data="intent"):
-                if edge[2] == pred_intent:
-                    next_node = edge[1]  # found intent under the current node
-                    break
+            next_node = curr_local_intents[pred_intent][0]["target_node"]  # found intent under the current node
             logger.info(f"curr_node: {next_node}")
             node_info, params = self._get_node(next_node, params, intent=pred_intent)
             if curr_node == self.start_node:
                 params.taskgraph.curr_global_intent = pred_intent
             return True, node_info, params
         return False, {}, params
+
+    def local_intent_prediction(self, curr_node, params: Params, curr_local_intents,
+                                text: str, chat_history_str: str) -> Tuple[bool, dict, Params]:
+        """
+        Do local intent prediction
+        """
+        curr_local_intents_w_unsure = self._local_candidate_intents(curr_local_intents)
+        pred_intent = self.nluapi.execute(text, curr_local_intents_w_unsure, chat_history_str)
+        return self._apply_local_intent(curr_node, params, curr_local_intents, curr_local_intents_w_unsure, pred_intent)
+
+    async def alocal_intent_prediction(self, curr_node, params: Params, curr_local_intents,
+                                       text: str, chat_history_str: str) -> Tuple[bool, dict, Params]:
+        """
+        Async version of local_intent_prediction
+        """
+        curr_local_intents_w_unsure = self._local_candidate_intents(curr_local_intents)
+        pred_intent = await self.nluapi.aexecute(text, curr_local_intents_w_unsure, chat_history_str)
+        return self._apply_local_intent(curr_node, params, curr_local_intents, curr_local_intents_w_unsure, pred_intent)
     
     def handle_unknown_intent(self, curr_node, params: Params) -> Tuple[dict, Params]:
         """
@@ -352,7 +414,7 @@ class TaskGraph(TaskGraphBase):
             resource_id = "planner",
             resource_name = "planner",
             can_skipped=False,
-            is_leaf=len(list(self.graph.successors(curr_node))) == 0,
+            is_leaf=self.is_leaf(curr_node),
             attributes = {"value": "", "direct": False}
         )
         return node_info, params
@@ -362,8 +424,7 @@ class TaskGraph(TaskGraphBase):
         if leaf node, first check if it's in a nested graph
         if not in nested graph, check if we have flow stack
         '''
-        def is_leaf(node):
-            return len(list(self.graph.successors(node))) == 0
+        is_leaf = self.is_leaf
         
         # if not leaf, return directly current node
         if not is_leaf(curr_node):
@@ -386,15 +447,11 @@ class TaskGraph(TaskGraphBase):
         
         return curr_node, params
 
-    def get_node(self, inputs):
+    def _prepare_node(self, params: Params):
         """
-        Get the next node
+        Resolve the current node before any intent prediction
+        Return the node directly if the current node is a multi-step node
         """
-        self.text = inputs["text"]
-        self.chat_history_str = inputs["chat_history_str"]
-        params: Params = inputs["parameters"]
-        # boolean to check if we allow global intent switch or not.
-        allow_global_intent_switch = inputs["allow_global_intent_switch"]
         params.taskgraph.nlu_records = []
 
         curr_node, params = self.get_current_node(params)
@@ -403,11 +460,10 @@ class TaskGraph(TaskGraphBase):
         # For the multi-step nodes, directly stay at that node instead of moving to other nodes
         is_multi_step_node, node_output, params = self.handle_multi_step_node(curr_node, params)
         if is_multi_step_node:
-            return node_output, params
+            return node_output, params, None, None, None
         
         curr_node, params = self.handle_leaf_node(curr_node, params)
         
-        
         # store current node
         params.taskgraph.curr_node = curr_node
         logger.info(f"curr_node: {curr_node}")
@@ -420,19 +476,12 @@ class TaskGraph(TaskGraphBase):
 
         # Get local intents of the curr_node
         curr_local_intents = self.get_local_intent(curr_node, params)
+        return None, params, curr_node, available_global_intents, curr_local_intents
 
-        if not curr_local_intents and allow_global_intent_switch:  # no local intent under the current node
-            logger.info(f"no local intent under the current node")
-            is_global_intent_found, _, node_output, params = \
-                self.global_intent_prediction(
-                    curr_node,
-                    params,
-                    available_global_intents,
-                    {}
-                )
-            if is_global_intent_found:
-                return node_output, params
-
+    def _handle_no_local_intent(self, curr_node, params: Params, curr_local_intents):
+        """
+        Handle the current node after the first global intent prediction and before the local intent prediction
+        """
         # if current node is incompleted -> return current node
         is_incomplete_node, node_output, params = self.handle_incomplete_node(curr_node, params)
         if is_incomplete_node:
@@ -444,9 +493,52 @@ class TaskGraph(TaskGraphBase):
             has_random_next_node, node_output, params = self.handle_random_next_node(curr_node, params)
             if has_random_next_node:
                 return node_output, params
+        return None, params
+
+    def _handle_no_intent_found(self, curr_node, params: Params, pred_intent):
+        """
+        Handle the current node when neither the local nor the global intent prediction moved the dialog
+        """
+        if pred_intent and pred_intent != self.unsure_intent.get("intent"): # if not unsure intent
+            # If user didn't indicate all the intent of children nodes under the current node, 
+            # then we could randomly choose one of Nones to continue the dialog flow
+            has_random_next_node, node_output, params = self.handle_random_next_node(curr_node, params)
+            if has_random_next_node:
+                return node_output, params
+            
+        # if none of the available intents can represent user's utterance or it is an unsure intents,
+        # transfer to the planner to let it decide for the next step
+        node_output, params = self.handle_unknown_intent(curr_node, params)
+        return node_output, params
+
+    def get_node(self, inputs):
+        """
+        Get the next node
+        The per-turn inputs are only passed down as arguments so that one TaskGraph can serve concurrent requests
+        """
+        text = inputs["text"]
+        chat_history_str = inputs["chat_history_str"]
+        params: Params = inputs["parameters"]
+        # boolean to check if we allow global intent switch or not.
+        allow_global_intent_switch = inputs["allow_global_intent_switch"]
+
+        node_output, params, curr_node, available_global_intents, curr_local_intents = self._prepare_node(params)
+        if node_output is not None:
+            return node_output, params
+
+        if not curr_local_intents and allow_global_intent_switch:  # no local intent under the current node
+            logger.info(f"no local intent under the current node")
+            is_global_intent_found, _, node_output, params = \
+                self.global_intent_prediction(curr_node, params, available_global_intents, {}, text, chat_history_str)
+            if is_global_intent_found:
+                return node_output, params
+
+        node_output, params = self._handle_no_local_intent(curr_node, params, curr_local_intents)
+        if node_output is not None:
+            return node_output, params
 
         logger.info("Finish global condition, start local intent prediction")
-        is_local_intent_found, node_output, params = self.local_intent_prediction(curr_node, params, curr_local_intents)
+        is_local_intent_found, node_output, params = self.local_intent_prediction(curr_node, params, curr_local_intents, text, chat_history_str)
         if is_local_intent_found:
             return node_output, params
         
@@ -457,21 +549,57 @@ class TaskGraph(TaskGraphBase):
                         curr_node,
                         params,
                         available_global_intents,
-                        {**curr_local_intents, **{"none": None}}
+                        {**curr_local_intents, **{"none": None}},
+                        text,
+                        chat_history_str
                     )
             if is_global_intent_found: 
                 return node_output, params
-        if pred_intent and pred_intent != self.unsure_intent.get("intent"): # if not unsure intent
-            # If user didn't indicate all the intent of children nodes under the current node, 
-            # then we could randomly choose one of Nones to continue the dialog flow
-            has_random_next_node, node_output, params = self.handle_random_next_node(curr_node, params)
-            if has_random_next_node:
+        return self._handle_no_intent_found(curr_node, params, pred_intent)
+
+    async def aget_node(self, inputs):
+        """
+        Async version of get_node, the intent predictions are awaited instead of blocking the event loop
+        """
+        text = inputs["text"]
+        chat_history_str = inputs["chat_history_str"]
+        params: Params = inputs["parameters"]
+        allow_global_intent_switch = inputs["allow_global_intent_switch"]
+
+        node_output, params, curr_node, available_global_intents, curr_local_intents = self._prepare_node(params)
+        if node_output is not None:
+            return node_output, params
+
+        if not curr_local_intents and allow_global_intent_switch:
+            logger.info(f"no local intent under the current node")
+            is_global_intent_found, _, node_output, params = \
+                await self.aglobal_intent_prediction(curr_node, params, available_global_intents, {}, text, chat_history_str)
+            if is_global_intent_found:
                 return node_output, params
-            
-        # if none of the available intents can represent user's utterance or it is an unsure intents,
-        # transfer to the planner to let it decide for the next step
-        node_output, params = self.handle_unknown_intent(curr_node, params)
-        return node_output, params
+
+        node_output, params = self._handle_no_local_intent(curr_node, params, curr_local_intents)
+        if node_output is not None:
+            return node_output, params
+
+        logger.info("Finish global condition, start local intent prediction")
+        is_local_intent_found, node_output, params = await self.alocal_intent_prediction(curr_node, params, curr_local_intents, text, chat_history_str)
+        if is_local_intent_found:
+            return node_output, params
+        
+        pred_intent = None
+        if allow_global_intent_switch:
+            is_global_intent_found, pred_intent, node_output, params = \
+                    await self.aglobal_intent_prediction(
+                        curr_node,
+                        params,
+                        available_global_intents,
+                        {**curr_local_intents, **{"none": None}},
+                        text,
+                        chat_history_str
+                    )
+            if is_global_intent_found: 
+                return node_output, params
+        return self._handle_no_intent_found(curr_node, params, pred_intent)
         
 
     def postprocess_node(self, node) -> Tuple[NodeInfo, Params]:
@@ -486,4 +614,18 @@ class TaskGraph(TaskGraphBase):
             )
         params.taskgraph.dialog_states = dialog_states
 
-        return node_info, params
\ No newline at end of file
+        return node_info, params
+
+    async def apostprocess_node(self, node) -> Tuple[NodeInfo, Params]:
+        node_info: NodeInfo = node[0]
+        params: Params = node[1]
+        dialog_states = params.taskgraph.dialog_states
+        # update the dialog states
+        if dialog_states.get(node_info.resource_id):
+            dialog_states = await self.slotfillapi.aexecute(
+                dialog_states.get(node_info.resource_id),
+                format_chat_history(params.memory.function_calling_trajectory)
+            )
+        params.taskgraph.dialog_states = dialog_states
+
+        return node_info, params
@@ -0,0 +1,67 @@
+import os
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from typing import Iterator, List, Sequence, Tuple
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from arklex.utils.utils import get_encoding
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_ENCODING = "cl100k_base"
+# processes splitting the documents, 1 splits them in the calling process
+CHUNK_WORKERS = int(os.getenv("CHUNK_WORKERS", os.cpu_count() or 1))
+# below this many characters in total the documents are split in the calling process, the pool costs more
+CHUNK_PARALLEL_MIN_CHARS = int(os.getenv("CHUNK_PARALLEL_MIN_CHARS", 1000000))
+
+_chunk_pool = None
+_chunk_pool_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def get_text_splitter(encoding_name: str, chunk_size: int, chunk_overlap: int) -> RecursiveCharacterTextSplitter:
+    """Splitters are cached per process, so each worker builds its tiktoken encoding once."""
+    return RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        encoding_name=encoding_name, chunk_size=chunk_size, chunk_overlap=chunk_overlap
+    )
+
+
+def split_text(text: str, encoding_name: str = DEFAULT_CHUNK_ENCODING, chunk_size: int = 200,
+               chunk_overlap: int = 40, strip: bool = False) -> List[Tuple[str, int]]:
+    """Chunks of text with their number of tokens."""
+    splitter = get_text_splitter(encoding_name, chunk_size, chunk_overlap)
+    encoding = get_encoding(encoding_name)
+    chunks = splitter.split_text(text.strip() if strip else text)
+    if strip:
+        chunks = [chunk.strip() for chunk in chunks]
+    return [(chunk, len(encoding.encode(chunk))) for chunk in chunks]
+
+
+def _get_chunk_pool() -> ProcessPoolExecutor:
+    global _chunk_pool
+    with _chunk_pool_lock:
+        if _chunk_pool is None:
+            _chunk_pool = ProcessPoolExecutor(max_workers=CHUNK_WORKERS)
+        return _chunk_pool
+
+
+def split_texts(texts: Sequence[str], encoding_name: str = DEFAULT_CHUNK_ENCODING, chunk_size: int = 200,
+                chunk_overlap: int = 40, strip: bool = False) -> Iterator[List[Tuple[str, int]]]:
+    """Yield the chunks (with their number of tokens) of each of texts, in order.
+
+    Large inputs are split by CHUNK_WORKERS processes and each text's chunks are yielded as soon as they
+    and the ones before them are ready, so the caller can save or embed them while the rest is split.
+    """
+    split = partial(split_text, encoding_name=encoding_name, chunk_size=chunk_size, chunk_overlap=chunk_overlap, strip=strip)
+    if CHUNK_WORKERS <= 1 or len(texts) < 2 or sum(len(text) for text in texts) < CHUNK_PARALLEL_MIN_CHARS:
+        for text in texts:
+            yield split(text)
+        return
+    logger.info(f"Splitting {len(texts)} documents with {CHUNK_WORKERS} processes")
+    # batches of documents per task to amortize the inter-process round trips
+    batch_size = max(1, min(64, len(texts) // (CHUNK_WORKERS * 4)))
+    yield from _get_chunk_pool().map(split, texts, chunksize=batch_size)
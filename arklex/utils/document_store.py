@@ -0,0 +1,208 @@
+import os
+import json
+import mmap
+import pickle
+import shutil
+import logging
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+
+
+logger = logging.getLogger(__name__)
+
+TEXT_NAME = "text.bin"
+OFFSETS_NAME = "offsets.bin"
+META_NAME = "meta.jsonl"
+IDS_NAME = "ids.txt"
+# text start, text end, metadata start, metadata end of each record
+_COLUMNS = 4
+
+
+def _encode(doc) -> tuple:
+    """(id, text, metadata row) of a CrawledURLObject or a langchain Document."""
+    if isinstance(doc, Document):
+        doc_id = doc.metadata.get("chunk_id") or getattr(doc, "id", None)
+        return doc_id, doc.page_content, {"kind": "document", "id": doc_id, "metadata": doc.metadata}
+    row = {
+        "kind": "crawled",
+        "id": doc.id,
+        "url": doc.url,
+        "metadata": doc.metadata,
+        "is_chunk": doc.is_chunk,
+        "is_error": doc.is_error,
+        "error_message": doc.error_message,
+        "links": getattr(doc, "links", None),
+        "has_content": doc.content is not None,
+    }
+    return doc.id, doc.content or "", row
+
+
+def _decode(text: str, row: dict):
+    if row["kind"] == "document":
+        return Document(page_content=text, metadata=row["metadata"])
+    from arklex.utils.loader import CrawledURLObject
+    return CrawledURLObject(
+        id=row["id"],
+        url=row["url"],
+        content=text if row["has_content"] else None,
+        metadata=row["metadata"],
+        is_chunk=row["is_chunk"],
+        is_error=row["is_error"],
+        error_message=row["error_message"],
+        links=row["links"],
+    )
+
+
+class DocumentStore:
+    """Crawled pages or chunks stored column-wise in a directory, readable without loading the corpus.
+
+    text.bin holds the UTF-8 texts back to back and meta.jsonl one JSON metadata row per record, both
+    memory-mapped. offsets.bin is the int64 array of the byte ranges of each record in the two files,
+    and ids.txt the id of each record (the chunk id for chunks), so records are read in O(1) by position
+    or id. Unlike pickles, opening a store never executes code from the files.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._ids: Optional[Dict[str, int]] = None
+        self._open()
+
+    def _open(self):
+        self._offsets = self._map_offsets()
+        self._text = self._map(TEXT_NAME)
+        self._meta = self._map(META_NAME)
+
+    def _map(self, name: str):
+        with open(os.path.join(self.path, name), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _map_offsets(self) -> np.ndarray:
+        file_path = os.path.join(self.path, OFFSETS_NAME)
+        num_records = os.path.getsize(file_path) // (_COLUMNS * 8)
+        if not num_records:
+            return np.zeros((0, _COLUMNS), dtype="<i8")
+        return np.memmap(file_path, dtype="<i8", mode="r", shape=(num_records, _COLUMNS))
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return all(os.path.exists(os.path.join(path, name)) for name in (TEXT_NAME, OFFSETS_NAME, META_NAME, IDS_NAME))
+
+    @classmethod
+    def write(cls, path: str, docs: Iterable) -> "DocumentStore":
+        """Write docs to a new store at path, replacing the store already there once it is complete."""
+        tmp_path = path.rstrip("/") + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for name in (TEXT_NAME, OFFSETS_NAME, META_NAME, IDS_NAME):
+            open(os.path.join(tmp_path, name), "wb").close()
+        cls._append_files(tmp_path, docs)
+        if os.path.exists(path):
+            old_path = path.rstrip("/") + ".old"
+            os.replace(path, old_path)
+            os.replace(tmp_path, path)
+            shutil.rmtree(old_path, ignore_errors=True)
+        else:
+            os.replace(tmp_path, path)
+        return cls(path)
+
+    @staticmethod
+    def _append_files(path: str, docs: Iterable) -> int:
+        with open(os.path.join(path, TEXT_NAME), "ab") as text_file, \
+                open(os.path.join(path, META_NAME), "ab") as meta_file, \
+                open(os.path.join(path, OFFSETS_NAME), "ab") as offsets_file, \
+                open(os.path.join(path, IDS_NAME), "a", encoding="utf-8") as ids_file:
+            text_pos, meta_pos = text_file.tell(), meta_file.tell()
+            count = 0
+            for doc in docs:
+                doc_id, text, row = _encode(doc)
+                text_bytes = text.encode("utf-8")
+                meta_bytes = (json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8")
+                text_file.write(text_bytes)
+                meta_file.write(meta_bytes)
+                offsets_file.write(np.array(
+                    [text_pos, text_pos + len(text_bytes), meta_pos, meta_pos + len(meta_bytes)], dtype="<i8"
+                ).tobytes())
+                ids_file.write(f"{doc_id}\n")
+                text_pos += len(text_bytes)
+                meta_pos += len(meta_bytes)
+                count += 1
+        return count
+
+    def append(self, docs: Iterable) -> int:
+        """Add docs at the end of the store, returns the number of records added."""
+        self.close()
+        count = self._append_files(self.path, docs)
+        self._ids = None
+        self._open()
+        return count
+
+    def close(self):
+        for mapped in (self._text, self._meta):
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+        self._offsets = None
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def text(self, position: int) -> str:
+        start, end = self._offsets[position][:2]
+        return self._text[start:end].decode("utf-8")
+
+    def __getitem__(self, position: int):
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError(f"record {position} out of range")
+        text_start, text_end, meta_start, meta_end = self._offsets[position]
+        row = json.loads(self._meta[meta_start:meta_end])
+        return _decode(self._text[text_start:text_end].decode("utf-8"), row)
+
+    def __iter__(self) -> Iterator:
+        for position in range(len(self)):
+            yield self[position]
+
+    def position(self, doc_id: str) -> Optional[int]:
+        if self._ids is None:
+            with open(os.path.join(self.path, IDS_NAME), encoding="utf-8") as f:
+                self._ids = {line.rstrip("\n"): position for position, line in enumerate(f)}
+        return self._ids.get(doc_id)
+
+    def get(self, doc_id: str):
+        """The record with id doc_id (its chunk id for chunks), None if there is none."""
+        position = self.position(doc_id)
+        return None if position is None else self[position]
+
+    def get_text(self, doc_id: str) -> Optional[str]:
+        position = self.position(doc_id)
+        return None if position is None else self.text(position)
+
+
+def store_path(file_path: str) -> str:
+    """Path of the document store replacing the pickle file_path (documents.pkl -> documents)."""
+    return file_path[:-len(".pkl")] if file_path.endswith(".pkl") else file_path
+
+
+def documents_exist(file_path: str) -> bool:
+    return DocumentStore.exists(store_path(file_path)) or os.path.exists(store_path(file_path) + ".pkl")
+
+
+def load_documents(file_path: str) -> List:
+    """The records of the store at file_path, or of the pickle written there by older versions.
+
+    The store is read lazily; a legacy pickle is loaded whole, so only load pickles you created.
+    """
+    path = store_path(file_path)
+    if DocumentStore.exists(path):
+        return DocumentStore(path)
+    legacy_path = path + ".pkl"
+    logger.warning(f"Loading legacy pickle {legacy_path}, it is converted to a document store the next time it is saved")
+    with open(legacy_path, "rb") as f:
+        return pickle.load(f)
+
+
+def save_documents(file_path: str, docs: Iterable) -> DocumentStore:
+    return DocumentStore.write(store_path(file_path), docs)
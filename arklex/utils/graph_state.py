@@ -2,6 +2,7 @@ from typing import Any, Optional, List, Dict
 from pydantic import BaseModel, Field
 from enum import Enum
 import uuid
+import zlib
 from arklex.utils.slot import Slot
 
 ### Bot-related classes
@@ -16,6 +17,8 @@ class BotConfig(BaseModel):
 class ConvoMessage(BaseModel):
     history: str # it could be the whole original message or the summarization of the previous conversation from memory module
     message: str
+    # the messages behind history, used to truncate the history at message boundaries in the prompts
+    turns: List[Dict[str, Any]] = Field(default_factory=list)
 
 
 class OrchestratorMessage(BaseModel):
@@ -95,12 +98,24 @@ class Taskgraph(BaseModel):
 class Memory(BaseModel):
     trajectory: List[List[ResourceRecord]] = Field(default_factory=list)
     function_calling_trajectory: List[Dict[str, Any]] = Field(default_factory=list)
+    # rolling summary of the user turns that are no longer kept verbatim, see arklex.memory.summary
+    summary: str = ""
+    # number of user turns covered by the summary
+    summarized_upto: int = 0
     
 class Params(BaseModel):
     metadata: Metadata = Field(default_factory=Metadata)
     taskgraph: Taskgraph = Field(default_factory=Taskgraph)
     memory: Memory = Field(default_factory=Memory)
 
+    def encode(self) -> bytes:
+        """Compact binary encoding: zlib-compressed JSON, used to keep sessions server side."""
+        return zlib.compress(self.model_dump_json().encode("utf-8"))
+
+    @classmethod
+    def decode(cls, data: bytes) -> "Params":
+        return cls.model_validate_json(zlib.decompress(data))
+
 class NodeTypeEnum(str, Enum):
     NONE = ""
     START = "start"
@@ -1,21 +1,30 @@
+import asyncio
+import hashlib
 import logging
-import time
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List
+from typing import Dict, Iterator, List, Optional
+from urllib.parse import urlparse
+import httpx
 import requests
-import pickle
 import uuid
 import argparse
 import os
 
 from webdriver_manager.chrome import ChromeDriverManager
 from selenium import webdriver
+from selenium.webdriver.support.ui import WebDriverWait
 from bs4 import BeautifulSoup
 from urllib.parse import urljoin
-import networkx as nx
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import numpy as np
+from scipy import sparse
 from langchain_core.documents import Document
 
+from arklex.utils.document_store import save_documents
+from arklex.utils.chunking import split_texts
+
 
 # Configure logging
 logging.basicConfig(
@@ -27,6 +36,95 @@ logger = logging.getLogger(__name__)
 
 CHROME_DRIVER_VERSION = "125.0.6422.7"
 
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.0.3 Safari/605.1.15'
+}
+# pages fetched at the same time, in total and per host
+CRAWL_CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", 32))
+CRAWL_PER_HOST_CONCURRENCY = int(os.getenv("CRAWL_PER_HOST_CONCURRENCY", 8))
+CRAWL_TIMEOUT = float(os.getenv("CRAWL_TIMEOUT", 10))
+# headless browsers used for the pages that need JavaScript
+CRAWL_BROWSERS = int(os.getenv("CRAWL_BROWSERS", 2))
+# a page whose static HTML has less text than this is rendered in a browser
+JS_RENDER_MIN_TEXT = int(os.getenv("JS_RENDER_MIN_TEXT", 200))
+
+class PageFetchError(Exception):
+    """A page answered with a status other than 200."""
+    def __init__(self, url: str, status_code: int):
+        self.status_code = status_code
+        super().__init__(f"Failed to retrieve page {url}, status code: {status_code}")
+
+
+def _run_sync(coro):
+    """Run coro to completion from synchronous code. asyncio.run cannot be called from a thread with a
+    running event loop (e.g. inside a FastAPI handler or a notebook), the coroutine then runs in a
+    separate thread with its own loop; async callers should await the a* methods instead."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+
+def chunk_id(url: str, idx: int) -> str:
+    """Deterministic id of the idx-th chunk of a page, used as its id in the vector index."""
+    return f"{hashlib.sha256(url.encode('utf-8')).hexdigest()[:16]}_{idx}"
+
+
+def pagerank(num_nodes: int, edges, alpha: float = 0.85, max_iter: int = 100, tol: float = 1.0e-6) -> np.ndarray:
+    """PageRank of a directed graph given as (source, target) node positions, by power iteration on a
+    sparse matrix. Same conventions as networkx.pagerank: uniform teleport, and the rank of the nodes
+    without out links is spread over all the nodes."""
+    if not num_nodes:
+        return np.zeros(0)
+    edges = list(edges)
+    rows = np.fromiter((source for source, _ in edges), dtype=np.int64, count=len(edges))
+    cols = np.fromiter((target for _, target in edges), dtype=np.int64, count=len(edges))
+    matrix = sparse.csr_matrix((np.ones(len(edges)), (rows, cols)), shape=(num_nodes, num_nodes))
+    out_degree = np.asarray(matrix.sum(axis=1)).ravel()
+    inv_degree = np.divide(1.0, out_degree, out=np.zeros(num_nodes), where=out_degree != 0)
+    transition = sparse.diags(inv_degree) @ matrix
+    dangling = out_degree == 0
+
+    scores = np.full(num_nodes, 1.0 / num_nodes)
+    for _ in range(max_iter):
+        previous = scores
+        scores = alpha * (previous @ transition + previous[dangling].sum() / num_nodes) + (1 - alpha) / num_nodes
+        if np.abs(scores - previous).sum() < num_nodes * tol:
+            break
+    else:
+        logger.warning(f"pagerank did not converge in {max_iter} iterations")
+    return scores
+
+
+class UrlMatcher:
+    """Finds which of a set of urls occur in a text, in a single pass over the occurrences of their first
+    characters instead of one substring search per url."""
+    def __init__(self, urls):
+        self.urls = set(urls)
+        self.anchor_len = min((len(url) for url in self.urls), default=0)
+        self.anchor_len = min(self.anchor_len, 8)
+        # anchor -> lengths of the urls starting with it
+        self.lengths: Dict[str, set] = defaultdict(set)
+        for url in self.urls:
+            self.lengths[url[:self.anchor_len]].add(len(url))
+
+    def find(self, text: str) -> set:
+        found = set()
+        if not text or not self.anchor_len:
+            return found
+        for anchor, lengths in self.lengths.items():
+            start = text.find(anchor)
+            while start != -1:
+                for length in lengths:
+                    candidate = text[start:start + length]
+                    if candidate in self.urls:
+                        found.add(candidate)
+                start = text.find(anchor, start + 1)
+        return found
+
+
 class URLObject:
     def __init__(self, id: str, url: str):
         self.id = id
@@ -43,6 +141,7 @@ class CrawledURLObject(URLObject):
         is_chunk=False,
         is_error=False,
         error_message=None,
+        links=None,
     ):
         super().__init__(id, url)
         self.content = content
@@ -50,19 +149,31 @@ class CrawledURLObject(URLObject):
         self.is_chunk = is_chunk
         self.is_error = is_error
         self.error_message = error_message
+        # urls the page links to, None for pages crawled before links were recorded
+        self.links = links
 
 
-class Loader:
+class _CrawlLimits:
+    """Concurrency limits of one crawl: CRAWL_CONCURRENCY requests in total and CRAWL_PER_HOST_CONCURRENCY per host."""
     def __init__(self):
-        pass
+        self.total = asyncio.Semaphore(CRAWL_CONCURRENCY)
+        self._hosts: Dict[str, asyncio.Semaphore] = defaultdict(lambda: asyncio.Semaphore(CRAWL_PER_HOST_CONCURRENCY))
 
-    def to_crawled_obj(self, url_list: List[str]):    
-        url_objs = [URLObject(str(uuid.uuid4()), url) for url in url_list]
-        crawled_url_objs = self.crawl_urls(url_objs)
-        return crawled_url_objs
+    def for_host(self, url: str) -> asyncio.Semaphore:
+        return self._hosts[urlparse(url).netloc]
 
-    def crawl_urls(self, url_objects: list[URLObject]) -> List[CrawledURLObject]:
-        logger.info(f"Start crawling {len(url_objects)} urls")
+
+class BrowserPool:
+    """Headless Chrome instances started on first use, shared by the threads rendering pages."""
+    def __init__(self, size: int = CRAWL_BROWSERS, page_load_timeout: float = 30):
+        self.size = size
+        self.page_load_timeout = page_load_timeout
+        self._drivers = []
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._available = threading.Semaphore(size)
+
+    def _create_driver(self):
         options = webdriver.ChromeOptions()
         options.add_argument("--no-sandbox")
         options.add_argument("--headless")
@@ -75,98 +186,260 @@ class Loader:
         options.binary_location = str(chrome_driver_path.parent.absolute())
         logger.info(f"chrome binary location: {options.binary_location}")
         driver = webdriver.Chrome(options=options)
+        driver.set_page_load_timeout(self.page_load_timeout)
+        return driver
 
-        docs: List[CrawledURLObject] = []
-        for url_obj in url_objects:
+    def render(self, url: str) -> str:
+        with self._available:
+            with self._lock:
+                driver = self._idle.popleft() if self._idle else None
+            if driver is None:
+                driver = self._create_driver()
+                with self._lock:
+                    self._drivers.append(driver)
             try:
-                logger.info(f"loading url: {url_obj.url}")
-                driver.get(url_obj.url)
-                time.sleep(2)
-                html = driver.page_source
-                soup = BeautifulSoup(html, "html.parser")
-
-                text_list = []
-                for string in soup.strings:        
-                    if string.find_parent("a"):
-                        href = urljoin(url_obj.url, string.find_parent("a").get("href"))
-                        if href.startswith(url_obj.url):
-                            text = f"{string} {href}"
-                            text_list.append(text)
-                    elif string.strip():
-                        text_list.append(string)
-                text_output = "\n".join(text_list)
-                
-                title = url_obj.url
-                for title in soup.find_all("title"):
-                    title = title.get_text()
-                    break
-
-                docs.append(
-                    CrawledURLObject(
-                        id=url_obj.id,
-                        url=url_obj.url,
-                        content=text_output,
-                        metadata={"title": title, "source": url_obj.url},
-                    )
+                driver.get(url)
+                # wait for the document to be loaded instead of a fixed sleep
+                WebDriverWait(driver, self.page_load_timeout).until(
+                    lambda d: d.execute_script("return document.readyState") == "complete"
                 )
+                page_source = driver.page_source
+            except Exception:
+                # a timed out or crashed browser may still be loading the page, it is not reused
+                self._discard(driver)
+                raise
+            with self._lock:
+                self._idle.append(driver)
+            return page_source
+
+    def _discard(self, driver):
+        with self._lock:
+            if driver in self._drivers:
+                self._drivers.remove(driver)
+        try:
+            driver.quit()
+        except Exception as err:
+            logger.error(f"Fail to close the browser: {err}")
+
+    def close(self):
+        with self._lock:
+            for driver in self._drivers:
+                try:
+                    driver.quit()
+                except Exception as err:
+                    logger.error(f"Fail to close the browser: {err}")
+            self._drivers = []
+            self._idle.clear()
+
+
+class Loader:
+    def __init__(self):
+        # html of the pages fetched by get_all_urls, reused by crawl_urls
+        self._pages: Dict[str, str] = {}
+        # ETag and Last-Modified of the fetched pages, for conditional requests on the next refresh
+        self.validators: Dict[str, dict] = {}
+
+    def to_crawled_obj(self, url_list: List[str]):    
+        url_objs = [URLObject(str(uuid.uuid4()), url) for url in url_list]
+        crawled_url_objs = self.crawl_urls(url_objs)
+        return crawled_url_objs
+
+    def crawl_urls(self, url_objects: list[URLObject]) -> List[CrawledURLObject]:
+        return _run_sync(self.acrawl_urls(url_objects))
+
+    async def acrawl_urls(self, url_objects: list[URLObject]) -> List[CrawledURLObject]:
+        """Crawl the pages concurrently from their static HTML, rendering in a headless browser only
+        the pages whose static HTML has (almost) no text, i.e. the ones built by JavaScript."""
+        logger.info(f"Start crawling {len(url_objects)} urls")
+        limits = _CrawlLimits()
+        browsers = BrowserPool(CRAWL_BROWSERS)
+        try:
+            async with httpx.AsyncClient(headers=HEADERS, timeout=CRAWL_TIMEOUT, follow_redirects=True) as client:
+                docs = await asyncio.gather(*[
+                    self._crawl_url(client, limits, browsers, url_obj) for url_obj in url_objects
+                ])
+        finally:
+            browsers.close()
+        return list(docs)
 
+    async def _crawl_url(self, client: httpx.AsyncClient, limits: "_CrawlLimits", browsers: "BrowserPool",
+                         url_obj: URLObject) -> CrawledURLObject:
+        try:
+            logger.info(f"loading url: {url_obj.url}")
+            # pages fetched while discovering the urls are not downloaded again
+            html = self._pages.pop(url_obj.url, None)
+            if html is None:
+                # raises PageFetchError for a non-200 answer, which is never rendered
+                html = await self._fetch(client, limits, url_obj.url)
+            text_output, title, links = await asyncio.to_thread(self._parse_page, url_obj.url, html)
+            if len(text_output) < JS_RENDER_MIN_TEXT:
+                logger.info(f"rendering url with JavaScript: {url_obj.url}")
+                html = await asyncio.to_thread(browsers.render, url_obj.url)
+                text_output, title, links = await asyncio.to_thread(self._parse_page, url_obj.url, html)
+            return CrawledURLObject(
+                id=url_obj.id,
+                url=url_obj.url,
+                content=text_output,
+                metadata={"title": title, "source": url_obj.url},
+                links=links,
+            )
+        except Exception as err:
+            logger.info(f"error crawling {url_obj}")
+            logger.error(err)
+            return CrawledURLObject(
+                id=url_obj.id,
+                url=url_obj.url,
+                content=None,
+                metadata={"title": url_obj.url, "source": url_obj.url},
+                is_error=True,
+                error_message=str(err),
+            )
+
+    @staticmethod
+    def _parse_page(url: str, html: str):
+        """Visible text of the page, links to sub pages kept next to their anchor text, its title and
+        the urls of all its links."""
+        soup = BeautifulSoup(html, "html.parser")
+
+        links = set()
+        for link in soup.find_all("a", href=True):
+            links.add(urljoin(url, link.get("href")).split("#")[0].rstrip("/"))
+
+        text_list = []
+        for string in soup.strings:        
+            if string.find_parent("a"):
+                href = urljoin(url, string.find_parent("a").get("href"))
+                if href.startswith(url):
+                    text = f"{string} {href}"
+                    text_list.append(text)
+            elif string.strip():
+                text_list.append(string)
+        text_output = "\n".join(text_list)
+        
+        title = url
+        for title in soup.find_all("title"):
+            title = title.get_text()
+            break
+        return text_output, title, sorted(links)
+
+    async def _fetch(self, client: httpx.AsyncClient, limits: "_CrawlLimits", url: str) -> str:
+        async with limits.total, limits.for_host(url):
+            response = await client.get(url)
+        if response.status_code != 200:
+            raise PageFetchError(url, response.status_code)
+        self.validators[url] = {
+            "etag": response.headers.get("etag"),
+            "last_modified": response.headers.get("last-modified"),
+        }
+        return response.text
+
+    def refresh_urls(self, url_objects: List[URLObject], validators: Dict[str, dict]) -> Dict[str, Optional[CrawledURLObject]]:
+        return _run_sync(self.arefresh_urls(url_objects, validators))
+
+    async def arefresh_urls(self, url_objects: List[URLObject], validators: Dict[str, dict]) -> Dict[str, Optional[CrawledURLObject]]:
+        """Re-fetch known pages with conditional requests built from their validators (url -> etag, last_modified).
+
+        Returns url -> the newly crawled page, None when the page no longer exists (404 or 410). Pages that
+        were not modified (304) or could not be fetched are left out.
+        """
+        limits = _CrawlLimits()
+        browsers = BrowserPool(CRAWL_BROWSERS)
+        results = {}
+
+        async def refresh(client: httpx.AsyncClient, url_obj: URLObject):
+            headers = {}
+            validator = validators.get(url_obj.url) or {}
+            if validator.get("etag"):
+                headers["If-None-Match"] = validator["etag"]
+            if validator.get("last_modified"):
+                headers["If-Modified-Since"] = validator["last_modified"]
+            try:
+                async with limits.total, limits.for_host(url_obj.url):
+                    response = await client.get(url_obj.url, headers=headers)
             except Exception as err:
-                logger.info(f"error crawling {url_obj}")
-                logger.error(err)
-                docs.append(
-                    CrawledURLObject(
-                        id=url_obj.id,
-                        url=url_obj.url,
-                        content=None,
-                        metadata={"title": url_obj.url, "source": url_obj.url},
-                        is_error=True,
-                        error_message=str(err),
-                    )
-                )
-        driver.quit()
-        return docs
+                logger.error(f"Fail to get the page from {url_obj.url}: {err}")
+                return
+            if response.status_code == 304:
+                return
+            if response.status_code in (404, 410):
+                logger.info(f"Page removed: {url_obj.url}")
+                results[url_obj.url] = None
+                return
+            if response.status_code != 200:
+                logger.error(f"Failed to retrieve page {url_obj.url}, status code: {response.status_code}")
+                return
+            self.validators[url_obj.url] = {
+                "etag": response.headers.get("etag"),
+                "last_modified": response.headers.get("last-modified"),
+            }
+            self._pages[url_obj.url] = response.text
+            results[url_obj.url] = await self._crawl_url(client, limits, browsers, url_obj)
+
+        try:
+            async with httpx.AsyncClient(headers=HEADERS, timeout=CRAWL_TIMEOUT, follow_redirects=True) as client:
+                await asyncio.gather(*[refresh(client, url_obj) for url_obj in url_objects])
+        finally:
+            browsers.close()
+        return results
 
     def get_all_urls(self, base_url: str, max_num: int) -> List[str]:
+        return _run_sync(self.aget_all_urls(base_url, max_num))
+
+    async def aget_all_urls(self, base_url: str, max_num: int) -> List[str]:
+        """Breadth first discovery of the pages under base_url, fetching each level of the frontier concurrently."""
         logger.info(f"Getting all pages for base url: {base_url}, maximum number is: {max_num}")
-        urls_visited = []
         base_url = base_url.split("#")[0].rstrip("/")
-        urls_to_visit = [base_url]
-        
-        while urls_to_visit:
-            if len(urls_visited) >= max_num:
-                break
-            current_url = urls_to_visit.pop(0)
-            if current_url not in urls_visited:
-                urls_visited.append(current_url)
-                new_urls = self.get_outsource_urls(current_url, base_url)
-                urls_to_visit.extend(new_urls)
-                urls_to_visit = list(set(urls_to_visit))
+        urls_visited = []
+        seen = {base_url}
+        urls_to_visit = deque([base_url])
+        limits = _CrawlLimits()
+        async with httpx.AsyncClient(headers=HEADERS, timeout=CRAWL_TIMEOUT, follow_redirects=True) as client:
+            while urls_to_visit and len(urls_visited) < max_num:
+                batch = [urls_to_visit.popleft() for _ in range(min(len(urls_to_visit), max_num - len(urls_visited)))]
+                urls_visited.extend(batch)
+                results = await asyncio.gather(*[self._discover(client, limits, url, base_url) for url in batch])
+                for new_urls in results:
+                    for url in new_urls:
+                        if url not in seen:
+                            seen.add(url)
+                            urls_to_visit.append(url)
         logger.info(f"URLs visited: {urls_visited}")
         return sorted(urls_visited[:max_num])
-    
+
+    async def _discover(self, client: httpx.AsyncClient, limits: "_CrawlLimits", curr_url: str, base_url: str) -> List[str]:
+        try:
+            html = await self._fetch(client, limits, curr_url)
+        except Exception as err:
+            logger.error(f"Fail to get the page from {curr_url}: {err}")
+            return []
+        self._pages[curr_url] = html
+        return await asyncio.to_thread(self._extract_urls, html, curr_url, base_url)
+
     def get_outsource_urls(self, curr_url: str, base_url: str):
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.0.3 Safari/605.1.15'
-        } 
         new_urls = list()
         try:
-            response = requests.get(curr_url, headers=headers, timeout=10)
+            response = requests.get(curr_url, headers=HEADERS, timeout=10)
             # Check if the request was successful
             if response.status_code == 200:
-                soup = BeautifulSoup(response.text, 'html.parser')
-                for link in soup.find_all("a"):
-                    try:
-                        full_url = urljoin(curr_url, link.get("href"))
-                        full_url = full_url.split("#")[0].rstrip("/")
-                        if self._check_url(full_url, base_url):
-                            new_urls.append(full_url)
-                    except Exception as err:
-                        logger.error(f"Fail to process sub-url {link.get('href')}: {err}")
+                new_urls = self._extract_urls(response.text, curr_url, base_url)
             else:
                 logger.error(f"Failed to retrieve page {curr_url}, status code: {response.status_code}")
         except Exception as err:
             logger.error(f"Fail to get the page from {curr_url}: {err}")
-        return list(set(new_urls))
+        return new_urls
+
+    def _extract_urls(self, html: str, curr_url: str, base_url: str) -> List[str]:
+        new_urls = set()
+        soup = BeautifulSoup(html, 'html.parser')
+        for link in soup.find_all("a"):
+            try:
+                full_url = urljoin(curr_url, link.get("href"))
+                full_url = full_url.split("#")[0].rstrip("/")
+                if self._check_url(full_url, base_url):
+                    new_urls.add(full_url)
+            except Exception as err:
+                logger.error(f"Fail to process sub-url {link.get('href')}: {err}")
+        return list(new_urls)
     
     def _check_url(self, full_url, base_url):
         kw_list = ['.pdf', '.jpg', '.png', '.docx', '.xlsx', '.pptx', '.zip', ".jpeg"]
@@ -174,70 +447,53 @@ class Loader:
             return True
         return False
 
-    def get_candidates_websites(self, urls: List[CrawledURLObject], top_k: int) -> List[str]:
-        """Based on the pagerank algorithm of the crawled websites, return the top 10 websites. 
-        The reason why we can do that is because we have the hreqs of the including <a> tags in the content of the website.
-        So we can use that to construct the edges and then use the tool from networkx to get the pagerank of the websites.
+    def get_candidates_websites(self, urls: List[CrawledURLObject], top_k: int) -> List[dict]:
+        """Return the top_k crawled websites ranked by the pagerank of the graph of links between them.
+
+        The edges are the links recorded at crawl time. Pages from older pickles have no recorded links,
+        for them a link is any crawled url appearing in the content (which keeps the hrefs of the <a> tags).
         """
-        
-        nodes = []
-        edges = []
-        url_to_id_mapping = {}
-        for url in urls:
-            url_to_id_mapping[url.url] = url.id
-
-        for url in urls:
-            if url.is_error:
-                continue
-            for url_key in url_to_id_mapping:
-                if url_key in url.content:
-                    edge = [url.id, url_to_id_mapping[url_key]]
-                    edges.append(edge)
-
-            node = [url.id, {"url": url.url, "content": url.content, "metadata": url.metadata}]
-            nodes.append(node)
-        
-        self.graph = nx.DiGraph(name="website graph")
-        self.graph.add_nodes_from(nodes)
-        self.graph.add_edges_from(edges)
-        pr = nx.pagerank(self.graph, alpha=0.9)
-        # sort the pagerank values in descending order
-        sorted_pr = sorted(pr.items(), key=lambda x: x[1], reverse=True)
-        logger.info(f"pagerank results: {sorted_pr}")
-        # get the top websites
-        top_k_websites = sorted_pr[:top_k]
-        urls_candidates = [self.graph.nodes[url_id] for url_id, _ in top_k_websites]
-        urls_cleaned = [doc for doc in urls_candidates if doc]
-        return urls_cleaned
-    
+        pages = [url for url in urls if not url.is_error]
+        if not pages:
+            return []
+        position = {url.url.split("#")[0].rstrip("/"): i for i, url in enumerate(pages)}
+        matcher = None
+        edges = set()
+        for i, url in enumerate(pages):
+            links = getattr(url, "links", None)
+            if links is None:
+                matcher = matcher or UrlMatcher(position)
+                links = matcher.find(url.content)
+            edges.update((i, position[link]) for link in links if link in position)
+
+        scores = pagerank(len(pages), edges, alpha=0.9)
+        ranked = np.argsort(-scores, kind="stable")[:top_k]
+        logger.info(f"pagerank results: {[(pages[i].url, float(scores[i])) for i in ranked]}")
+        return [{"url": pages[i].url, "content": pages[i].content, "metadata": pages[i].metadata} for i in ranked]
+
     @staticmethod
     def save(file_path: str, docs: List[CrawledURLObject]):
-        with open(file_path, "wb") as f:
-            pickle.dump(docs, f)
+        save_documents(file_path, docs)
     
     @classmethod
-    def chunk(cls, url_objs: List[CrawledURLObject]) -> List[CrawledURLObject]:
-        text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(encoding_name="cl100k_base", chunk_size=200, chunk_overlap=40)
-        docs = []
-        langchain_docs = []
+    def chunk(cls, url_objs: List[CrawledURLObject]) -> List[Document]:
+        return list(cls.iter_chunks(url_objs))
+
+    @classmethod
+    def iter_chunks(cls, url_objs: List[CrawledURLObject]) -> Iterator[Document]:
+        """Yield the chunks of the crawled pages as they are split, with their number of tokens in the metadata."""
+        pages = []
         for url_obj in url_objs:
             if url_obj.is_error or url_obj.content is None:
                 logger.info(f"Skip url: {url_obj.url} because of error or no content")
-                continue
             elif url_obj.is_chunk:
                 logger.info(f"Skip url: {url_obj.url} because it has been chunked")
-                docs.append(url_obj)
-                continue
-            splitted_text = text_splitter.split_text(url_obj.content)
-            for i, txt in enumerate(splitted_text):
-                doc = CrawledURLObject(
-                    id=url_obj.id+"_"+str(i),
-                    url=url_obj.url,
-                    content=txt,
-                    metadata=url_obj.metadata,
-                    is_chunk=True,
+            else:
+                pages.append(url_obj)
+        chunked_pages = split_texts([url_obj.content for url_obj in pages], chunk_size=200, chunk_overlap=40)
+        for url_obj, chunks in zip(pages, chunked_pages):
+            for i, (txt, num_tokens) in enumerate(chunks):
+                yield Document(
+                    page_content=txt,
+                    metadata={"source": url_obj.url, "chunk_id": chunk_id(url_obj.url, i), "num_tokens": num_tokens},
                 )
-                docs.append(doc)
-                langchain_docs.append(Document(page_content=txt, metadata={"source": url_obj.url}))
-        return langchain_docs
-
@@ -2,9 +2,10 @@ from abc import ABC
 from abc import abstractmethod
 import pickle
 
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
 
+from arklex.utils.chunking import split_texts
+
 class Loader(ABC):
     def __init__(self):
         pass
@@ -20,12 +21,9 @@ class Loader(ABC):
 
     @abstractmethod
     def chunk(self, document_objs):
-        text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(encoding_name="cl100k_base", chunk_size=200, chunk_overlap=40)
-        docs = []
         langchain_docs = []
-        for doc in document_objs:
-            splitted_text = text_splitter.split_text(doc.content)
-            for i, txt in enumerate(splitted_text):
-                docs.append(doc)
-                langchain_docs.append(Document(page_content=txt, metadata={"source": doc.title}))
+        chunked_docs = split_texts([doc.content for doc in document_objs], chunk_size=200, chunk_overlap=40)
+        for doc, chunks in zip(document_objs, chunked_docs):
+            for txt, num_tokens in chunks:
+                langchain_docs.append(Document(page_content=txt, metadata={"source": doc.title, "num_tokens": num_tokens}))
         return langchain_docs
\ No newline at end of file
@@ -3,7 +3,7 @@ import json
 import shopify
 
 from arklex.utils.loaders.base import Loader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from arklex.utils.chunking import split_texts
 from langchain_core.documents import Document
 
 class ShopifyLoader(Loader):
@@ -32,12 +32,9 @@ class ShopifyLoader(Loader):
         return docs
 
     def chunk(self, document_objs):
-        text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(encoding_name="cl100k_base", chunk_size=200, chunk_overlap=40)
-        docs = []
         langchain_docs = []
-        for doc in document_objs:
-            splitted_text = text_splitter.split_text(doc.page_content)
-            for i, txt in enumerate(splitted_text):
-                docs.append(doc)
-                langchain_docs.append(Document(page_content=txt, metadata=doc.metadata))
+        chunked_docs = split_texts([doc.page_content for doc in document_objs], chunk_size=200, chunk_overlap=40)
+        for doc, chunks in zip(document_objs, chunked_docs):
+            for txt, num_tokens in chunks:
+                langchain_docs.append(Document(page_content=txt, metadata={**doc.metadata, "num_tokens": num_tokens}))
         return langchain_docs
\ No newline at end of file
@@ -4,4 +4,13 @@ MODEL = {
     "context": 16000,
     "max_tokens": 4096,
     "tokenizer": "o200k_base"
-}
\ No newline at end of file
+}
+
+NLU_CONFIG = {
+    # number of (utterance, candidate intents) -> intent predictions kept per taskgraph, 0 disables the cache
+    "intent_cache_size": 1024,
+    # classify with the embeddings of the edges' definitions and sample utterances before calling the LLM
+    "embedding_fast_path": False,
+    # minimum cosine similarity for the embedding fast path to skip the LLM
+    "embedding_threshold": 0.95,
+}
@@ -1,3 +1,9 @@
+import os
+import asyncio
+import weakref
+import threading
+
+import httpx
 from langchain_openai import ChatOpenAI
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_anthropic import ChatAnthropic
@@ -6,6 +12,8 @@ from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain_huggingface.embeddings import HuggingFaceEmbeddings
 from langchain_huggingface import HuggingFaceEndpoint,ChatHuggingFace
 
+from arklex.utils.model_config import MODEL
+
 
 def get_huggingface_llm(model, **kwargs):
     llm = HuggingFaceEndpoint(
@@ -35,4 +43,113 @@ PROVIDER_EMBEDDING_MODELS = {
     "gemini": "models/embedding-001",
     "openai": "text-embedding-ada-002",
     "huggingface": "sentence-transformers/all-mpnet-base-v2",
-}
\ No newline at end of file
+}
+
+# Connection pool and timeout settings shared by every client handed out by get_llm
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 60))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 100))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", 20))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", 30))
+
+_llm_cache = {}
+_embedding_cache = {}
+_http_clients = {}
+_registry_lock = threading.Lock()
+
+
+class _PerLoopAsyncClient(httpx.AsyncClient):
+    """AsyncClient sending each request through a pooled client of the running event loop.
+
+    The connections of an AsyncClient belong to the loop that opened them, and the shared models outlive
+    any one loop (asyncio.run in scripts, tests and the loader's worker threads), so one client is kept
+    per loop and dropped with it.
+    """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._client_kwargs = kwargs
+        self._clients = weakref.WeakKeyDictionary()
+        self._clients_lock = threading.Lock()
+
+    def _loop_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        with self._clients_lock:
+            client = self._clients.get(loop)
+            if client is None:
+                client = self._clients[loop] = httpx.AsyncClient(**self._client_kwargs)
+            return client
+
+    async def send(self, request, **kwargs):
+        return await self._loop_client().send(request, **kwargs)
+
+
+def _get_http_clients():
+    """Return the keep-alive httpx clients shared by all OpenAI chat models. Must be called with the lock held."""
+    if not _http_clients:
+        limits = httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        )
+        _http_clients["sync"] = httpx.Client(limits=limits, timeout=LLM_TIMEOUT)
+        _http_clients["async"] = _PerLoopAsyncClient(limits=limits, timeout=LLM_TIMEOUT)
+    return _http_clients["sync"], _http_clients["async"]
+
+
+def _create_llm(provider, model, temperature, kwargs):
+    kwargs = {"timeout": LLM_TIMEOUT, **kwargs}
+    if temperature is not None:
+        kwargs["temperature"] = temperature
+    if provider == "openai":
+        http_client, http_async_client = _get_http_clients()
+        kwargs.setdefault("http_client", http_client)
+        kwargs.setdefault("http_async_client", http_async_client)
+    return PROVIDER_MAP.get(provider, ChatOpenAI)(model=model, **kwargs)
+
+
+def get_llm(provider: str = None, model: str = None, temperature: float = None, response_format: str = None, **kwargs):
+    """Return a shared chat model for (provider, model, temperature, response_format).
+
+    Models are created once per process and reused, so every call goes through the same keep-alive
+    connection pool. The returned runnables are safe to share between threads. Extra kwargs are passed
+    to the model constructor and become part of the cache key, so they must be hashable.
+    response_format is "text" or "json" and is only applied to OpenAI models.
+    """
+    provider = provider or MODEL["llm_provider"]
+    model = model or MODEL["model_type_or_path"]
+    if provider != "openai":
+        response_format = None
+    key = (provider, model, temperature, response_format, tuple(sorted(kwargs.items())))
+    llm = _llm_cache.get(key)
+    if llm is not None:
+        return llm
+    with _registry_lock:
+        llm = _llm_cache.get(key)
+        if llm is None:
+            base_key = (provider, model, temperature, None, key[-1])
+            base_llm = _llm_cache.get(base_key)
+            if base_llm is None:
+                base_llm = _create_llm(provider, model, temperature, kwargs)
+                _llm_cache[base_key] = base_llm
+            llm = base_llm
+            if response_format is not None:
+                llm = base_llm.bind(response_format={"type": "json_object"} if response_format == "json" else {"type": "text"})
+            _llm_cache[key] = llm
+    return llm
+
+
+def get_embedding_model(provider: str = None, model: str = None):
+    """Return a shared embedding model for (provider, model)."""
+    provider = provider or MODEL["llm_provider"]
+    model = model or PROVIDER_EMBEDDING_MODELS[provider]
+    key = (provider, model)
+    embedding_model = _embedding_cache.get(key)
+    if embedding_model is not None:
+        return embedding_model
+    with _registry_lock:
+        embedding_model = _embedding_cache.get(key)
+        if embedding_model is None:
+            embedding_model = PROVIDER_EMBEDDINGS.get(provider, OpenAIEmbeddings)(
+                **{ 'model': model } if provider != 'anthropic' else { 'model_name': model }
+            )
+            _embedding_cache[key] = embedding_model
+    return embedding_model
@@ -3,6 +3,7 @@ import string
 import mysql.connector
 import time
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
 
@@ -33,12 +34,23 @@ class MySQLPool(object):
             "password":self._password,
             "database":self._database
         }
-        self.pool = mysql.connector.pooling.MySQLConnectionPool(
-            pool_name="mypool",
-            pool_size=pool_size,
-            pool_reset_session=True,
-            **self.dbconfig
-        )
+        self.pool_size = pool_size
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    @property
+    def pool(self) -> mysql.connector.pooling.MySQLConnectionPool:
+        # connected on first use, so the modules querying MySQL can be imported without a server
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = mysql.connector.pooling.MySQLConnectionPool(
+                        pool_name="mypool",
+                        pool_size=self.pool_size,
+                        pool_reset_session=True,
+                        **self.dbconfig
+                    )
+        return self._pool
     
     def get_connection(self) -> mysql.connector.pooling.PooledMySQLConnection:
         t0 = time.time()
@@ -34,6 +34,11 @@ class Slot(BaseModel):
     verified: bool = Field(default=False)
 
 
+class SlotDetail(Slot):
+    verified_value: str = Field(default="")
+    confirmed: bool = Field(default=False)
+
+
 class SlotInput(BaseModel):
     name: str
     value: Union[str, int, float, bool, List[str], None]
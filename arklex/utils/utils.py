@@ -1,7 +1,11 @@
 import os
 import sys
 import json
+import hashlib
 import logging
+import threading
+import collections
+from functools import lru_cache
 from logging.handlers import RotatingFileHandler
 from arklex.utils.model_config import MODEL
 
@@ -10,6 +14,12 @@ import Levenshtein
 
 logger = logging.getLogger(__name__)
 
+TOKEN_COUNT_CACHE_SIZE = int(os.getenv("TOKEN_COUNT_CACHE_SIZE", 8192))
+
+# token counts keyed by a digest of the text and the tokenizer, so the cache does not hold the texts
+_token_counts = collections.OrderedDict()
+_token_counts_lock = threading.Lock()
+
 
 def init_logger(log_level=logging.INFO, filename=None):
     root_logger = logging.getLogger()  # Root logger
@@ -57,16 +67,107 @@ def init_logger(log_level=logging.INFO, filename=None):
     return logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=None)
+def get_encoding(tokenizer):
+	"""tiktoken encodings are expensive to build, keep one per tokenizer for the whole process."""
+	return tiktoken.get_encoding(tokenizer)
+
+
+def count_tokens(text, tokenizer=MODEL["tokenizer"]):
+	"""Number of tokens of text. The history messages come back on every turn, so the counts are cached."""
+	if not TOKEN_COUNT_CACHE_SIZE:
+		return len(get_encoding(tokenizer).encode(text))
+	key = (hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest(), tokenizer)
+	with _token_counts_lock:
+		num_tokens = _token_counts.get(key)
+		if num_tokens is not None:
+			_token_counts.move_to_end(key)
+			return num_tokens
+	num_tokens = len(get_encoding(tokenizer).encode(text))
+	with _token_counts_lock:
+		_token_counts[key] = num_tokens
+		while len(_token_counts) > TOKEN_COUNT_CACHE_SIZE:
+			_token_counts.popitem(last=False)
+	return num_tokens
+
+
 def chunk_string(text, tokenizer, max_length, from_end=True):
-    # Initialize the tokenizer
-	encoding = tiktoken.get_encoding(tokenizer)
+	if max_length <= 0:
+		return ""
+	# a token covers at least one byte, so a text with no more bytes than max_length is never cut
+	if len(text.encode("utf-8")) <= max_length:
+		return text
+	encoding = get_encoding(tokenizer)
 	tokens = encoding.encode(text)
+	if len(tokens) <= max_length:
+		return text
 	if from_end:
 		chunks = encoding.decode(tokens[-max_length:])
 	else:
 		chunks = encoding.decode(tokens[:max_length])
 	return chunks
 
+
+class TokenBudget:
+	"""Assembles a prompt of at most max_tokens tokens from pieces whose token counts are cached.
+
+	The fixed pieces of the prompt (template, instructions, context) are added first, then
+	fit_history keeps the most recent messages of the chat history that fit in what is left,
+	dropping whole messages instead of cutting the prompt in the middle of one.
+	"""
+	def __init__(self, max_tokens=MODEL["context"], tokenizer=MODEL["tokenizer"]):
+		self.max_tokens = max_tokens
+		self.tokenizer = tokenizer
+		self.used = 0
+
+	@property
+	def remaining(self):
+		return max(self.max_tokens - self.used, 0)
+
+	def add(self, text):
+		num_tokens = count_tokens(text, self.tokenizer)
+		self.used += num_tokens
+		return num_tokens
+
+	def fit_history(self, chat_history):
+		kept = []
+		if self.remaining <= 0:
+			return ""
+		for turn in reversed(chat_history):
+			line = f"{turn['role']}: {turn['content']}"
+			# +1 for the newline joining the messages
+			num_tokens = count_tokens(line, self.tokenizer) + 1
+			if num_tokens > self.remaining:
+				break
+			kept.append(line)
+			self.used += num_tokens
+		if not kept and chat_history:
+			# not even the last message fits, keep its end
+			line = f"{chat_history[-1]['role']}: {chat_history[-1]['content']}"
+			kept.append(chunk_string(line, self.tokenizer, self.remaining))
+			self.used += count_tokens(kept[0], self.tokenizer)
+		return "\n".join(reversed(kept)).strip()
+
+
+def build_prompt(prompt, inputs, chat_history=None, history_key="formatted_chat",
+				 max_tokens=MODEL["context"], tokenizer=MODEL["tokenizer"]):
+	"""Render the PromptTemplate prompt with inputs, filling history_key with the most recent messages of
+	chat_history that fit in max_tokens. Without chat_history the rendered prompt is chunked from the end."""
+	if not chat_history:
+		return chunk_string(prompt.format(**inputs), tokenizer=tokenizer, max_length=max_tokens)
+	budget = TokenBudget(max_tokens, tokenizer)
+	budget.add(prompt.template)
+	for key, value in inputs.items():
+		if key != history_key:
+			budget.add(str(value))
+	inputs = {**inputs, history_key: budget.fit_history(chat_history)}
+	text = prompt.format(**inputs)
+	# the sum of the pieces is cheap, the rendered prompt is only counted when it may be over the budget
+	if budget.used <= max_tokens or count_tokens(text, tokenizer) <= max_tokens:
+		return text
+	# the fixed pieces alone are over the budget
+	return chunk_string(text, tokenizer=tokenizer, max_length=max_tokens)
+
 def normalize(lst):
 		return [float(num)/sum(lst) for num in lst]
 
@@ -109,8 +210,10 @@ def truncate_string(text: str, max_length: int=400):
         text = text[:max_length] + "..."
     return text
 
-def format_chat_history(chat_history):
-    '''Includes current user utterance'''
+def format_chat_history(chat_history, max_tokens=None, tokenizer=MODEL["tokenizer"]):
+    '''Includes current user utterance. With max_tokens, only the most recent messages that fit are kept'''
+    if max_tokens is not None:
+        return TokenBudget(max_tokens, tokenizer).fit_history(chat_history)
     chat_history_str= ""
     for turn in chat_history:
         chat_history_str += f"{turn['role']}: {turn['content']}\n"
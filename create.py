@@ -45,7 +45,7 @@ def init_worker(args):
     if "FaissRAGWorker" in worker_names:
         logger.info("Initializing FaissRAGWorker...")
         # if url: uncomment the following line
-        build_rag(args.output_dir, config["rag_docs"])
+        build_rag(args.output_dir, config["rag_docs"], incremental=args.incremental_rag)
         # if shopify: uncomment the following lines
         # import shopify
         # from arklex.utils.loaders.shopify import ShopifyLoader
@@ -73,6 +73,7 @@ if __name__ == "__main__":
     parser.add_argument( '--llm-provider',type=str,default=MODEL["llm_provider"],choices=LLM_PROVIDERS)
     parser.add_argument('--log-level', type=str, default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"])
     parser.add_argument('--task', type=str, choices=["gen_taskgraph", "init", "all"], default="all")
+    parser.add_argument('--incremental-rag', action="store_true", help="only re-embed the documents that changed since the last build")
     args = parser.parse_args()
     MODEL["model_type_or_path"] = args.model
     MODEL["llm_provider"] = args.llm_provider
@@ -1,50 +1,186 @@
 import os
 import logging
-from typing import Dict
+from typing import Dict, Optional
 import json
 from http import HTTPStatus
 import argparse
+import asyncio
+import uuid
+import traceback
+from functools import lru_cache
+import janus
 import uvicorn
 
 from openai import OpenAI
-from fastapi import FastAPI, Response
+from fastapi import FastAPI, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 
 from arklex.utils.utils import init_logger
-from arklex.env.env import Env
+from arklex.env.env import Env, get_env
 from arklex.orchestrator.orchestrator import AgentOrg
+from arklex.orchestrator.task_graph import TaskGraph
+from arklex.memory import InMemorySessionStore, SQLiteSessionStore
+from arklex.memory.session_store import SESSION_TTL
+from arklex.types import EventType, StreamType
 from arklex.utils.model_config import MODEL
 from arklex.utils.model_provider_config import LLM_PROVIDERS
 
 
 logger = logging.getLogger(__name__)
 app = FastAPI()
+# set SESSION_DB_PATH to keep the sessions in SQLite so that they survive restarts
+session_store = SQLiteSessionStore(os.getenv("SESSION_DB_PATH"), ttl=SESSION_TTL) if os.getenv("SESSION_DB_PATH") else InMemorySessionStore()
+
+
+@lru_cache(maxsize=None)
+def load_task_graph(input_dir: str):
+    """Read taskgraph.json and build the TaskGraph once per input directory."""
+    config = json.load(open(os.path.join(input_dir, "taskgraph.json")))
+    return config, TaskGraph("taskgraph", config)
+
+
+@lru_cache(maxsize=None)
+def load_orchestrator(input_dir: str):
+    """Build the Env and AgentOrg of the taskgraph once, with the process-wide session store."""
+    config, task_graph = load_task_graph(input_dir)
+    env = Env(
+        tools = config.get("tools", []),
+        workers = config.get("workers", []),
+        slotsfillapi = config.get("slotfillapi", "")
+    )
+    return AgentOrg(config=config, env=env, task_graph=task_graph, session_store=session_store)
 
 
 def get_api_bot_response(args, history, user_text, parameters, env):
     data = {"text": user_text, 'chat_history': history, 'parameters': parameters}
-    orchestrator = AgentOrg(config=os.path.join(args.input_dir, "taskgraph.json"), env=env)
+    config, task_graph = load_task_graph(args.input_dir)
+    orchestrator = AgentOrg(config=config, env=env, task_graph=task_graph)
     result = orchestrator.get_response(data)
 
     return result['answer'], result['parameters']
 
 
+async def aget_api_bot_response(args, history, user_text, parameters, env):
+    data = {"text": user_text, 'chat_history': history, 'parameters': parameters}
+    config, task_graph = load_task_graph(args.input_dir)
+    orchestrator = AgentOrg(config=config, env=env, task_graph=task_graph)
+    result = await orchestrator.aget_response(data)
+
+    return result['answer'], result['parameters']
+
+
 @app.post("/eval/chat")
-def predict(data: Dict):
+async def predict(data: Dict):
     history = data['history']
     params = data['parameters']
     workers = data['workers']
     tools = data['tools']
     user_text = history[-1]['content']
 
-    env = Env(
+    env = get_env(
         tools = tools,
         workers = workers,
         slotsfillapi = ""
     )
-    answer, params = get_api_bot_response(args, history[:-1], user_text, params, env)
+    answer, params = await aget_api_bot_response(args, history[:-1], user_text, params, env)
     return {"answer": answer, "parameters": params}
 
 
+@app.post("/chat")
+async def chat(data: Dict):
+    """Session endpoint: the caller only sends the text and the chat_id returned by the first turn."""
+    chat_id = data.get("chat_id") or str(uuid.uuid4())
+    orchestrator = load_orchestrator(args.input_dir)
+    result = await orchestrator.aget_response({"chat_id": chat_id, "text": data["text"]})
+    return {"chat_id": chat_id, "answer": result["answer"], "human_in_the_loop": result["human_in_the_loop"], "choice_list": result["choice_list"]}
+
+
+async def stream_bot_response(orchestrator: AgentOrg, inputs: dict):
+    """Run one turn with streaming and yield its events as they are produced.
+
+    The workers put CHUNK events on the sync side of a janus queue (from the event loop or from the
+    threads running sync workers), and they are read here from the async side. The turn ends with a
+    LAST event carrying the answer and the parameters, or an ERROR event.
+    """
+    queue = janus.Queue()
+    turn = asyncio.create_task(orchestrator.aget_response(inputs, StreamType.TEXT, queue.sync_q))
+
+    def on_turn_done(_):
+        # wake the reader up once the turn is over, whatever the outcome
+        if not queue.closed:
+            queue.sync_q.put_nowait(None)
+
+    turn.add_done_callback(on_turn_done)
+    try:
+        while True:
+            event = await queue.async_q.get()
+            if event is None:
+                break
+            yield event
+        try:
+            result = turn.result()
+            yield {"event": EventType.LAST.value, **result}
+        except Exception as e:
+            logger.error(traceback.format_exc())
+            yield {"event": EventType.ERROR.value, "message": str(e)}
+    finally:
+        if not turn.done():
+            # the client went away, stop generating
+            turn.cancel()
+        queue.close()
+        await queue.wait_closed()
+
+
+async def sse_events(orchestrator: AgentOrg, inputs: dict, extra: Optional[dict] = None):
+    async for event in stream_bot_response(orchestrator, inputs):
+        if event["event"] == EventType.LAST.value:
+            event.update(extra or {})
+        yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+
+
+@app.post("/eval/chat/stream")
+async def predict_stream(data: Dict):
+    """Streaming version of /eval/chat, answered with server-sent events."""
+    history = data['history']
+    user_text = history[-1]['content']
+    env = get_env(
+        tools = data['tools'],
+        workers = data['workers'],
+        slotsfillapi = ""
+    )
+    config, task_graph = load_task_graph(args.input_dir)
+    orchestrator = AgentOrg(config=config, env=env, task_graph=task_graph)
+    inputs = {"text": user_text, 'chat_history': history[:-1], 'parameters': data['parameters']}
+    return StreamingResponse(sse_events(orchestrator, inputs), media_type="text/event-stream")
+
+
+@app.post("/chat/stream")
+async def chat_stream(data: Dict):
+    """Streaming version of /chat, answered with server-sent events."""
+    chat_id = data.get("chat_id") or str(uuid.uuid4())
+    orchestrator = load_orchestrator(args.input_dir)
+    inputs = {"chat_id": chat_id, "text": data["text"]}
+    return StreamingResponse(sse_events(orchestrator, inputs, {"chat_id": chat_id}), media_type="text/event-stream")
+
+
+@app.websocket("/ws/chat")
+async def chat_websocket(websocket: WebSocket):
+    """Session chat over a WebSocket: each {"text", "chat_id"} message is answered with CHUNK frames and a LAST frame."""
+    await websocket.accept()
+    orchestrator = load_orchestrator(args.input_dir)
+    chat_id = str(uuid.uuid4())
+    try:
+        while True:
+            data = await websocket.receive_json()
+            chat_id = data.get("chat_id") or chat_id
+            async for event in stream_bot_response(orchestrator, {"chat_id": chat_id, "text": data["text"]}):
+                if event["event"] == EventType.LAST.value:
+                    event["chat_id"] = chat_id
+                await websocket.send_json(event)
+    except WebSocketDisconnect:
+        logger.info(f"WebSocket of chat {chat_id} disconnected")
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Start FastAPI with custom config.")
     parser.add_argument('--input-dir', type=str, default="./examples/test")
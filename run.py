@@ -20,9 +20,8 @@ def pprint_with_color(data, color_code="\033[34m"):  # Default to blue
     print("\033[0m", end="")  
 
 
-def get_api_bot_response(args, history, user_text, parameters, env):
+def get_api_bot_response(orchestrator: AgentOrg, history, user_text, parameters):
     data = {"text": user_text, 'chat_history': history, 'parameters': parameters}
-    orchestrator = AgentOrg(config=os.path.join(args.input_dir, "taskgraph.json"), env=env)
     result = orchestrator.get_response(data)
 
     return result['answer'], result['parameters'], result['human_in_the_loop']
@@ -48,7 +47,9 @@ if __name__ == "__main__":
         workers = config.get("workers", []),
         slotsfillapi = config["slotfillapi"]
     )
-        
+    # Load the taskgraph once and reuse the orchestrator for every turn
+    orchestrator = AgentOrg(config=config, env=env)
+
     history = []
     params = {}
     user_prefix = "user"
@@ -65,7 +66,7 @@ if __name__ == "__main__":
         if user_text.lower() == "quit":
             break
         start_time = time.time()
-        output, params, hitl = get_api_bot_response(args, history, user_text, params, env)
+        output, params, hitl = get_api_bot_response(orchestrator, history, user_text, params)
         history.append({"role": user_prefix, "content": user_text})
         history.append({"role": worker_prefix, "content": output})
         print(f"getAPIBotResponse Time: {time.time() - start_time}")
@@ -0,0 +1,141 @@
+import hashlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("httpx")
+pytest.importorskip("bs4")
+pytest.importorskip("faiss")
+
+from arklex.env.tools.RAG import build_rag as build_rag_module
+from arklex.env.tools.RAG.build_rag import MANIFEST_NAME, build_rag
+from arklex.utils import loader as loader_module
+from arklex.utils.document_store import load_documents
+from arklex.utils.loader import BrowserPool
+
+
+TEXT = "Static page content that is long enough not to need a browser. " * 10
+
+
+def page(title, *links):
+    anchors = " ".join(f'<a href="{link}">{link}</a>' for link in links)
+    return f"<html><head><title>{title}</title></head><body><p>{title} {TEXT}</p>{anchors}</body></html>"
+
+
+class Site(BaseHTTPRequestHandler):
+    pages = {}
+    # (path, whether the request was conditional) of every GET
+    requests = []
+
+    def do_GET(self):
+        html = self.pages.get(self.path)
+        etag = html and f'"{hashlib.sha256(html.encode()).hexdigest()[:8]}"'
+        Site.requests.append((self.path, "If-None-Match" in self.headers))
+        if html is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = html.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def base_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Site)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def index(monkeypatch):
+    """Calls to the FAISS index, which is not built: the embeddings are not under test."""
+    calls = {"build": [], "update": []}
+
+    def build_index(texts, index_path, embedding_model_name=None):
+        calls["build"].append([doc.metadata["chunk_id"] for doc in texts])
+
+    def update_index(index_path, added, deleted_ids, embedding_model_name=None):
+        calls["update"].append(([doc.metadata["source"] for doc in added], sorted(deleted_ids)))
+
+    executor = build_rag_module.FaissRetrieverExecutor
+    monkeypatch.setattr(executor, "build_index", staticmethod(build_index))
+    monkeypatch.setattr(executor, "update_index", staticmethod(update_index))
+    monkeypatch.setattr(executor, "index_exists", staticmethod(lambda index_path: True))
+    # one chunk per page, without downloading a tokenizer
+    monkeypatch.setattr(loader_module, "split_texts", lambda texts, **kwargs: ([(text, len(text.split()))] for text in texts))
+
+    def render(self, url):
+        raise AssertionError(f"{url} should not need a browser")
+
+    monkeypatch.setattr(BrowserPool, "render", render)
+    return calls
+
+
+def test_update_rag_only_refetches_known_pages_conditionally(base_url, index, tmp_path):
+    Site.pages = {
+        "/shop": page("Shop", "/shop/one", "/shop/two", "/shop/gone"),
+        "/shop/one": page("One"),
+        "/shop/two": page("Two"),
+        "/shop/gone": page("Gone"),
+        "/blog": page("Blog", "/blog/post"),
+        "/blog/post": page("Post"),
+    }
+    shop, blog = f"{base_url}/shop", f"{base_url}/blog"
+    folder = str(tmp_path)
+    build_rag(folder, [{"source": shop, "num": 10}, {"source": blog, "num": 10}], incremental=True)
+    with open(tmp_path / MANIFEST_NAME) as f:
+        manifest = json.load(f)
+    assert set(manifest["pages"]) == {shop, f"{shop}/one", f"{shop}/two", f"{shop}/gone", blog, f"{blog}/post"}
+    # every page was downloaded once, the html fetched while exploring is reused for the crawl
+    assert sorted(path for path, _ in Site.requests) == sorted(Site.pages)
+
+    # /shop/two changes and links to a new page, /shop/gone is deleted and the blog is no longer a source
+    Site.pages["/shop/two"] = page("Two, updated", "/shop/new")
+    Site.pages["/shop/new"] = page("New")
+    del Site.pages["/shop/gone"]
+    Site.requests = []
+    build_rag(folder, [{"source": shop, "num": 10}], incremental=True)
+
+    # the known pages of the kept source are requested once, conditionally; the new page once
+    assert sorted(Site.requests) == sorted([
+        ("/shop", True), ("/shop/one", True), ("/shop/two", True), ("/shop/gone", True), ("/shop/new", False),
+    ])
+    assert index["update"] == [(
+        [f"{shop}/two", f"{shop}/new"],
+        sorted(chunk_id for url in [f"{shop}/two", f"{shop}/gone", blog, f"{blog}/post"]
+               for chunk_id in manifest["pages"][url]["chunk_ids"]),
+    )]
+
+    with open(tmp_path / MANIFEST_NAME) as f:
+        updated = json.load(f)
+    assert set(updated["pages"]) == {shop, f"{shop}/one", f"{shop}/two", f"{shop}/new"}
+    assert updated["pages"][f"{shop}/one"] == manifest["pages"][f"{shop}/one"]
+    assert updated["pages"][f"{shop}/two"]["hash"] != manifest["pages"][f"{shop}/two"]["hash"]
+    documents = {doc.url: doc for doc in load_documents(str(tmp_path / "documents"))}
+    assert set(documents) == set(updated["pages"])
+    assert "Two, updated" in documents[f"{shop}/two"].content
+    chunks = load_documents(str(tmp_path / "chunked_documents"))
+    assert {chunk.metadata["source"] for chunk in chunks} == set(updated["pages"])
+
+    # nothing changed: one 304 per page and no index update
+    Site.requests = []
+    build_rag(folder, [{"source": shop, "num": 10}], incremental=True)
+    assert sorted(Site.requests) == sorted((path, True) for path in ["/shop", "/shop/one", "/shop/two", "/shop/new"])
+    assert len(index["update"]) == 1
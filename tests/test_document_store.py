@@ -0,0 +1,93 @@
+import pickle
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("langchain_core")
+
+from langchain_core.documents import Document
+
+from arklex.utils.document_store import DocumentStore, documents_exist, load_documents, save_documents
+from arklex.utils.loader import CrawledURLObject
+
+
+def crawled(i: int, **kwargs) -> CrawledURLObject:
+    return CrawledURLObject(
+        id=f"page-{i}", url=f"https://example.com/{i}", content=f"Page {i} – ünïcode",
+        metadata={"title": f"Title {i}", "source": f"https://example.com/{i}"}, **kwargs,
+    )
+
+
+def chunk(i: int) -> Document:
+    return Document(page_content=f"chunk {i} text", metadata={"source": "https://example.com", "chunk_id": f"chunk-{i}"})
+
+
+def assert_same_page(actual: CrawledURLObject, expected: CrawledURLObject):
+    assert (actual.id, actual.url, actual.content, actual.metadata, actual.is_chunk, actual.is_error,
+            actual.error_message, actual.links) == \
+        (expected.id, expected.url, expected.content, expected.metadata, expected.is_chunk, expected.is_error,
+         expected.error_message, expected.links)
+
+
+def test_crawled_pages_round_trip(tmp_path):
+    pages = [
+        crawled(0, links=["https://example.com/1"]),
+        crawled(1),
+        CrawledURLObject(id="page-2", url="https://example.com/2", content=None, is_error=True, error_message="HTTP 404"),
+        CrawledURLObject(id="page-3", url="https://example.com/3", content="", links=[]),
+    ]
+    path = str(tmp_path / "documents")
+    save_documents(path, pages)
+
+    store = load_documents(path)
+    assert isinstance(store, DocumentStore) and len(store) == len(pages)
+    for actual, expected in zip(store, pages):
+        assert_same_page(actual, expected)
+    # an error page keeps no content, an empty page keeps an empty one
+    assert store[2].content is None and store[-1].content == ""
+    with pytest.raises(IndexError):
+        store[len(pages)]
+
+
+def test_chunks_are_read_by_chunk_id(tmp_path):
+    chunks = [chunk(i) for i in range(3)]
+    store = DocumentStore.write(str(tmp_path / "chunked_documents"), chunks)
+    assert store.get("chunk-1").page_content == "chunk 1 text"
+    assert store.get("chunk-1").metadata == chunks[1].metadata
+    assert store.get_text("chunk-2") == "chunk 2 text"
+    assert store.position("chunk-0") == 0
+    assert store.get("missing") is None and store.get_text("missing") is None
+
+
+def test_append_and_rewrite(tmp_path):
+    path = str(tmp_path / "chunked_documents")
+    store = DocumentStore.write(path, [chunk(0)])
+    assert store.append([chunk(1), chunk(2)]) == 2
+    assert [doc.page_content for doc in store] == ["chunk 0 text", "chunk 1 text", "chunk 2 text"]
+    assert store.get("chunk-2").page_content == "chunk 2 text"
+
+    store.close()
+    store = DocumentStore.write(path, [chunk(5)])
+    assert [doc.metadata["chunk_id"] for doc in DocumentStore(path)] == ["chunk-5"]
+    assert not (tmp_path / "chunked_documents.tmp").exists()
+
+
+def test_empty_store(tmp_path):
+    store = DocumentStore.write(str(tmp_path / "documents"), [])
+    assert len(store) == 0 and list(store) == [] and store.get("anything") is None
+
+
+def test_legacy_pickle_is_loaded(tmp_path):
+    pages = [crawled(0), crawled(1)]
+    with open(tmp_path / "documents.pkl", "wb") as f:
+        pickle.dump(pages, f)
+
+    assert documents_exist(str(tmp_path / "documents"))
+    loaded = load_documents(str(tmp_path / "documents.pkl"))
+    for actual, expected in zip(loaded, pages):
+        assert_same_page(actual, expected)
+
+    # saving converts the corpus to a store, which is read from then on
+    save_documents(str(tmp_path / "documents.pkl"), loaded)
+    assert DocumentStore.exists(str(tmp_path / "documents"))
+    assert isinstance(load_documents(str(tmp_path / "documents")), DocumentStore)
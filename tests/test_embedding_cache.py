@@ -0,0 +1,63 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("langchain_core")
+
+from arklex.env.tools.RAG.embedding_cache import EmbeddingCache, text_key
+
+
+def vector(i: int, dim: int = 4) -> list:
+    return [float(i)] * dim
+
+
+def test_put_and_get(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "model", capacity=8)
+    cache.put_many(["a", "b"], [vector(1), vector(2)])
+    assert cache.get_many(["a", "b", "c"]) == [vector(1), vector(2), None]
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 1
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "model", capacity=2)
+    cache.put_many(["a", "b"], [vector(1), vector(2)])
+    cache.get_many(["a"])
+    cache.put_many(["c"], [vector(3)])
+    assert cache.get_many(["a", "b", "c"]) == [vector(1), None, vector(3)]
+
+
+def test_stale_entry_removal_does_not_overwrite_live_entries(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "model", capacity=4)
+    cache.put_many(["a", "b", "c"], [vector(1), vector(2), vector(3)])
+    # simulate the row of "a" rewritten by another entry after the index was saved
+    cache._keys[cache._slots[text_key("a")]] = np.frombuffer(bytes.fromhex(text_key("x")), dtype=np.uint8)
+    assert cache.get_many(["a"]) == [None]
+
+    cache.put_many(["d", "e"], [vector(4), vector(5)])
+    assert cache.get_many(["b", "c", "d", "e"]) == [vector(2), vector(3), vector(4), vector(5)]
+
+
+def test_embed_only_calls_the_model_for_missing_texts(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "model", capacity=8)
+    cache.put_many(["a"], [vector(1)])
+    calls = []
+
+    def embed_fn(texts):
+        calls.append(list(texts))
+        return [vector(len(text)) for text in texts]
+
+    assert cache.embed(["a", "bb", "bb"], embed_fn) == [vector(1), vector(2), vector(2)]
+    assert calls == [["bb"]]
+
+
+def test_flushed_entries_are_read_by_another_process_view(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "model", capacity=8)
+    cache.put_many(["a", "b"], [vector(1), vector(2)])
+    cache.flush()
+
+    reader = EmbeddingCache(str(tmp_path), "model", capacity=8)
+    assert reader.get_many(["a", "b"]) == [vector(1), vector(2)]
+    # a row rewritten after the index was saved is detected by its key
+    cache.put_many(["c"], [vector(3)])
+    cache._keys[cache._slots[text_key("b")]] = np.frombuffer(bytes.fromhex(text_key("c")), dtype=np.uint8)
+    cache._keys.flush()
+    assert reader.get_many(["b"]) == [None]
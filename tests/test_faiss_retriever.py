@@ -0,0 +1,56 @@
+import logging
+
+import pytest
+
+pytest.importorskip("faiss")
+pytest.importorskip("langchain_community")
+
+from arklex.env.tools.RAG.retrievers import faiss_retriever
+from arklex.env.tools.RAG.retrievers.faiss_retriever import FaissRetrieverExecutor, RetrieveEngine
+from arklex.utils.document_store import DocumentStore
+from arklex.utils.graph_state import ConvoMessage, MessageState
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    monkeypatch.setattr(faiss_retriever, "_executors", {})
+    monkeypatch.setattr(faiss_retriever, "_executor_locks", {})
+    monkeypatch.setattr(faiss_retriever, "_missing_indexes", set())
+
+
+def missing_index_errors(caplog):
+    return [record for record in caplog.records if record.levelno == logging.ERROR and "No FAISS index" in record.message]
+
+
+def test_a_missing_index_is_reported_once(tmp_path, monkeypatch, caplog):
+    DocumentStore.write(str(tmp_path / "chunked_documents"), [])
+    monkeypatch.setenv("DATA_DIR", str(tmp_path))
+    monkeypatch.setattr(faiss_retriever, "load_prompts", lambda bot_config: {"retrieve_contextualize_q_prompt": ""})
+    monkeypatch.setattr(faiss_retriever, "trace", lambda input, state, name=None: state)
+
+    with caplog.at_level(logging.ERROR):
+        for _ in range(3):
+            state = RetrieveEngine.faiss_retrieve(MessageState(user_message=ConvoMessage(history="user: hi", message="hi")))
+            assert state.message_flow == ""
+        with pytest.raises(FileNotFoundError):
+            FaissRetrieverExecutor.load_docs(str(tmp_path))
+    errors = missing_index_errors(caplog)
+    assert len(errors) == 1 and "build_rag" in errors[0].message and str(tmp_path) in errors[0].message
+
+
+def test_executors_are_shared_per_index_and_embeddings(tmp_path, monkeypatch):
+    created = []
+
+    def init(self, texts, index_path, embedding_model_name="default", retrieval_mode=None):
+        created.append((index_path, embedding_model_name))
+
+    monkeypatch.setattr(FaissRetrieverExecutor, "index_exists", staticmethod(lambda index_path: True))
+    monkeypatch.setattr(FaissRetrieverExecutor, "__init__", init)
+    data_dir = str(tmp_path)
+    executor = FaissRetrieverExecutor.load_docs(data_dir)
+    assert FaissRetrieverExecutor.load_docs(data_dir) is executor
+    assert FaissRetrieverExecutor.load_docs(data_dir, index_path=str(tmp_path / "other")) is not executor
+    assert FaissRetrieverExecutor.load_docs(data_dir, embeddings="other-model") is not executor
+    assert created == [
+        (str(tmp_path / "index"), "default"), (str(tmp_path / "other"), "default"), (str(tmp_path / "index"), "other-model"),
+    ]
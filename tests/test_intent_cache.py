@@ -0,0 +1,70 @@
+import os
+from unittest import mock
+
+import pytest
+
+pytest.importorskip("langchain_core")
+pytest.importorskip("httpx")
+
+# nlu loads .env, whose placeholder values would break the imports of the other test modules
+with mock.patch.dict(os.environ):
+    from arklex.orchestrator.NLU import nlu as nlu_module
+    from arklex.orchestrator.NLU.intent_index import last_assistant_turn
+    from arklex.orchestrator.NLU.nlu import NLU
+
+
+INTENTS = {
+    "track order": [{"target_node": "1", "attribute": {"definition": "the user wants to track an order"}}],
+    "cancel order": [{"target_node": "2", "attribute": {"definition": "the user wants to cancel an order"}}],
+}
+
+
+class FakeModel:
+    def __init__(self, answers):
+        self.answers = answers
+        self.calls = []
+
+    def predict(self, text, intents, chat_history_str, model):
+        self.calls.append(chat_history_str)
+        return self.answers[len(self.calls) - 1]
+
+
+@pytest.fixture
+def model(monkeypatch):
+    def make(*answers):
+        fake = FakeModel(answers)
+        monkeypatch.setattr(nlu_module.nlu_api, "predict", fake.predict)
+        return fake
+    return make
+
+
+def test_last_assistant_turn():
+    history = "user: hi\nassistant: Track it\nor cancel it?\nuser: yes"
+    assert last_assistant_turn(history) == "Track it\nor cancel it?"
+    assert last_assistant_turn("user: my assistant: says hi") == ""
+    assert last_assistant_turn("assistant: hello") == "hello"
+
+
+def test_short_replies_depend_on_the_last_assistant_turn(model):
+    fake = model("track order", "cancel order")
+    nlu = NLU(url=None)
+    track = "user: where is my order\nassistant: Do you want to track it?\nuser: yes"
+    cancel = "user: i ordered twice\nassistant: Do you want to cancel one?\nuser: yes"
+    assert nlu.execute("yes", INTENTS, track) == "track order"
+    assert nlu.execute("yes", INTENTS, cancel) == "cancel order"
+    assert len(fake.calls) == 2
+
+    # the same reply to the same question is served by the cache
+    assert nlu.execute("Yes!", INTENTS, "user: hello\nassistant: Do you want to track it?\nuser: Yes!") == "track order"
+    assert len(fake.calls) == 2 and nlu.get_stats()["cache_hits"] == 1
+
+
+def test_answers_outside_the_candidates_are_not_cached(model):
+    fake = model("others", "i am not sure", "track order")
+    nlu = NLU(url=None)
+    history = "user: where is my parcel"
+    assert nlu.execute("where is my parcel", INTENTS, history) == "others"
+    assert nlu.execute("where is my parcel", INTENTS, history) == "i am not sure"
+    assert nlu.execute("where is my parcel", INTENTS, history) == "track order"
+    assert nlu.execute("where is my parcel", INTENTS, history) == "track order"
+    assert len(fake.calls) == 3
@@ -0,0 +1,142 @@
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("httpx")
+pytest.importorskip("bs4")
+
+from arklex.utils.loader import BrowserPool, Loader, URLObject
+
+
+LONG_TEXT = "Static page content that is long enough not to need a browser. " * 10
+PAGES = {
+    "/": f'<html><head><title>Home</title></head><body><p>{LONG_TEXT}</p>'
+         '<a href="/about">About</a> <a href="/missing">Missing</a> <a href="/app">App</a></body></html>',
+    "/about": f"<html><head><title>About</title></head><body><p>{LONG_TEXT}</p></body></html>",
+    "/app": '<html><head><title>App</title></head><body><div id="root"></div><script src="/app.js"></script></body></html>',
+}
+RENDERED_APP = f"<html><head><title>App</title></head><body><p>Rendered {LONG_TEXT}</p></body></html>"
+ETAG = '"v1"'
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        html = PAGES.get(self.path)
+        if html is None:
+            self.send_response(404)
+            self.end_headers()
+            self.wfile.write(b"<html><body>Not found</body></html>")
+            return
+        if self.headers.get("If-None-Match") == ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = html.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("ETag", ETAG)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def base_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def rendered(monkeypatch):
+    """Urls sent to the headless browser, which returns the rendered app page."""
+    urls = []
+
+    def render(self, url):
+        urls.append(url)
+        return RENDERED_APP
+
+    monkeypatch.setattr(BrowserPool, "render", render)
+    return urls
+
+
+def test_get_all_urls_discovers_linked_pages(base_url):
+    urls = Loader().get_all_urls(base_url, 10)
+    assert urls == sorted([base_url, f"{base_url}/about", f"{base_url}/app", f"{base_url}/missing"])
+
+
+def test_crawl_urls(base_url, rendered):
+    loader = Loader()
+    paths = ["/", "/about", "/missing", "/app"]
+    docs = {doc.url: doc for doc in loader.crawl_urls([URLObject(path, base_url + path) for path in paths])}
+
+    home = docs[base_url + "/"]
+    assert not home.is_error and home.metadata["title"] == "Home"
+    assert f"{base_url}/about" in home.links
+
+    missing = docs[f"{base_url}/missing"]
+    assert missing.is_error and missing.content is None and "404" in missing.error_message
+
+    app = docs[f"{base_url}/app"]
+    assert not app.is_error and "Rendered" in app.content
+    # only the 200 page without text is rendered, never the error page
+    assert rendered == [f"{base_url}/app"]
+
+
+def test_sync_wrappers_inside_a_running_loop(base_url, rendered):
+    async def crawl():
+        return Loader().crawl_urls([URLObject("about", f"{base_url}/about")])
+
+    docs = asyncio.run(crawl())
+    assert len(docs) == 1 and not docs[0].is_error
+
+
+def test_refresh_urls_skips_not_modified_pages(base_url, rendered):
+    loader = Loader()
+    url_objects = [URLObject("about", f"{base_url}/about"), URLObject("missing", f"{base_url}/missing")]
+    refreshed = loader.refresh_urls(url_objects, {f"{base_url}/about": {"etag": ETAG}})
+    assert refreshed == {f"{base_url}/missing": None}
+
+    refreshed = loader.refresh_urls(url_objects[:1], {})
+    assert "Static page content" in refreshed[f"{base_url}/about"].content
+    assert loader.validators[f"{base_url}/about"]["etag"] == ETAG
+
+
+class FakeDriver:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.page_source = "<html></html>"
+        self.quit_called = False
+
+    def get(self, url):
+        if self.fail:
+            raise TimeoutError(f"timed out loading {url}")
+
+    def execute_script(self, script):
+        return "complete"
+
+    def quit(self):
+        self.quit_called = True
+
+
+def test_browser_pool_drops_a_failed_driver(monkeypatch):
+    drivers = [FakeDriver(fail=True), FakeDriver()]
+    created = iter(drivers)
+    pool = BrowserPool(size=1)
+    monkeypatch.setattr(pool, "_create_driver", lambda: next(created))
+    with pytest.raises(TimeoutError):
+        pool.render("https://example.com/slow")
+    assert drivers[0].quit_called and pool._drivers == [] and not pool._idle
+
+    assert pool.render("https://example.com") == "<html></html>"
+    assert pool.render("https://example.com") == "<html></html>"
+    assert pool._drivers == [drivers[1]] and list(pool._idle) == [drivers[1]]
+    assert not drivers[1].quit_called
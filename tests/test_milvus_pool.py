@@ -0,0 +1,110 @@
+import threading
+
+import pytest
+
+pytest.importorskip("pymilvus")
+pytest.importorskip("milvus_lite")
+
+from arklex.env.tools.RAG.retrievers import milvus_retriever
+from arklex.env.tools.RAG.retrievers.milvus_retriever import MilvusClientPool, MilvusRetriever, get_client_pool
+
+
+@pytest.fixture
+def uri(tmp_path):
+    """A Milvus Lite database, local to the test."""
+    return str(tmp_path / "milvus.db")
+
+
+def test_released_clients_are_reused(uri):
+    pool = MilvusClientPool(uri, "", size=2)
+    client = pool.acquire()
+    pool.release(client)
+    assert pool.acquire() is client
+    # the pool is empty again, a new client is opened
+    other = pool.acquire()
+    assert other is not client
+    assert other.list_collections() == []
+    pool.release(client)
+    pool.release(other)
+
+
+def test_clients_above_the_pool_size_are_closed(uri, monkeypatch):
+    pool = MilvusClientPool(uri, "", size=1)
+    closed = []
+    monkeypatch.setattr(MilvusClientPool, "_close", staticmethod(closed.append))
+    first, second = pool.acquire(), pool.acquire()
+    pool.release(first)
+    pool.release(second)
+    assert closed == [second]
+    assert pool.acquire() is first
+
+
+def test_client_released_after_an_error_is_discarded(uri, monkeypatch):
+    closed = []
+    monkeypatch.setattr(MilvusClientPool, "_close", staticmethod(closed.append))
+    with pytest.raises(RuntimeError):
+        with MilvusRetriever(uri, "") as retriever:
+            client = retriever.client
+            raise RuntimeError("broken channel")
+    assert closed == [client]
+
+    with MilvusRetriever(uri, "") as retriever:
+        assert retriever.client is not client
+        kept = retriever.client
+    with MilvusRetriever(uri, "") as retriever:
+        assert retriever.client is kept
+
+
+def test_idle_clients_are_checked_before_reuse(uri, monkeypatch):
+    monkeypatch.setattr(milvus_retriever, "MILVUS_HEALTH_CHECK_INTERVAL", 0)
+    pool = MilvusClientPool(uri, "")
+    healthy = pool.acquire()
+    pool.release(healthy)
+    assert pool.acquire() is healthy
+
+    def list_collections():
+        raise ConnectionError("server went away")
+
+    monkeypatch.setattr(healthy, "list_collections", list_collections)
+    pool.release(healthy)
+    replacement = pool.acquire()
+    assert replacement is not healthy
+    assert replacement.list_collections() == []
+    pool.release(replacement)
+
+
+def test_pools_are_shared_per_server(uri, tmp_path):
+    assert get_client_pool(uri, "") is get_client_pool(uri, "")
+    assert get_client_pool(uri, "") is not get_client_pool(str(tmp_path / "other.db"), "")
+
+
+def test_concurrent_checkouts_never_share_a_client(uri):
+    pool = MilvusClientPool(uri, "", size=3)
+    # Milvus Lite cannot open a database file from several threads at once, the clients are opened first
+    clients = [pool.acquire() for _ in range(3)]
+    for client in clients:
+        pool.release(client)
+    checked_out, errors = set(), []
+    lock = threading.Lock()
+
+    def worker():
+        try:
+            for _ in range(5):
+                client = pool.acquire()
+                with lock:
+                    assert client not in checked_out
+                    checked_out.add(client)
+                client.list_collections()
+                with lock:
+                    checked_out.discard(client)
+                pool.release(client)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert {client for client, _ in pool._idle} == set(clients)
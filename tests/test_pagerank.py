@@ -0,0 +1,99 @@
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+nx = pytest.importorskip("networkx")
+pytest.importorskip("scipy")
+pytest.importorskip("bs4")
+
+from arklex.utils.loader import CrawledURLObject, Loader, UrlMatcher, pagerank
+
+
+def random_edges(num_nodes: int, num_edges: int, seed: int) -> set:
+    rng = random.Random(seed)
+    # self loops included, and the last nodes have no out links
+    return {(rng.randrange(num_nodes - 3), rng.randrange(num_nodes)) for _ in range(num_edges)}
+
+
+@pytest.mark.parametrize("alpha", [0.85, 0.9])
+def test_pagerank_matches_networkx(alpha):
+    num_nodes = 40
+    edges = random_edges(num_nodes, 120, seed=7)
+    graph = nx.DiGraph()
+    graph.add_nodes_from(range(num_nodes))
+    graph.add_edges_from(edges)
+    expected = nx.pagerank(graph, alpha=alpha)
+
+    scores = pagerank(num_nodes, edges, alpha=alpha)
+    assert scores.sum() == pytest.approx(1.0)
+    assert np.allclose(scores, [expected[i] for i in range(num_nodes)], atol=1e-6)
+
+
+def test_pagerank_of_a_graph_without_edges_is_uniform():
+    assert np.allclose(pagerank(4, []), [0.25] * 4)
+    assert len(pagerank(0, [])) == 0
+
+
+def test_url_matcher_finds_the_same_urls_as_substring_search():
+    urls = [
+        "https://example.com", "https://example.com/a", "https://example.com/ab", "https://example.com/b/c",
+        "https://docs.example.com/a", "http://example.com/a",
+    ]
+    rng = random.Random(3)
+    words = urls + ["see", "https://", "example.com", "https://example.co", "/a", "\n", "[link]("]
+    matcher = UrlMatcher(urls)
+    for _ in range(200):
+        text = " ".join(rng.choice(words) for _ in range(rng.randrange(12)))
+        assert matcher.find(text) == {url for url in urls if url in text}
+    assert matcher.find("") == set() and UrlMatcher([]).find("https://example.com") == set()
+
+
+def networkx_candidates(urls, top_k):
+    """The ranking of get_candidates_websites before it moved off networkx."""
+    url_to_id_mapping = {url.url: url.id for url in urls}
+    nodes, edges = [], []
+    for url in urls:
+        if url.is_error:
+            continue
+        for url_key in url_to_id_mapping:
+            if url_key in url.content:
+                edges.append([url.id, url_to_id_mapping[url_key]])
+        nodes.append([url.id, {"url": url.url, "content": url.content, "metadata": url.metadata}])
+    graph = nx.DiGraph()
+    graph.add_nodes_from(nodes)
+    graph.add_edges_from(edges)
+    pr = nx.pagerank(graph, alpha=0.9)
+    return [graph.nodes[url_id] for url_id, _ in sorted(pr.items(), key=lambda x: x[1], reverse=True)[:top_k]]
+
+
+def site(num_pages: int, seed: int, with_links: bool):
+    """Pages of a site whose content cites the urls of the pages they link to."""
+    rng = random.Random(seed)
+    # no url is a prefix of another, so the urls found in the content are exactly the links
+    page_urls = [f"https://example.com/page{i:02d}" for i in range(num_pages)]
+    pages = []
+    for i, url in enumerate(page_urls):
+        # a few hubs get most of the links so the ranking has no ties at the top
+        links = sorted({page_urls[min(int(rng.expovariate(0.3)), num_pages - 1)] for _ in range(rng.randrange(1, 6))})
+        content = f"Page {i}\n" + "\n".join(f"[{link[-6:]}]({link})" for link in links)
+        pages.append(CrawledURLObject(str(i), url, content, metadata={"source": url},
+                                      links=links if with_links else None))
+    return pages
+
+
+@pytest.mark.parametrize("with_links", [True, False])
+def test_candidates_match_the_networkx_ranking(with_links):
+    pages = site(30, seed=11, with_links=with_links)
+    expected = networkx_candidates(pages, top_k=5)
+
+    candidates = Loader().get_candidates_websites(pages, top_k=5)
+    assert [candidate["url"] for candidate in candidates] == [node["url"] for node in expected]
+    assert candidates[0] == {"url": expected[0]["url"], "content": expected[0]["content"], "metadata": expected[0]["metadata"]}
+
+
+def test_candidates_skip_error_pages():
+    pages = site(5, seed=2, with_links=True)
+    pages.append(CrawledURLObject("error", "https://example.com/gone", None, is_error=True, error_message="HTTP 404"))
+    candidates = Loader().get_candidates_websites(pages, top_k=10)
+    assert len(candidates) == 5 and "https://example.com/gone" not in {c["url"] for c in candidates}
@@ -0,0 +1,71 @@
+import sqlite3
+
+import pytest
+
+pytest.importorskip("pydantic")
+
+from arklex.memory import session_store as session_store_module
+from arklex.memory import InMemorySessionStore, SQLiteSessionStore
+from arklex.utils.graph_state import Params
+
+
+HISTORY = [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}]
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(session_store_module.time, "time", clock.time)
+    return clock
+
+
+def chat_ids(db_path):
+    with sqlite3.connect(db_path) as conn:
+        return {row[0] for row in conn.execute("SELECT chat_id FROM sessions")}
+
+
+@pytest.mark.parametrize("make_store", [
+    lambda tmp_path: InMemorySessionStore(ttl=100),
+    lambda tmp_path: SQLiteSessionStore(str(tmp_path / "sessions.db"), ttl=100),
+])
+def test_sessions_expire_after_ttl(make_store, tmp_path, clock):
+    store = make_store(tmp_path)
+    store.put("chat", HISTORY, Params())
+    history, params = store.get("chat")
+    assert history == HISTORY and isinstance(params, Params)
+
+    clock.now += 101
+    assert store.get("chat") is None and store.get_dialog_states("chat") is None
+
+
+def test_sqlite_store_deletes_expired_sessions(tmp_path, clock, monkeypatch):
+    monkeypatch.setattr(session_store_module, "SESSION_SWEEP_INTERVAL", 150)
+    db_path = str(tmp_path / "sessions.db")
+    store = SQLiteSessionStore(db_path, ttl=100)
+    for i in range(5):
+        store.put(f"old-{i}", HISTORY, Params())
+    assert len(chat_ids(db_path)) == 5
+
+    clock.now += 151
+    store.put("new", HISTORY, Params())
+    assert chat_ids(db_path) == {"new"}
+
+    # "new" has expired, but the next sweep waits for SESSION_SWEEP_INTERVAL
+    clock.now += 101
+    store.put("newer", HISTORY, Params())
+    assert chat_ids(db_path) == {"new", "newer"}
+    clock.now += 50
+    store.put("newest", HISTORY, Params())
+    assert chat_ids(db_path) == {"newer", "newest"}
+
+
+def test_sqlite_store_uses_the_session_ttl_by_default(tmp_path):
+    assert SQLiteSessionStore(str(tmp_path / "sessions.db")).ttl == session_store_module.SESSION_TTL
@@ -0,0 +1,83 @@
+import pytest
+
+pytest.importorskip("tiktoken")
+pytest.importorskip("langchain_core")
+
+from langchain_core.prompts import PromptTemplate
+
+from arklex.utils import utils
+from arklex.utils.utils import TokenBudget, build_prompt, chunk_string, count_tokens
+
+TOKENIZER = "whitespace"
+
+
+class WhitespaceEncoding:
+    """One token per word, so the expected counts are easy to write down."""
+    def encode(self, text):
+        return text.split()
+
+    def decode(self, tokens):
+        return " ".join(tokens)
+
+
+@pytest.fixture(autouse=True)
+def whitespace_encoding(monkeypatch):
+    get_encoding = utils.get_encoding
+    monkeypatch.setattr(utils, "get_encoding", lambda tokenizer: WhitespaceEncoding() if tokenizer == TOKENIZER else get_encoding(tokenizer))
+
+
+def words(n, word="w"):
+    return " ".join([word] * n)
+
+
+def history(num_turns, turn_words):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": words(turn_words, f"t{i}")} for i in range(num_turns)]
+
+
+PROMPT = PromptTemplate.from_template("{sys_instruct}\n{context}\nConversation:\n{formatted_chat}\nAnswer:")
+
+
+def test_chunk_string_with_no_room_is_empty():
+    assert chunk_string(words(10), TOKENIZER, 0) == ""
+    assert chunk_string(words(10), TOKENIZER, -3) == ""
+    assert chunk_string(words(10), TOKENIZER, 4) == words(4)
+    assert chunk_string("a b c d", TOKENIZER, 2, from_end=False) == "a b"
+
+
+def test_history_keeps_the_most_recent_messages_that_fit():
+    budget = TokenBudget(max_tokens=30, tokenizer=TOKENIZER)
+    budget.add(words(10))
+    # each message is 1 (role) + 5 words, +1 for its newline
+    kept = budget.fit_history(history(6, 5))
+    assert kept.splitlines() == [f"{turn['role']}: {turn['content']}" for turn in history(6, 5)[-2:]]
+    assert budget.used == 24
+
+
+def test_no_history_is_added_once_the_budget_is_used():
+    budget = TokenBudget(max_tokens=10, tokenizer=TOKENIZER)
+    budget.add(words(12))
+    assert budget.fit_history(history(3, 50)) == ""
+    assert budget.used == 12
+
+
+def test_the_end_of_a_message_too_long_for_the_budget_is_kept():
+    budget = TokenBudget(max_tokens=20, tokenizer=TOKENIZER)
+    budget.add(words(5))
+    kept = budget.fit_history(history(1, 100))
+    assert count_tokens(kept, TOKENIZER) == 15 and budget.used == 20
+
+
+def test_prompt_fits_in_the_budget():
+    inputs = {"sys_instruct": words(20, "s"), "context": words(20, "c"), "formatted_chat": ""}
+    text = build_prompt(PROMPT, inputs, history(20, 30), max_tokens=100, tokenizer=TOKENIZER)
+    assert count_tokens(text, TOKENIZER) <= 100
+    # the most recent message is kept whole
+    assert words(30, "t19") in text
+
+
+def test_fixed_pieces_over_the_budget():
+    inputs = {"sys_instruct": words(80, "s"), "context": words(70, "c"), "formatted_chat": ""}
+    text = build_prompt(PROMPT, inputs, history(5, 20), max_tokens=100, tokenizer=TOKENIZER)
+    assert count_tokens(text, TOKENIZER) <= 100
+    # the prompt is cut from the end and no history is squeezed in
+    assert text.endswith("Answer:") and "t4" not in text